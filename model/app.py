@@ -1,51 +1,144 @@
+import asyncio
+import hashlib
 import os
+import threading
 import time
-from charset_normalizer import detect
-import faiss
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from contextlib import aclosing
+from typing import Optional
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
 from llama_cpp import Llama
-from sentence_transformers import SentenceTransformer
-import whisper
-from gtts import gTTS
-from fastapi.responses import FileResponse
-import firebase_admin
-from firebase_admin import credentials, firestore, storage, initialize_app
+import json
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from dotenv import load_dotenv
-from transformers import pipeline
-import pandas as pd
-from langdetect import detect
-from googletrans import Translator
-import onnx
-import onnxruntime as ort
 import numpy as np
 from transformers import AutoTokenizer
-from scipy.special import softmax
+from batching import MicroBatcher
+from onnx_classifier import LazyOnnxClassifier, OnnxTextClassifier, create_session
+from embeddings import EmbeddingService, create_encoder
+from emotions import EMOTION_LABELS, EMOTION_MODEL_NAME
+from faiss_store import FaissIndexManager
+from faq_counters import FaqCounterTable
+from jobs import JobQueue
+from metrics import MetricsMiddleware, metrics_response, record_llm_call, register_stats
+from llm_sessions import LlamaSessionManager, session_key
+from llm_workers import LLM_THREADS, LLM_WORKERS, LlamaWorkerPool
+from conversations import ConversationStore
+from scheduler import DEFAULT_QUEUES, QueueFullError, Scheduler
+from storage_backends import create_storage
+from stage_timing import stages
+from model_registry import ModelRegistry, ModelUnavailableError
+from tts import SentenceSplitter, TextToSpeech, split_sentences
+from translation import TranslationService
+from transcription import WHISPER_TIERS, AudioDecodeError, Transcriber, decode_audio
 
 load_dotenv()
 
-tokenizer = AutoTokenizer.from_pretrained("monologg/bert-base-cased-goemotions-original")
+# Models are loaded lazily on first use or in parallel at startup, and can be
+# disabled per replica (see model_registry.py)
+models = ModelRegistry()
 
-# Load the ONNX model
-onnx_model_path = "./saved_model/model.onnx"  # Path to the saved ONNX model
-session = ort.InferenceSession(onnx_model_path)
+# Load the ONNX model; EMOTION_MODEL_VARIANT picks the fp32 export, the
+# ORT-optimized graph or its INT8 dynamically quantized version
+EMOTION_MODEL_VARIANTS = {
+    "fp32": "./saved_model/model.onnx",
+    "optimized": "./saved_model/model_optimized.onnx",
+    "int8": "./saved_model/model_quantized.onnx",
+}
+
+EMOTION_BATCH_CHUNK_SIZE = int(os.getenv("EMOTION_BATCH_CHUNK_SIZE", "64"))
+
+@models.register("emotion")
+def load_emotion_classifier():
+    tokenizer = AutoTokenizer.from_pretrained(EMOTION_MODEL_NAME, use_fast=True)
+    onnx_model_path = EMOTION_MODEL_VARIANTS[os.getenv("EMOTION_MODEL_VARIANT", "fp32").lower()]
+    session = create_session(onnx_model_path)
+    return OnnxTextClassifier(session, tokenizer, EMOTION_LABELS)
 
 # Initialize FastAPI app
 app = FastAPI()
-translator = Translator()
-# Initialize Firebase
-cred = credentials.Certificate("./firebase-key.json")
-firebase_admin.initialize_app(cred, {
-    'storageBucket': os.getenv("FIREBASE_STORAGE_BUCKET"),
-    'projectId': os.getenv("FIREBASE_PROJECT_ID")
-})
-db = firestore.client()
-bucket = storage.bucket()
+# Per-request timing of the pipeline stages, exported at /metrics (see metrics.py)
+app.add_middleware(MetricsMiddleware)
+
+# Blocking model and I/O calls run on bounded per-type worker pools so the
+# event loop stays free; requests beyond capacity are rejected quickly.
+# The LLM pool gets one slot per llama.cpp worker process
+scheduler = Scheduler(dict(DEFAULT_QUEUES, llm=(LLM_WORKERS, 8 * LLM_WORKERS)))
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request, exc: QueueFullError):
+    retry_after = max(1, int(round(exc.retry_after)))
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(retry_after)},
+        content={
+            "detail": str(exc),
+            "queue": exc.queue,
+            "queue_depth": exc.depth,
+            "estimated_wait_seconds": round(exc.retry_after, 2)
+        }
+    )
+
+@app.exception_handler(AudioDecodeError)
+async def audio_decode_error_handler(request, exc: AudioDecodeError):
+    return JSONResponse(status_code=400, content={"detail": f"Could not decode audio: {exc}"})
+
+@app.exception_handler(ModelUnavailableError)
+async def model_unavailable_handler(request, exc: ModelUnavailableError):
+    return JSONResponse(status_code=503, content={"detail": str(exc), "model": exc.name})
+
+@app.on_event("startup")
+def preload_models():
+    models.preload_in_background()
+
+@app.on_event("shutdown")
+def shutdown_scheduler():
+    scheduler.shutdown()
+
+# Side effects the user does not wait for (FAQ counting, Faiss indexing,
+# storing the user's audio) run after the response, spooled to disk. Handlers
+# register at import; the spool is only opened when the app starts
+jobs = JobQueue()
+
+@app.on_event("startup")
+def start_jobs():
+    jobs.start()
+
+@app.on_event("shutdown")
+def stop_jobs():
+    jobs.close()
+
+def defer(name, *args):
+    """Queue a background job, or run it right away if the job queue is full"""
+    try:
+        jobs.enqueue(name, *args)
+    except QueueFullError as e:
+        print(f"{e}; running {name} inline")
+        jobs.handlers[name](*args)
+# Cached translation and language detection; concurrent translations are
+# batched into one upstream call (see translation.py)
+translations = TranslationService()
+
+@app.on_event("startup")
+def load_language_profiles():
+    translations.load_language_profiles()
+
+# Files and documents: Firebase Storage and Firestore, or local disk and
+# SQLite with STORAGE_BACKEND=local (see storage_backends.py)
+@models.register("storage")
+def load_storage():
+    return create_storage()
+
+def get_storage():
+    return models.get("storage")
 
 # Request Models
 class ChatRequest(BaseModel):
     message: str
     response_type: str
+    user_id: Optional[str] = None
+    chat_id: Optional[str] = None
 
 class AudioRequest(BaseModel):
     audio_url: str
@@ -54,159 +147,414 @@ class AudioRequest(BaseModel):
 
 class ClassificationRequest(BaseModel):
     message: str
-# Load LLaMA Model
-model_path = os.getenv("MODEL_PATH")
-llm = Llama(model_path=model_path, n_ctx=2048, n_threads=8)
-
-# Load Whisper Model for Speech-to-Text
-whisper_model = whisper.load_model("large")
 
-# Maintain chat history
-chat_history = []
+class BatchClassificationRequest(BaseModel):
+    messages: list[str]
 
-# Initialize Sentence Transformer for embeddings
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-
-# Faiss Index Configuration
-FAISS_INDEX_FILE = "faiss_index.index"
+class MentalHealthRequest(BaseModel):
+    message: str
+    top_n: int = 2
+# Load LLaMA Model
+model_path = os.getenv("MODEL_PATH")
+LLM_N_CTX = 2048
+LLM_MAX_TOKENS = 150
+
+@models.register("llm")
+def load_llm():
+    # With LLM_WORKERS > 1 conversations are served concurrently by separate
+    # llama.cpp processes sharing the mmap'd weights (see llm_workers.py)
+    if LLM_WORKERS > 1:
+        return LlamaWorkerPool(model_path, LLM_WORKERS, llama_kwargs={"n_ctx": LLM_N_CTX})
+    llm = Llama(model_path=model_path, n_ctx=LLM_N_CTX, n_threads=LLM_THREADS)
+    # Per-conversation llama.cpp state, so each turn only evaluates its new tokens
+    return LlamaSessionManager(llm)
+
+@app.on_event("shutdown")
+def stop_llm_workers():
+    llm_sessions = models.get_if_loaded("llm")
+    if isinstance(llm_sessions, LlamaWorkerPool):
+        llm_sessions.close()
+
+# Load Whisper Model for Speech-to-Text; other size tiers load on first use
+@models.register("whisper")
+def load_whisper():
+    transcriber = Transcriber()
+    transcriber.model(transcriber.default_tier)
+    return transcriber
+
+def transcribe(audio, tier=None, **kwargs):
+    """Transcribe audio with Whisper, using `tier` or the configured tier selection"""
+    return models.get("whisper").transcribe(audio, tier=tier, **kwargs)
+
+@stages.timed("whisper")
+def transcribe_bytes(data, tier=None, **kwargs):
+    """Decode uploaded audio in memory and transcribe it, without touching disk"""
+    return transcribe(decode_audio(data), tier, **kwargs)
+
+def transcribe_stream(data, tier=None, **kwargs):
+    """Decode uploaded audio in memory and yield its transcription chunk by chunk"""
+    with stages.stage("whisper"):
+        yield from models.get("whisper").stream(decode_audio(data), tier, **kwargs)
+
+def validate_whisper_tier(tier):
+    if tier and tier.lower() not in WHISPER_TIERS:
+        raise HTTPException(status_code=400, detail=f"whisper_tier must be one of {', '.join(WHISPER_TIERS)}.")
+
+def count_tokens(text):
+    """Count tokens with the llama tokenizer (estimated until the LLM is loaded)"""
+    llm_sessions = models.get_if_loaded("llm")
+    if llm_sessions is None:
+        return len(text) // 3 + 1
+    return llm_sessions.count_tokens(text)
+
+def forget_llm_session(key):
+    llm_sessions = models.get_if_loaded("llm")
+    if llm_sessions is not None:
+        llm_sessions.forget(key)
+
+# Maintain chat history per user and chat, bounded to what fits in the context
+conversations = ConversationStore(
+    count_tokens,
+    max_prompt_tokens=LLM_N_CTX - LLM_MAX_TOKENS - 16,
+    on_evict=forget_llm_session
+)
+
+# Sentence embeddings (MiniLM via sentence-transformers or ONNX), cached per
+# normalised text so a question is embedded once for search and promotion
+@models.register("embedding")
+def load_embedding_model():
+    return EmbeddingService(create_encoder())
+
+@stages.timed("embedding")
+def embed_texts(texts):
+    return list(models.get("embedding").encode(texts))
+
+# Concurrent single-text embeddings are encoded together
+embedding_batcher = MicroBatcher(
+    embed_texts,
+    lambda fn, texts: scheduler.run("onnx", fn, texts),
+    max_batch=int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32")),
+    max_wait_ms=float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5"))
+)
+
+async def embed(text):
+    """Embed one text from the cache, or batched with other concurrent requests"""
+    embeddings = models.get_if_loaded("embedding")
+    cached = embeddings.cached(text) if embeddings is not None else None
+    if cached is not None:
+        return cached
+    return await embedding_batcher.submit(text)
+
+# Faiss index is loaded once and kept resident in memory
+@models.register("faiss")
+def load_faiss_index():
+    index = FaissIndexManager(get_storage(), models.get("embedding").dimension)
+    index.load()
+    # Migrate existing Firestore metadata into the local side table on first start
+    if index.metadata.count() == 0:
+        rebuild_faiss_from_firestore(index)
+    return index
+
+@app.on_event("shutdown")
+def persist_faiss_index():
+    faiss_index = models.get_if_loaded("faiss")
+    if faiss_index is not None:
+        faiss_index.close()
+
+# FAQ counters live in memory and are written behind in batches (see faq_counters.py)
+@models.register("faq")
+def load_faq_counters():
+    # Promotion to Faiss (embedding, Firestore write) is its own background job
+    faq_counters = FaqCounterTable(get_storage(), lambda *entry: jobs.enqueue("faiss", *entry))
+    faq_counters.load()
+    return faq_counters
+
+@app.on_event("shutdown")
+def flush_faq_counters():
+    faq_counters = models.get_if_loaded("faq")
+    if faq_counters is not None:
+        faq_counters.close()
+
+# After the Faiss index and FAQ counters have written their last changes
+@app.on_event("shutdown")
+def close_storage():
+    storage = models.get_if_loaded("storage")
+    if storage is not None:
+        storage.close()
 
 def load_frequent_questions():
-    """Load frequently asked questions from Firestore"""
-    faq_ref = db.collection('frequent_questions')
-    faq_docs = faq_ref.stream()
-    
-    questions = {}
-    for doc in faq_docs:
-        questions[doc.id] = doc.to_dict()
-    
-    return questions
+    """Return the frequently asked questions from the in-memory table"""
+    return models.get("faq").all()
 
 def save_frequent_questions(question, data):
     """Save frequently asked question to Firestore"""
-    faq_ref = db.collection('frequent_questions')
-    
-    # Normalize the question to use as document ID
-    doc_id = question.lower().strip()
-    
-    # Update or create the document
-    faq_ref.document(doc_id).set(data)
+    models.get("faq").set(question, data)
 
-def update_frequent_questions(question, response):
+@jobs.register("faq")
+def update_frequent_questions(question, response, language=None):
     """
     Update frequency of asked questions and store in Faiss if asked more than 3 times
     
     Args:
         question (str): The question asked by the user
         response (str): The response generated for the question
+        language (str): Language code of the response
     """
-    # Retrieve existing frequent questions
-    questions = load_frequent_questions()
-    
-    # Normalize the question
-    normalized_question = question.lower().strip()
-    
-    # Update question frequency
-    if normalized_question in questions:
-        current_count = questions[normalized_question].get('count', 0)
-        data = {
-            'count': current_count + 1,
-            'response': response
-        }
-    else:
-        data = {
-            'count': 1,
-            'response': response
-        }
-    
-    # Save to Firestore
-    save_frequent_questions(normalized_question, data)
-    
-    # If a question is asked more than 3 times, add to Faiss
-    if data['count'] > 3:
-        add_to_faiss(normalized_question, response)
-        print(f"Added to Faiss database: {normalized_question}")
-
-def initialize_faiss_index():
-    """Initialize or load Faiss index, potentially using Firebase Storage"""
-    # Try to download index from Firebase Storage if exists
-    try:
-        blob = bucket.blob(FAISS_INDEX_FILE)
-        blob.download_to_filename(FAISS_INDEX_FILE)
-        index = faiss.read_index(FAISS_INDEX_FILE)
-        return index
-    except Exception:
-        # Create new index if no existing index
-        dimension = embedding_model.get_sentence_embedding_dimension()
-        index = faiss.IndexFlatL2(dimension)
-        return index
-
-def add_to_faiss(question, response=None):
-    """Add question to Faiss index and upload to Firebase Storage"""
-    index = initialize_faiss_index()
-    
-    # Generate embedding
-    embedding = embedding_model.encode([question])[0]
-    
-    # Add embedding to index
-    faiss.normalize_L2(embedding.reshape(1, -1))
-    index.add(embedding.reshape(1, -1))
-    
-    # Save index locally
-    faiss.write_index(index, FAISS_INDEX_FILE)
+    # Counted in memory; the Firestore write and the one-time Faiss promotion
+    # are handled by the counter table
+    models.get("faq").record(question, response, language)
+
+def faiss_metadata_id(question):
+    return hashlib.sha1(question.encode("utf-8")).hexdigest()
+
+@jobs.register("faiss")
+def add_to_faiss(question, response=None, language=None):
+    """Add question to the in-memory Faiss index; persistence happens in the background"""
+    if not models.enabled("faiss"):
+        return
+
+    # Generate embedding (usually cached from the searches for this question)
+    embedding = models.get("embedding").encode([question])
     
-    # Upload to Firebase Storage
-    blob = bucket.blob(FAISS_INDEX_FILE)
-    blob.upload_from_filename(FAISS_INDEX_FILE)
+    # Add embedding and its answer to the index and local side table
+    faiss_id = models.get("faiss").add(embedding, question, response, language)
     
-    # Store metadata in Firestore
-    faq_metadata_ref = db.collection('faiss_metadata')
-    faq_metadata_ref.add({
+    # Store metadata in Firestore so the side table can be rebuilt; keyed by
+    # the question so a retried job overwrites its document instead of adding one
+    storage = get_storage()
+    faq_metadata_ref = storage.collection('faiss_metadata').document(faiss_metadata_id(question))
+    faq_metadata_ref.set({
         'question': question,
         'response': response,
-        'timestamp': firestore.SERVER_TIMESTAMP
+        'language': language,
+        'faiss_id': faiss_id,
+        'timestamp': storage.server_timestamp
     })
 
-def search_faiss(query, top_k=1):
-    """Search Faiss index for similar questions"""
-    index = initialize_faiss_index()
-    
-    if index.ntotal == 0:
+def rebuild_faiss_from_firestore(faiss_index=None, batch_size=1024):
+    """Rebuild the Faiss index and its side table from the `faiss_metadata` collection"""
+    faiss_index = faiss_index or models.get("faiss")
+    embedding_model = models.get("embedding")
+    docs = [doc.to_dict() for doc in get_storage().collection('faiss_metadata').stream()]
+    docs = [doc for doc in docs if doc.get('question')]
+
+    entries = []
+    for start in range(0, len(docs), batch_size):
+        batch = docs[start:start + batch_size]
+        # Bypass the cache so a bulk rebuild does not evict live entries
+        embeddings = embedding_model.encode([doc['question'] for doc in batch], cache=False)
+        for doc, embedding in zip(batch, embeddings):
+            entries.append((doc['question'], doc.get('response'), doc.get('language'), embedding))
+
+    faiss_index.rebuild(entries)
+    print(f"Rebuilt Faiss index from Firestore ({len(entries)} entries)")
+    return len(entries)
+
+@stages.timed("faiss")
+def search_faiss(query, top_k=1, query_embedding=None):
+    """Search the in-memory Faiss index and return the cached answer of the nearest question"""
+    if not models.enabled("faiss"):
+        return None
+
+    faiss_index = models.get("faiss")
+    if faiss_index.ntotal == 0:
         return None
     
-    # Generate embedding for query
-    query_embedding = embedding_model.encode([query])[0]
-    faiss.normalize_L2(query_embedding.reshape(1, -1))
+    # Generate embedding for query (L2-normalised, so inner product is cosine)
+    if query_embedding is None:
+        query_embedding = models.get("embedding").encode([query])[0]
+    query_embedding = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
     
     # Search index
-    D, I = index.search(query_embedding.reshape(1, -1), top_k)
+    D, I = faiss_index.search(query_embedding, top_k)
     
-    # If similarity is below a threshold, return None
-    if D[0][0] > 1.0:  # Adjust threshold as needed
+    # If cosine similarity is below the threshold for this index type, return None
+    if I[0][0] < 0 or D[0][0] < faiss_index.min_similarity:
         return None
     
-    # Retrieve metadata from Firestore
-    faq_metadata_ref = db.collection('faiss_metadata')
-    query_ref = faq_metadata_ref.where('question', '==', query).limit(1)
-    docs = query_ref.stream()
-    
-    for doc in docs:
-        return doc.to_dict()
-    
-    return None
+    # Resolve the vector ID against the local side table (no network call)
+    return faiss_index.get_entry(int(I[0][0]))
 
-def generate_llm_response(prompt):
-    """Generate response using LLM"""
-    chat_history.append(f"User: {prompt}\nAssistant:")
-    full_prompt = "\n".join(chat_history)
-    output = llm(full_prompt, max_tokens=150, stop=["User:", "Assistant:"], temperature=0.7)
+async def search_faiss_batched(query):
+    """Search Faiss with the query embedded together with other concurrent requests"""
+    if not models.enabled("faiss"):
+        return None
+    # Nothing can match until the index is loaded and has entries, so skip the encoder pass
+    faiss_index = models.get_if_loaded("faiss")
+    if faiss_index is None or faiss_index.ntotal == 0:
+        return None
+    return await scheduler.run("onnx", search_faiss, query, 1, await embed(query))
+
+@stages.timed("llm")
+def generate_llm_response(prompt, session=None):
+    """Generate response using LLM within the conversation's history and KV cache"""
+    session = session or session_key()
+    llm_sessions = models.get("llm")
+    full_prompt = conversations.build_prompt(session, prompt)
+    start = time.perf_counter()
+    output = llm_sessions(session, full_prompt, max_tokens=LLM_MAX_TOKENS, stop=["User:", "Assistant:"], temperature=0.7)
+    usage = output["usage"]
+    record_llm_call(usage["completion_tokens"], time.perf_counter() - start, usage["prompt_tokens"])
     response = output["choices"][0]["text"].strip()
-    chat_history.append(response)
+    conversations.append(session, prompt, response)
     return response
 
+def stream_llm_response(prompt, session=None):
+    """Yield response text as it is generated; the turn is recorded once the stream ends"""
+    session = session or session_key()
+    llm_sessions = models.get("llm")
+    full_prompt = conversations.build_prompt(session, prompt)
+    pieces = []
+    start = time.perf_counter()
+    with stages.stage("llm"):
+        # llama.cpp streams one token per chunk
+        for chunk in llm_sessions.stream(session, full_prompt, max_tokens=LLM_MAX_TOKENS, stop=["User:", "Assistant:"], temperature=0.7):
+            text = chunk["choices"][0]["text"]
+            if text:
+                pieces.append(text)
+                yield text
+    record_llm_call(len(pieces), time.perf_counter() - start)
+    conversations.append(session, prompt, "".join(pieces).strip())
+
+async def llm_token_stream(prompt, session, reservation=None):
+    """
+    Yield the reply's text as the LLM generates it. The whole generation is
+    one call on the LLM queue, like `generate_llm_response`, so no other
+    request takes the model between two tokens. With a `reservation` already
+    held on the LLM queue, the call runs within it instead of being admitted.
+    """
+    loop = asyncio.get_running_loop()
+    tokens = asyncio.Queue()
+    stop = threading.Event()
+
+    def generate():
+        stream = stream_llm_response(prompt, session)
+        try:
+            for text in stream:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(tokens.put_nowait, text)
+        finally:
+            stream.close()
+
+    generation = asyncio.ensure_future(reservation.run(generate) if reservation else scheduler.run("llm", generate))
+    # Runs after the tokens already handed to the loop
+    generation.add_done_callback(lambda _: tokens.put_nowait(None))
+    try:
+        while True:
+            text = await tokens.get()
+            if text is None:
+                break
+            yield text
+        await generation
+    finally:
+        stop.set()
+
+# Speech is cached on disk by hash of (text, language, voice); repeated
+# replies are neither synthesised nor uploaded again (see tts.py)
+tts = TextToSpeech()
+
+@app.on_event("startup")
+def open_speech_cache():
+    tts.cache.open()
+
+@stages.timed("tts")
+def save_tts_response(text, lang):
+    """Synthesise a text response to speech and return the local audio path"""
+    return tts.path(text, lang)
+
+@stages.timed("tts")
+def tts_response_url(text, lang, prefix=""):
+    """Synthesise a text response to speech and return its public URL"""
+    return tts.url(text, lang, upload_to_storage, prefix)
+
+@stages.timed("tts")
+def tts_joined_file(sentences, lang, prefix=""):
+    """
+    Join the already synthesised sentences of a reply. Returns the cache entry
+    and, unless it was uploaded before, its (data, file name, content type)
+    """
+    entry = tts.joined_entry(sentences, lang)
+    if entry["url"]:
+        return entry, None
+    return entry, (tts.cache.read(entry), prefix + entry["file_name"], entry["content_type"])
+
+@stages.timed("detect")
+def detect(text):
+    """Detect the language of a message (cached)"""
+    return translations.detect_language(text)
+
+translation_batcher = MicroBatcher(
+    stages.timed("translate")(translations.translate_many),
+    lambda fn, items: scheduler.run("io", fn, items),
+    max_batch=int(os.getenv("TRANSLATION_BATCH_MAX_SIZE", "16")),
+    max_wait_ms=float(os.getenv("TRANSLATION_BATCH_MAX_WAIT_MS", "10"))
+)
+
+async def translate(text, src, dest):
+    """Translate from the cache, or batched with other concurrent requests"""
+    cached = translations.cached(text, src, dest)
+    if cached is not None:
+        return cached
+    return await translation_batcher.submit((text, src, dest))
+
+def sse_event(event, data):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.get("/test")
 async def test():
     return {"message": "Model is working"}
 
+@app.get("/health")
+async def health():
+    """Readiness of each model; 503 until every preloaded model is ready"""
+    ready = models.ready()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "loading", "models": models.status()}
+    )
+
+@app.get("/queues")
+async def queue_stats():
+    """Depth and service time of each worker pool"""
+    return scheduler.stats()
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """Sessions and in-flight requests of the LLM (per worker when pooled)"""
+    return llm_stats_snapshot()
+
+def llm_stats_snapshot():
+    llm_sessions = models.get_if_loaded("llm")
+    return llm_sessions.stats() if llm_sessions is not None else None
+
+@app.get("/jobs")
+async def job_stats():
+    """Depth, lag and retry counters of the background jobs"""
+    return jobs.stats()
+
+@app.get("/stages")
+async def stage_stats():
+    """Latency percentiles of each pipeline stage (detect, translate, faiss, llm, tts, ...)"""
+    return stages.summary()
+
+def metrics_snapshot():
+    """The stats exported as Prometheus gauges and counters at each scrape"""
+    return {
+        "caches": cache_stats_snapshot(),
+        "queues": scheduler.stats(),
+        "jobs": jobs.stats(),
+        "models": models.status(),
+        "llm": llm_stats_snapshot(),
+    }
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics: stage and request latency histograms, cache, queue, job, LLM and memory stats"""
+    body, content_type = metrics_response()
+    return Response(body, media_type=content_type)
+
 @app.post("/chat/")
 async def chat(request: ChatRequest):
     user_message = request.message.strip()
@@ -214,52 +562,117 @@ async def chat(request: ChatRequest):
     print(user_message)
 
     # Check Faiss for similar questions first
-    faiss_result = search_faiss(user_message)
+    faiss_result = await search_faiss_batched(user_message)
     if faiss_result:
         print("Request found in Faiss database")
         return {"response": faiss_result['response'] or "I found a similar question in my database."}
 
-    detected_lang = detect(user_message)
+    detected_lang = await scheduler.run("io", detect, user_message)
     print(f"Detected Language: {detected_lang}")
 
     if detected_lang != "en":
-        user_message = translator.translate(user_message, src=detected_lang, dest="en").text
+        user_message = await translate(user_message, detected_lang, "en")
         print(f"Translated to English: {user_message}")
 
     response_type = request.response_type.lower()
 
     # Generate response
-    english_response = generate_llm_response(user_message)
+    english_response = await scheduler.run(
+        "llm", generate_llm_response, user_message, session_key(request.user_id, request.chat_id)
+    )
     final_response = english_response
 
   
 
     if detected_lang != "en":
-        final_response = translator.translate(english_response, src="en", dest=detected_lang).text
+        final_response = await translate(english_response, "en", detected_lang)
         print(f"Translated Back to {detected_lang}: {final_response}")
     
     # Update frequent questions with the generated response
-    update_frequent_questions(faiss_message, final_response)
+    await scheduler.run("io", defer, "faq", faiss_message, final_response, detected_lang)
     
     if response_type == "text":
         return {"response": final_response}
             
-    tts = gTTS(final_response, lang=detected_lang)
-    
-    audio_dir = "audio_responses"
-    os.makedirs(audio_dir, exist_ok=True)  
-    audio_path = os.path.join(audio_dir, "response.mp3")
-    tts.save(audio_path)
+    audio_path = await scheduler.run("io", save_tts_response, final_response, detected_lang)
     
     return {"response": final_response, "audio_url": audio_path}
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Stream the reply to a chat message as server-sent events.
+
+    Events: `token` for each generated piece of English text, `translation`
+    with the reply in the user's language (non-English only), `audio` with the
+    synthesised speech (unless response_type is "text") and a final `done`
+    carrying the complete response.
+    """
+    user_message = request.message.strip()
+    faiss_message = user_message
+    response_type = request.response_type.lower()
+    session = session_key(request.user_id, request.chat_id)
+
+    # LLM capacity is reserved and the stages before generation run on their
+    # pools before the response starts, so overload is still rejected with a 429
+    reservation = scheduler["llm"].reserve()
+    try:
+        faiss_result = await search_faiss_batched(user_message)
+        if faiss_result:
+            reservation.release()
+            print("Request found in Faiss database")
+            response = faiss_result['response'] or "I found a similar question in my database."
+            return StreamingResponse(
+                iter([sse_event("token", {"text": response}), sse_event("done", {"response": response})]),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache"}
+            )
+
+        detected_lang = await scheduler.run("io", detect, user_message)
+        english_message = user_message
+        if detected_lang != "en":
+            english_message = await translate(user_message, detected_lang, "en")
+    except BaseException:
+        reservation.release()
+        raise
+
+    async def events():
+        with reservation:
+            english_response = ""
+            async with aclosing(llm_token_stream(english_message, session, reservation)) as tokens:
+                async for text in tokens:
+                    english_response += text
+                    yield sse_event("token", {"text": text})
+            english_response = english_response.strip()
+
+            final_response = english_response
+            if detected_lang != "en":
+                final_response = await translate(english_response, "en", detected_lang)
+                yield sse_event("translation", {"response": final_response, "language": detected_lang})
+
+            if response_type != "text":
+                audio_path = await scheduler.run("io", save_tts_response, final_response, detected_lang)
+                yield sse_event("audio", {"audio_url": audio_path})
+
+            yield sse_event("done", {"response": final_response})
+
+            # Fill the FAQ/Faiss cache once the client has everything
+            await scheduler.run("io", defer, "faq", faiss_message, final_response, detected_lang)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+        background=BackgroundTask(reservation.release)
+    )
+
 @app.post("/add_frequent_question/")
 async def add_frequent_question(question: str, response: str):
     """Manually add a frequently asked question to Firestore and Faiss"""
-    add_to_faiss(question, response)
+    await scheduler.run("io", add_to_faiss, question, response)
     
     # Update frequent questions in Firestore
-    save_frequent_questions(question, {
+    await scheduler.run("io", save_frequent_questions, question, {
         'count': 5,  # Set to 5 to trigger Faiss addition
         'response': response
     })
@@ -269,138 +682,307 @@ async def add_frequent_question(question: str, response: str):
 @app.get("/frequent_questions/")
 async def get_frequent_questions():
     """Retrieve frequently asked questions from Firestore"""
-    return load_frequent_questions()
+    return await scheduler.run("io", load_frequent_questions)
 
 # Optional: Speech-to-Text endpoint
 @app.post("/transcribe/")
-async def transcribe_audio(audio_file: UploadFile = File(...)):
+async def transcribe_audio(audio_file: UploadFile = File(...), whisper_tier: Optional[str] = Form(None)):
     """Transcribe audio file using Whisper"""
-    # Save uploaded file temporarily
-    with open("temp_audio.mp3", "wb") as buffer:
-        buffer.write(await audio_file.read())
-    
-    # Transcribe audio
-    result = whisper_model.transcribe("temp_audio.mp3")
-    
-    # Optional: Remove temporary file
-    os.remove("temp_audio.mp3")
+    validate_whisper_tier(whisper_tier)
+    # Decoded and transcribed in memory
+    result = await scheduler.run("whisper", transcribe_bytes, await audio_file.read(), whisper_tier)
     
     return {"transcription": result["text"]}
 
+@app.websocket("/transcribe/stream")
+async def transcribe_audio_stream(websocket: WebSocket, whisper_tier: Optional[str] = None):
+    """
+    Streaming transcription of long voice messages.
 
-def upload_to_firebase(file_path, file_name):
-    """Uploads audio file to Firebase Storage and returns URL"""
-    blob = bucket.blob(file_name)
-    blob.upload_from_filename(file_path)
-    blob.make_public()
-    return blob.public_url
-
+    The client sends the recording as one or more binary messages followed by
+    the text message "end". Each transcribed chunk is sent back as a `partial`
+    message as soon as it is ready, then a `done` message carries the full
+    transcription. Failures are sent as an `error` message before closing.
+    """
+    await websocket.accept()
+    if whisper_tier and whisper_tier.lower() not in WHISPER_TIERS:
+        await websocket.send_json({"type": "error", "detail": f"whisper_tier must be one of {', '.join(WHISPER_TIERS)}."})
+        await websocket.close()
+        return
 
-@app.get("/test")
-async def test():
-    return {"message": "Model is working"}
+    try:
+        audio = bytearray()
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes"):
+                audio.extend(message["bytes"])
+            elif message.get("text") == "end":
+                break
+
+        pieces = []
+        language = None
+        chunks = scheduler.stream("whisper", transcribe_stream, bytes(audio), whisper_tier)
+        try:
+            async for chunk in chunks:
+                pieces.append(chunk["text"])
+                language = chunk["language"]
+                await websocket.send_json({"type": "partial", **chunk})
+        finally:
+            await chunks.aclose()
+
+        await websocket.send_json({"type": "done", "transcription": " ".join(pieces), "language": language})
+    except WebSocketDisconnect:
+        return
+    except (QueueFullError, ModelUnavailableError, AudioDecodeError) as e:
+        await websocket.send_json({"type": "error", "detail": str(e)})
+    await websocket.close()
+
+
+@jobs.register("upload")
+@stages.timed("upload")
+def upload_to_storage(data, file_name, content_type="audio/mpeg"):
+    """Uploads in-memory audio bytes as a public file and returns its URL"""
+    return get_storage().upload(data, file_name, content_type)
+
+async def upload_many(files):
+    """Upload [(data, file name, content type), ...] at once on the I/O pool and return their URLs"""
+    storage = await scheduler.run("io", get_storage)
+    return await storage.upload_many_async(files, run=lambda upload, *args: scheduler.run("io", timed_upload, upload, *args))
+
+@stages.timed("upload")
+def timed_upload(upload, *args):
+    return upload(*args)
+
+def upload_after_response(data, file_name, content_type="audio/mpeg"):
+    """Queue an upload and return the public URL the file will have"""
+    defer("upload", data, file_name, content_type)
+    return get_storage().public_url(file_name)
 
 @app.post("/chat/audio/")
-async def chat_audio(file: UploadFile = File(...), response_type: str = Form("both")):
-     file_path = f"temp_{file.filename}"
-     with open(file_path, "wb") as f:
-         f.write(await file.read())
- 
-     transcript = whisper_model.transcribe(file_path)["text"].strip()
-     os.remove(file_path)  # Cleanup
+async def chat_audio(
+    file: UploadFile = File(...),
+    response_type: str = Form("both"),
+    user_id: Optional[str] = Form(None),
+    chat_id: Optional[str] = Form(None),
+    whisper_tier: Optional[str] = Form(None)
+):
+     validate_whisper_tier(whisper_tier)
+     audio = await file.read()
+     transcript = (await scheduler.run("whisper", transcribe_bytes, audio, whisper_tier))["text"].strip()
      
-     chat_history.append(f"User: {transcript}\nAssistant:")
-     prompt = "\n".join(chat_history)
-     output = llm(prompt, max_tokens=150, stop=["User:", "Assistant:"], temperature=0.7)
-     response = output["choices"][0]["text"].strip()
-     chat_history.append(response)
+     response = await scheduler.run("llm", generate_llm_response, transcript, session_key(user_id, chat_id))
      
      if response_type == "text":
          return {"response": response}
      
-     # Convert text response to speech and upload to Firebase
-     tts = gTTS(response)
-     response_audio_path = "response.mp3"
-     tts.save(response_audio_path)
-     audio_url = upload_to_firebase(response_audio_path, "response.mp3")
+     # Convert text response to speech and upload it (cached by content)
+     audio_url = await scheduler.run("io", tts_response_url, response, "en")
      
      return {"response": response, "audio_url": audio_url}   
 
-@app.post("/chat/audio/file")
-async def chat_audio_file(
-    file: UploadFile = File(...),
-    response_type: str = Form("both"),
-    user_id: str = Form(...),
-    chat_id: str = Form(...)
-):
-    timestamp = int(time.time())
+async def reply_sentences(transcript, session):
+    """Yield the English reply sentence by sentence: from Faiss, or as the LLM generates it"""
+    faiss_result = await search_faiss_batched(transcript)
+    if faiss_result:
+        print("Request found in Faiss database")
+        response_text = faiss_result['response'] or ""
+        await scheduler.run("io", conversations.append, session, transcript, response_text)
+        for sentence in split_sentences(response_text):
+            yield sentence
+        return
+
+    splitter = SentenceSplitter()
+    async with aclosing(llm_token_stream(transcript, session)) as tokens:
+        async for text in tokens:
+            for sentence in splitter.feed(text):
+                yield sentence
+    for sentence in splitter.flush():
+        yield sentence
+
+async def speak_sentence(sentence, language, speak, upload):
+    """Translate one English reply sentence to the user's language and synthesise it"""
+    text = sentence if language == "en" else await translate(sentence, "en", language)
+    audio_url = None
+    if speak and upload:
+        audio_url = await scheduler.run("io", tts_response_url, text, language, "audioMessages/response/")
+    elif speak:
+        # Synthesised into the speech cache now; joined and uploaded once the reply is complete
+        await scheduler.run("io", save_tts_response, text, language)
+    return {"english": sentence, "text": text, "audio_url": audio_url}
+
+async def pipeline_sentences(sentences, language, speak, upload):
+    """
+    Translate and synthesise each reply sentence as soon as it is complete,
+    while the following ones are still being generated, and yield the results
+    in order. With `upload` each sentence's audio is uploaded on its own.
+    """
+    pending = asyncio.Queue()
 
-    user_temp_path = f"user_audio_{timestamp}.webm"
-    response_audio_path = "response.mp3"
+    async def produce():
+        try:
+            async with aclosing(sentences):
+                async for sentence in sentences:
+                    pending.put_nowait(asyncio.ensure_future(speak_sentence(sentence, language, speak, upload)))
+        finally:
+            pending.put_nowait(None)
 
+    producer = asyncio.ensure_future(produce())
     try:
-        # Save user audio file
-        with open(user_temp_path, "wb") as f:
-            f.write(await file.read())
-
-        # Upload user audio to Firebase
-        user_audio_filename = f"audioMessages/user/user_{user_id}_{timestamp}_{chat_id}.webm"
-        user_audio_url = upload_to_firebase(user_temp_path, user_audio_filename)
-
-        # Transcribe the audio using Whisper
-        result = whisper_model.transcribe(user_temp_path, task="transcribe")
-        transcript = result["text"].strip()
-        language = result["language"]
-
+        while True:
+            task = await pending.get()
+            if task is None:
+                break
+            yield await task
+        await producer
+    finally:
+        producer.cancel()
+        while not pending.empty():
+            task = pending.get_nowait()
+            if task is not None:
+                task.cancel()
+
+async def transcribe_voice_message(user_audio, whisper_tier):
+    """
+    Transcribe a voice message and translate it to English; returns (English
+    transcript, language). Long voice notes are transcribed in chunks and
+    each chunk is translated while the next ones are still being transcribed.
+    """
+    pieces = []
+    translated_pieces = []
+    language = None
+    chunks = scheduler.stream("whisper", transcribe_stream, user_audio, whisper_tier, task="transcribe")
+    try:
+        try:
+            async for chunk in chunks:
+                language = chunk["language"]
+                pieces.append(chunk["text"])
+                if language != "en":
+                    translated_pieces.append(asyncio.ensure_future(translate(chunk["text"], language, "en")))
+        finally:
+            await chunks.aclose()
+
+        if not pieces:
+            raise HTTPException(status_code=400, detail="No speech found in the audio.")
+        transcript = " ".join(pieces)
+
+        # Whisper already identified the spoken language; no separate detection
         print("Extracted text:", transcript, "Language:", language)
 
-        os.remove(user_temp_path)  # Cleanup user audio temp file
-
-        # Detect language from transcript
-        detected_lang = detect(transcript)
-        print(f"Detected Language: {detected_lang}")
-
-        # Translate to English if needed
         if language != "en":
-            transcript = translator.translate(transcript, src=language, dest="en").text
+            transcript = " ".join(await asyncio.gather(*translated_pieces))
             print(f"Translated to English: {transcript}")
+        return transcript, language
+    finally:
+        # Translations of earlier chunks are not needed once a later stage failed
+        for piece in translated_pieces:
+            piece.cancel()
+            piece.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+async def audio_reply_events(transcript, language, session, speak, upload):
+    """Server-sent events of a voice reply, one `sentence` event per synthesised sentence"""
+    user_audio_url = await upload
+    yield sse_event("transcript", {"userMessage": transcript, "language": language, "userAudioUrl": user_audio_url})
+
+    english, texts = [], []
+    try:
+        async with aclosing(pipeline_sentences(reply_sentences(transcript, session), language, speak, True)) as replies:
+            async for reply in replies:
+                yield sse_event("sentence", {"index": len(texts), "text": reply["text"], "audio_url": reply["audio_url"]})
+                english.append(reply["english"])
+                texts.append(reply["text"])
+    except Exception as e:
+        print(f"Error streaming audio reply: {e}")
+        yield sse_event("error", {"detail": str(e)})
+        return
+
+    yield sse_event("done", {
+        "response": " ".join(texts),
+        "english": " ".join(english),
+        "userMessage": transcript,
+        "userAudioUrl": user_audio_url
+    })
 
-        # Process with LLM
-        chat_history.append(f"User: {transcript}\nAssistant:")
-        prompt = "\n".join(chat_history)
-        faiss_result = search_faiss(transcript)
-
-        if faiss_result:
-            print("Request found in Faiss database")
-            response_text = faiss_result['response']
-        else:
-            output = llm(prompt, max_tokens=150, stop=["User:", "Assistant:"], temperature=0.7)
-            response_text = output["choices"][0]["text"].strip()
-
-        chat_history.append(response_text)
-
-        final_response = response_text
+@app.post("/chat/audio/file")
+async def chat_audio_file(
+    file: UploadFile = File(...),
+    response_type: str = Form("both"),
+    user_id: str = Form(...),
+    chat_id: str = Form(...),
+    whisper_tier: Optional[str] = Form(None),
+    stream: bool = Form(False)
+):
+    """
+    Voice chat turn, run as overlapping stages: the user's audio is uploaded
+    while it is transcribed, and the reply is translated and synthesised
+    sentence by sentence while the LLM is still generating the rest.
 
-        # Translate back to original language if needed
-        if language != "en":
-            final_response = translator.translate(response_text, src="en", dest=language).text
-            print(f"Translated Back to {language}: {final_response}")
+    With `stream` the reply is sent as server-sent events: `transcript`, one
+    `sentence` per reply sentence (with its own audio URL unless
+    response_type is "text"), then `done`, or `error`.
+    """
+    validate_whisper_tier(whisper_tier)
+    timestamp = int(time.time())
+    speak = response_type != "text"
+    upload = None
+    streaming = False
 
-        if response_type == "text":
+    try:
+        user_audio = await file.read()
+        user_audio_filename = f"audioMessages/user/user_{user_id}_{timestamp}_{chat_id}.webm"
+        user_audio_type = file.content_type or "audio/webm"
+
+        # The user's own audio is only needed for the chat history. A spoken
+        # JSON reply uploads it together with the reply's speech; otherwise it
+        # is uploaded after the response, its URL known up front
+        if stream or not speak:
+            upload = asyncio.ensure_future(
+                scheduler.run("io", upload_after_response, user_audio, user_audio_filename, user_audio_type)
+            )
+
+        transcript, language = await transcribe_voice_message(user_audio, whisper_tier)
+        session = session_key(user_id, chat_id)
+
+        if stream:
+            # The event stream awaits the upload from here on
+            streaming = True
+            return StreamingResponse(
+                audio_reply_events(transcript, language, session, speak, upload),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache"}
+            )
+
+        replies = [
+            reply async for reply in pipeline_sentences(reply_sentences(transcript, session), language, speak, False)
+        ]
+        response_text = " ".join(reply["english"] for reply in replies)
+        final_response = " ".join(reply["text"] for reply in replies)
+
+        if not speak:
             return {
                 "response": final_response,
                 "userMessage": transcript,
-                "userAudioUrl": user_audio_url
+                "userAudioUrl": await upload
             }
 
-        # Convert text response to speech
-        tts = gTTS(final_response, lang=language)
-        tts.save(response_audio_path)
-
-        # Upload assistant response audio to Firebase
-        response_audio_filename = f"audioMessages/response/response_{user_id}_{timestamp}_{chat_id}.webm"
-        audio_url = upload_to_firebase(response_audio_path, response_audio_filename)
-        os.remove(response_audio_path)  # Cleanup
+        # The sentences are already synthesised; join them into one file.
+        # Replies spoken before (e.g. Faiss answers) reuse the stored file
+        files = [(user_audio, user_audio_filename, user_audio_type)]
+        reply_entry = reply_file = None
+        if replies:
+            reply_entry, reply_file = await scheduler.run(
+                "io", tts_joined_file, [reply["text"] for reply in replies], language, "audioMessages/response/"
+            )
+            if reply_file:
+                files.append(reply_file)
+
+        urls = await upload_many(files)
+        user_audio_url = urls[0]
+        audio_url = reply_entry["url"] if reply_entry else None
+        if reply_file:
+            audio_url = urls[1]
+            await scheduler.run("io", tts.cache.set_url, reply_entry["key"], audio_url)
 
         return {
             "response": response_text,
@@ -409,69 +991,162 @@ async def chat_audio_file(
             "userAudioUrl": user_audio_url
         }
 
+    except (QueueFullError, ModelUnavailableError, AudioDecodeError, HTTPException):
+        # Let the 429/503/400 handlers answer
+        raise
     except Exception as e:
-        # Cleanup on failure
-        if os.path.exists(user_temp_path):
-            os.remove(user_temp_path)
-        if os.path.exists(response_audio_path):
-            os.remove(response_audio_path)
         print(f"Error processing audio file: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing audio file: {str(e)}")
+    finally:
+        # Not awaited when an earlier stage failed: stop it, and retrieve its
+        # error so it is not reported as never retrieved
+        if upload is not None and not streaming:
+            upload.cancel()
+            upload.add_done_callback(lambda f: f.cancelled() or f.exception())
 
 def classify_emotion_onnx(text: str):
-     input_text = text
+    """Return the most probable emotion for a single message"""
+    top_5 = models.get("emotion").classify([text], top_k=5)[0]
 
-# Tokenize the input text using the same tokenizer used during training
-     inputs = tokenizer(input_text, return_tensors="np", padding=True, truncation=True, max_length=512)
+    # Print the top 5 predicted emotions and their probabilities
+    for emotion, probability in top_5:
+        print(f"Emotion: {emotion}, Probability: {probability:.4f}")
 
-# Extract the input_ids as numpy array and convert to int64
-     input_ids = inputs['input_ids'].astype(np.int64)
+    return top_5[0][0]  # Return the most probable emotion
 
-# Prepare the inputs for the ONNX model (make sure to match the input names defined during export)
-     onnx_inputs = {
-       "input_ids": input_ids
-     }
+def classify_emotions_onnx(texts):
+    """Return the most probable emotion for each message, in one batched pass"""
+    return [top[0][0] for top in models.get("emotion").classify(texts, top_k=1)]
 
-# Run inference using the ONNX model
-     onnx_output = session.run(None, onnx_inputs)
+# Concurrent /analyze/ calls are collected into one batched ONNX run
+emotion_batcher = MicroBatcher(
+    classify_emotions_onnx,
+    lambda fn, texts: scheduler.run("onnx", fn, texts),
+    max_batch=int(os.getenv("EMOTION_BATCH_MAX_SIZE", "32")),
+    max_wait_ms=float(os.getenv("EMOTION_BATCH_MAX_WAIT_MS", "5"))
+)
 
-# The output is typically a list of predictions, we get the first output (since we only have one output in this case)
-     predictions = onnx_output[0]
 
-# Process the output: predictions will typically be logits, apply softmax for probabilities
-     probabilities = softmax(predictions, axis=-1)
+# Update the analyze endpoint to use the ONNX-based emotion model
+@app.post("/analyze/")
+async def analyze(request: ClassificationRequest):
+    user_message = request.message.strip()
 
-# Get the top 5 predicted classes and their probabilities
-     top_5_indices = np.argsort(probabilities[0])[-5:][::-1]
-     top_5_probabilities = probabilities[0][top_5_indices]
+    if not user_message:
+        raise HTTPException(status_code=400, detail="Message cannot be empty.")
 
-# Emotion labels (these are the emotion labels corresponding to the model's outputs)
-     emotion_labels = [
-    "admiration", "amusement", "anger", "annoyance", "approval", "caring", "confusion", "curiosity", "desire", 
-    "disappointment", "disapproval", "disgust", "embarrassment", "excitement", "fear", "gratitude", "grief", 
-    "joy", "love", "nervousness", "optimism", "pride", "realization", "relief", "remorse", "sadness", "surprise", 
-    "neutral"
-   ]
+    # Get emotion classification using ONNX model
+    emotion = await emotion_batcher.submit(user_message)
+    return {
+        "emotion": emotion,
+    }
 
-# Print the top 5 predicted emotions and their probabilities
-     for i in range(5):
-       emotion = emotion_labels[top_5_indices[i]]
-       probability = top_5_probabilities[i]
-       print(f"Emotion: {emotion}, Probability: {probability:.4f}")  
+@app.post("/analyze/batch")
+async def analyze_batch(request: BatchClassificationRequest):
+    """Classify the emotion of many messages, e.g. when replaying chat history"""
+    messages = [message.strip() for message in request.messages]
 
-     return emotion_labels[top_5_indices[0]]  # Return the most probable emotion
+    if not messages or not all(messages):
+        raise HTTPException(status_code=400, detail="Messages cannot be empty.")
 
+    emotions = []
+    for start in range(0, len(messages), EMOTION_BATCH_CHUNK_SIZE):
+        chunk = messages[start:start + EMOTION_BATCH_CHUNK_SIZE]
+        emotions.extend(await scheduler.run("onnx", classify_emotions_onnx, chunk))
 
-# Update the analyze endpoint to use the ONNX-based emotion model
-@app.post("/analyze/")
-async def analyze(request: ClassificationRequest):
+    return {
+        "emotions": emotions,
+    }
+
+
+# Mental-health classifier (quantized Llama-3.1-8B). It is only loaded when
+# /classify/ is first called and is released again after being idle.
+MENTAL_HEALTH_MODEL_PATH = os.getenv(
+    "MENTAL_HEALTH_MODEL_PATH", "./mental_health_onnx_model/mental_health_model_quantized.onnx"
+)
+MENTAL_HEALTH_TOKENIZER = os.getenv(
+    "MENTAL_HEALTH_TOKENIZER", "kingabzpro/Llama-3.1-8B-Instruct-Mental-Health-Classification"
+)
+
+def load_mental_health_classifier():
+    """Load the mental-health ONNX session, tokenizer and labels"""
+    mh_tokenizer = AutoTokenizer.from_pretrained(MENTAL_HEALTH_TOKENIZER, use_fast=True)
+    if mh_tokenizer.pad_token is None:
+        mh_tokenizer.pad_token = mh_tokenizer.eos_token  # Use EOS token as padding token
+
+    mh_session = create_session(MENTAL_HEALTH_MODEL_PATH)
+    labels_path = os.path.join(os.path.dirname(MENTAL_HEALTH_MODEL_PATH), "labels.json")
+    if os.path.exists(labels_path):
+        with open(labels_path) as f:
+            labels = json.load(f)
+    else:
+        labels = [f"LABEL_{i}" for i in range(mh_session.get_outputs()[0].shape[-1])]
+
+    return OnnxTextClassifier(mh_session, mh_tokenizer, labels)
+
+# Registered so it can be disabled; the 8B session itself loads on first use
+@models.register("mental_health", preload=False)
+def load_lazy_mental_health_classifier():
+    return LazyOnnxClassifier(
+        load_mental_health_classifier,
+        idle_timeout=float(os.getenv("MENTAL_HEALTH_IDLE_UNLOAD", "600"))
+    )
+
+def classify_mental_health(items):
+    """Return the labelled top-N classes for each (message, top_n) item, in one batched pass"""
+    top_k = max(top_n for _, top_n in items)
+    predictions = models.get("mental_health").classify([message for message, _ in items], top_k=top_k)
+    return [
+        [{"label": label, "probability": probability} for label, probability in top[:top_n]]
+        for top, (_, top_n) in zip(predictions, items)
+    ]
+
+mental_health_batcher = MicroBatcher(
+    classify_mental_health,
+    lambda fn, items: scheduler.run("mental_health", fn, items),
+    max_batch=int(os.getenv("MENTAL_HEALTH_BATCH_MAX_SIZE", "8")),
+    max_wait_ms=float(os.getenv("MENTAL_HEALTH_BATCH_MAX_WAIT_MS", "10"))
+)
+
+@app.post("/classify/")
+async def classify(request: MentalHealthRequest):
+    """Classify a message with the mental-health model"""
     user_message = request.message.strip()
 
     if not user_message:
         raise HTTPException(status_code=400, detail="Message cannot be empty.")
+    if request.top_n < 1:
+        raise HTTPException(status_code=400, detail="top_n must be at least 1.")
 
-    # Get emotion classification using ONNX model
-    emotion = classify_emotion_onnx(user_message)
+    predictions = await mental_health_batcher.submit((user_message, request.top_n))
     return {
-        "emotion": emotion,
-    }
\ No newline at end of file
+        "predictions": predictions,
+    }
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit and miss counters of the classifier, TTS and translation caches"""
+    return cache_stats_snapshot()
+
+def cache_stats_snapshot():
+    emotion_classifier = models.get_if_loaded("emotion")
+    mental_health_classifier = models.get_if_loaded("mental_health")
+    faq_counters = models.get_if_loaded("faq")
+    embeddings = models.get_if_loaded("embedding")
+    return {
+        "emotion": emotion_classifier.stats() if emotion_classifier else None,
+        "mental_health": mental_health_classifier.stats() if mental_health_classifier else None,
+        "tts": tts.stats(),
+        "translation": translations.stats(),
+        "faq": faq_counters.stats() if faq_counters else None,
+        "embedding": embeddings.stats() if embeddings else None,
+    }
+
+@app.post("/classify/unload")
+async def unload_classifier():
+    """Release the mental-health model's memory until it is next needed"""
+    mental_health_classifier = models.get_if_loaded("mental_health")
+    return {"unloaded": mental_health_classifier.unload() if mental_health_classifier else False}
+
+# Registered last: the collector's snapshot reads helpers defined throughout this module
+register_stats(metrics_snapshot)
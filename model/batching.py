@@ -0,0 +1,65 @@
+import asyncio
+import contextvars
+
+
+class MicroBatcher:
+    """
+    Collects concurrent single-item requests into batches.
+
+    Items submitted within `max_wait_ms` of the first waiting item (up to
+    `max_batch` of them) are passed together to `process(items)`, which must
+    return one result per item. `run(process, items)` executes the batch,
+    typically on a scheduler pool: `lambda fn, items: scheduler.run("onnx", fn, items)`.
+    """
+
+    def __init__(self, process, run, max_batch=32, max_wait_ms=5):
+        self.process = process
+        self.run = run
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+
+        self._queue = None
+        self._worker = None
+
+    async def submit(self, item):
+        """Queue one item and wait for its result"""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            # The collector outlives this request, so it must not inherit its
+            # context (e.g. the request's timing spans)
+            self._worker = loop.create_task(self._collect(), context=contextvars.Context())
+
+        future = loop.create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Run without awaiting so the next batch can be collected meanwhile
+            loop.create_task(self._run_batch(batch))
+
+    async def _run_batch(self, batch):
+        items = [item for item, _ in batch]
+        try:
+            results = await self.run(self.process, items)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
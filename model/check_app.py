@@ -0,0 +1,26 @@
+"""
+Import smoke check for the API: imports app.py the way uvicorn, load_test.py
+and reindex_faiss.py do, then renders /metrics once so every stats snapshot
+helper runs. No models are loaded and nothing is sent over the network.
+
+    python check_app.py
+"""
+import sys
+
+
+def main():
+    import app
+    from metrics import metrics_response
+
+    body, _ = metrics_response()
+    routes = sorted({route.path for route in app.app.routes})
+    for path in ("/chat/", "/chat/stream", "/chat/audio/file", "/metrics", "/stages"):
+        if path not in routes:
+            print(f"Route {path} is missing")
+            return 1
+    print(f"app imported: {len(routes)} routes, /metrics renders {len(body)} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CHAT_MAX_TURNS = int(os.getenv("CHAT_MAX_TURNS", "50"))
+CHAT_SESSION_TTL = float(os.getenv("CHAT_SESSION_TTL", "1800"))
+CHAT_MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS", "1000"))
+# When a prompt overflows its budget, old turns are dropped until it fits in
+# this fraction of the budget. Trimming in steps keeps the prompt prefix
+# stable for several turns, so the llama.cpp KV cache can still be reused.
+CHAT_TRIM_RATIO = float(os.getenv("CHAT_TRIM_RATIO", "0.75"))
+
+
+class Conversation:
+    """Turns of one conversation with cached token counts"""
+
+    def __init__(self):
+        self.turns = []  # (user_message, response, tokens)
+        self.start = 0   # index of the oldest turn still included in prompts
+        self.last_used = time.monotonic()
+
+
+class ConversationStore:
+    """
+    Per-user, per-chat conversation histories with token-budgeted prompts.
+
+    Each conversation keeps at most `max_turns` turns. Prompts are assembled
+    from the newest turns that fit in `max_prompt_tokens`, counted with the
+    llama tokenizer via `count_tokens`. Sessions idle for longer than `ttl`
+    seconds, or beyond `max_sessions`, are evicted and `on_evict` is called
+    with their key.
+    """
+
+    def __init__(self, count_tokens, max_prompt_tokens, max_turns=CHAT_MAX_TURNS,
+                 ttl=CHAT_SESSION_TTL, max_sessions=CHAT_MAX_SESSIONS, on_evict=None):
+        self.count_tokens = count_tokens
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_turns = max_turns
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.on_evict = on_evict
+
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _format_turn(user_message, response=None):
+        if response is None:
+            return f"User: {user_message}\nAssistant:"
+        return f"User: {user_message}\nAssistant:\n{response}"
+
+    def _get(self, key):
+        conversation = self._sessions.get(key)
+        if conversation is None:
+            conversation = Conversation()
+            self._sessions[key] = conversation
+        self._sessions.move_to_end(key)
+        conversation.last_used = time.monotonic()
+        return conversation
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        evicted = []
+        while self._sessions:
+            key, conversation = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - conversation.last_used <= self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            evicted.append(key)
+        return evicted
+
+    def _fit_message(self, user_message):
+        """Cut `user_message` so that its turn alone fits in `max_prompt_tokens`"""
+        def fits(length):
+            return self.count_tokens(self._format_turn(user_message[:length])) <= self.max_prompt_tokens
+
+        if fits(len(user_message)):
+            return user_message
+        # Longest prefix that fits, by binary search over its length
+        low, high = 0, len(user_message)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if fits(middle):
+                low = middle
+            else:
+                high = middle - 1
+        print(f"Message of {len(user_message)} characters truncated to {low} to fit the prompt")
+        return user_message[:low]
+
+    def build_prompt(self, key, user_message):
+        """
+        Assemble the prompt for a new user message within the token budget.
+        A message too long for the budget on its own is truncated.
+        """
+        pending = self._format_turn(self._fit_message(user_message))
+        budget = self.max_prompt_tokens - self.count_tokens(pending)
+
+        with self._lock:
+            conversation = self._get(key)
+            turns = conversation.turns
+
+            used = sum(tokens for _, _, tokens in turns[conversation.start:])
+            if used > budget:
+                target = budget * CHAT_TRIM_RATIO
+                while conversation.start < len(turns) and used > target:
+                    used -= turns[conversation.start][2]
+                    conversation.start += 1
+
+            history = [self._format_turn(user, response) for user, response, _ in turns[conversation.start:]]
+            evicted = self._evict_idle()
+
+        self._notify(evicted)
+        return "\n".join(history + [pending])
+
+    def append(self, key, user_message, response):
+        """Record a completed turn"""
+        tokens = self.count_tokens(self._format_turn(user_message, response) + "\n")
+
+        with self._lock:
+            conversation = self._get(key)
+            conversation.turns.append((user_message, response, tokens))
+            overflow = len(conversation.turns) - self.max_turns
+            if overflow > 0:
+                del conversation.turns[:overflow]
+                conversation.start = max(0, conversation.start - overflow)
+            evicted = self._evict_idle()
+
+        self._notify(evicted)
+
+    def clear(self, key):
+        """Forget a conversation"""
+        with self._lock:
+            removed = self._sessions.pop(key, None) is not None
+        if removed:
+            self._notify([key])
+
+    def _notify(self, keys):
+        if self.on_evict is None:
+            return
+        for key in keys:
+            self.on_evict(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "turns": sum(len(c.turns) for c in self._sessions.values()),
+            }
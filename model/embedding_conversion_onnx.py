@@ -0,0 +1,80 @@
+import os
+from transformers import AutoTokenizer, AutoModel
+import torch
+import onnx
+from onnxruntime.quantization import quantize_dynamic, QuantType
+from onnxruntime.transformers import optimizer
+
+# Export the sentence-transformers MiniLM encoder (without its pooling layer,
+# which embeddings.OnnxEncoder applies) for EMBEDDING_BACKEND=onnx
+model_name = "sentence-transformers/all-MiniLM-L6-v2"
+onnx_dir = "embedding_onnx_model"
+os.makedirs(onnx_dir, exist_ok=True)
+
+tokenizer = AutoTokenizer.from_pretrained(model_name)
+model = AutoModel.from_pretrained(model_name)
+model.eval()
+
+# The tokenizer is saved next to the model so the server loads both from one directory
+tokenizer.save_pretrained(onnx_dir)
+
+inputs = tokenizer("How can I manage stress before exams?", return_tensors="pt")
+
+onnx_path = os.path.join(onnx_dir, "model.onnx")
+optimized_model_path = os.path.join(onnx_dir, "model_optimized.onnx")
+quantized_model_path = os.path.join(onnx_dir, "model_quantized.onnx")
+torch.onnx.export(
+    model,
+    (inputs["input_ids"], inputs["attention_mask"], inputs["token_type_ids"]),
+    onnx_path,
+    opset_version=14,
+    input_names=["input_ids", "attention_mask", "token_type_ids"],
+    output_names=["last_hidden_state"],
+    dynamic_axes={
+        "input_ids": {0: "batch_size", 1: "sequence_length"},
+        "attention_mask": {0: "batch_size", 1: "sequence_length"},
+        "token_type_ids": {0: "batch_size", 1: "sequence_length"},
+        "last_hidden_state": {0: "batch_size", 1: "sequence_length"},
+    },
+    do_constant_folding=True
+)
+
+onnx_model = onnx.load(onnx_path)
+onnx.checker.check_model(onnx_model)
+
+print(f"Model successfully exported to {onnx_path}")
+
+# Fuse attention, layer-norm and GELU subgraphs with the ORT transformer optimizer
+optimized_model = optimizer.optimize_model(
+    onnx_path,
+    model_type="bert",
+    num_heads=model.config.num_attention_heads,
+    hidden_size=model.config.hidden_size,
+)
+optimized_model.save_model_to_file(optimized_model_path)
+
+print(f"Optimized model saved to {optimized_model_path}")
+
+quantize_dynamic(
+    optimized_model_path,
+    quantized_model_path,
+    weight_type=QuantType.QInt8
+)
+
+print(f"Quantized model saved to {quantized_model_path}")
+
+# INT8 weights shift the embeddings slightly; check they still agree with PyTorch
+from sentence_transformers import SentenceTransformer
+from embeddings import OnnxEncoder
+import numpy as np
+
+sentences = [
+    "I feel anxious all the time",
+    "How do I stop worrying about exams?",
+    "Can you recommend a breathing exercise?",
+]
+reference = SentenceTransformer("all-MiniLM-L6-v2").encode(sentences, normalize_embeddings=True)
+for file_name in ("model.onnx", "model_optimized.onnx", "model_quantized.onnx"):
+    encoded = OnnxEncoder(onnx_dir, file_name).encode(sentences)
+    similarity = np.sum(reference * encoded, axis=1)
+    print(f"{file_name}: min cosine similarity to PyTorch {similarity.min():.4f}")
@@ -0,0 +1,132 @@
+import os
+
+import numpy as np
+
+from caching import LRUCache
+from onnx_classifier import bucket_length, create_session
+from stage_timing import stages
+from tokenization import CachedTokenizer, normalize_text
+
+# "sentence-transformers" runs the PyTorch model; "onnx" runs the MiniLM
+# export produced by embedding_conversion_onnx.py (INT8 by default)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers").lower()
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "./embedding_onnx_model")
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "model_quantized.onnx")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "8192"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+
+class SentenceTransformerEncoder:
+    def __init__(self, name=EMBEDDING_MODEL, batch_size=EMBEDDING_BATCH_SIZE):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(name)
+        self.batch_size = batch_size
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.lowercase = getattr(self.model.tokenizer, "do_lower_case", False)
+
+    def encode(self, texts):
+        return self.model.encode(
+            texts, batch_size=self.batch_size, convert_to_numpy=True, normalize_embeddings=True
+        ).astype(np.float32)
+
+
+class OnnxEncoder:
+    """MiniLM run through ONNX Runtime with mean pooling over the attention mask, like sentence-transformers"""
+
+    def __init__(self, model_dir=EMBEDDING_ONNX_DIR, file_name=EMBEDDING_ONNX_FILE,
+                 batch_size=EMBEDDING_BATCH_SIZE, max_length=256):
+        from transformers import AutoTokenizer
+
+        self.session = create_session(os.path.join(model_dir, file_name))
+        tokenizer = AutoTokenizer.from_pretrained(model_dir, use_fast=True)
+        self.lowercase = getattr(tokenizer, "do_lower_case", False)
+        self.tokenizer = CachedTokenizer(tokenizer, max_length)
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.dimension = self.session.get_outputs()[0].shape[-1]
+
+    def _run(self, sequences):
+        length = bucket_length(max(len(ids) for ids in sequences), self.max_length)
+        input_ids = np.full((len(sequences), length), self.tokenizer.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(sequences), length), dtype=np.int64)
+        for row, ids in enumerate(sequences):
+            input_ids[row, :len(ids)] = ids
+            attention_mask[row, :len(ids)] = 1
+
+        onnx_inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            onnx_inputs["token_type_ids"] = np.zeros_like(input_ids)
+        with stages.stage("onnx"):
+            hidden = self.session.run(None, onnx_inputs)[0]
+
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def encode(self, texts):
+        sequences = self.tokenizer.encode(texts)
+        # Sort by length so each batch pads to a similar size
+        order = sorted(range(len(sequences)), key=lambda i: len(sequences[i]))
+        embeddings = np.zeros((len(sequences), self.dimension), dtype=np.float32)
+        for start in range(0, len(order), self.batch_size):
+            indices = order[start:start + self.batch_size]
+            embeddings[indices] = self._run([sequences[i] for i in indices])
+        return embeddings
+
+
+def create_encoder(backend=EMBEDDING_BACKEND):
+    if backend == "sentence-transformers":
+        return SentenceTransformerEncoder()
+    if backend == "onnx":
+        return OnnxEncoder()
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+class EmbeddingService:
+    """
+    L2-normalised sentence embeddings with an LRU keyed by normalised text.
+
+    Uncased models (like MiniLM) give the same embedding regardless of case,
+    so for those the key is also lower-cased: a question embedded for a Faiss
+    search is reused when the same question is later promoted to the index.
+    """
+
+    def __init__(self, encoder, cache_size=EMBEDDING_CACHE_SIZE):
+        self.encoder = encoder
+        self.dimension = encoder.dimension
+        self.cache = LRUCache(cache_size)
+
+    def _key(self, text):
+        text = normalize_text(text)
+        return text.lower() if self.encoder.lowercase else text
+
+    def cached(self, text):
+        """Return the cached embedding of `text`, or None"""
+        return self.cache.get(self._key(text))
+
+    def encode(self, texts, cache=True):
+        """Return an (n_texts, dimension) float32 array; `cache=False` for bulk jobs"""
+        keys = [self._key(text) for text in texts]
+        embeddings = np.zeros((len(keys), self.dimension), dtype=np.float32)
+
+        pending = {}
+        for position, key in enumerate(keys):
+            cached = self.cache.get(key) if cache else None
+            if cached is not None:
+                embeddings[position] = cached
+            else:
+                pending.setdefault(key, []).append(position)
+
+        if pending:
+            unique_keys = list(pending)
+            for key, embedding in zip(unique_keys, self.encoder.encode(unique_keys)):
+                if cache:
+                    self.cache.put(key, embedding)
+                embeddings[pending[key]] = embedding
+        return embeddings
+
+    def stats(self):
+        return self.cache.stats()
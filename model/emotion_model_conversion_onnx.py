@@ -1,10 +1,15 @@
+import os
 from transformers import AutoTokenizer, BertForSequenceClassification
 import torch
 import onnx
+from onnxruntime.quantization import quantize_dynamic, QuantType
+from onnxruntime.transformers import optimizer
+
+from emotions import EMOTION_LABELS, EMOTION_MODEL_NAME
 
 # Load the pre-trained model and tokenizer
-tokenizer = AutoTokenizer.from_pretrained("monologg/bert-base-cased-goemotions-original")
-model = BertForSequenceClassification.from_pretrained("monologg/bert-base-cased-goemotions-original", num_labels=28)
+tokenizer = AutoTokenizer.from_pretrained(EMOTION_MODEL_NAME)
+model = BertForSequenceClassification.from_pretrained(EMOTION_MODEL_NAME, num_labels=len(EMOTION_LABELS))
 
 # Prepare an example input tensor (replace with appropriate input data if necessary)
 # Example text input
@@ -14,16 +19,24 @@ input_text = "I am happy"
 inputs = tokenizer(input_text, return_tensors="pt", padding=True, truncation=True, max_length=512)
 
 # Export the model to ONNX format
-onnx_path = "model.onnx"
+# app.py and emotion_quantization_drift.py load all three variants from here
+onnx_dir = "./saved_model"
+os.makedirs(onnx_dir, exist_ok=True)
+onnx_path = os.path.join(onnx_dir, "model.onnx")
+optimized_model_path = os.path.join(onnx_dir, "model_optimized.onnx")
+quantized_model_path = os.path.join(onnx_dir, "model_quantized.onnx")
+# The attention mask lets the server pad a batch of messages to a shared length
+model.eval()
 torch.onnx.export(
     model,               # Model to export
-    (inputs['input_ids'],),  # Pass the tokenized input tensor (as a tuple for compatibility)
+    (inputs['input_ids'], inputs['attention_mask']),  # Tokenized input tensors
     onnx_path,           # Path to save the ONNX model
     opset_version=14,    # Use opset version 14 or higher
-    input_names=["input_ids"],  # Name of the input layer
+    input_names=["input_ids", "attention_mask"],  # Names of the input layers
     output_names=["output"],    # Name of the output layer
     dynamic_axes={
         "input_ids": {0: "batch_size", 1: "sequence_length"},  # Dynamic axes for input
+        "attention_mask": {0: "batch_size", 1: "sequence_length"},
         "output": {0: "batch_size"}  # Dynamic axes for output
     },
     do_constant_folding=True  # Optimize the model
@@ -34,3 +47,23 @@ onnx_model = onnx.load(onnx_path)
 onnx.checker.check_model(onnx_model)
 
 print(f"Model successfully exported to {onnx_path}")
+
+# Fuse attention, layer-norm and GELU subgraphs with the ORT transformer optimizer
+optimized_model = optimizer.optimize_model(
+    onnx_path,
+    model_type="bert",
+    num_heads=model.config.num_attention_heads,
+    hidden_size=model.config.hidden_size,
+)
+optimized_model.save_model_to_file(optimized_model_path)
+
+print(f"Optimized model saved to {optimized_model_path}")
+
+# Perform ONNX model quantization on the optimized graph
+quantize_dynamic(
+    optimized_model_path,
+    quantized_model_path,
+    weight_type=QuantType.QInt8  # Convert to 8-bit
+)
+
+print(f"Quantized model saved to {quantized_model_path}")
@@ -0,0 +1,98 @@
+"""
+Accuracy drift of the optimized / INT8 GoEmotions models against fp32.
+
+Runs every variant over the same labelled sample and reports top-1 accuracy
+against the gold labels, top-1 agreement with fp32, probability drift and
+per-message latency.
+
+The sample is either a CSV with `text` and `labels` columns (labels are
+emotion names separated by ";") or, by default, the GoEmotions test split:
+
+    python emotion_quantization_drift.py --limit 2000
+    python emotion_quantization_drift.py --csv labelled_messages.csv
+"""
+import argparse
+import csv
+import os
+import time
+
+import numpy as np
+from transformers import AutoTokenizer
+
+from emotions import EMOTION_LABELS, EMOTION_MODEL_NAME
+from onnx_classifier import OnnxTextClassifier, create_session
+
+VARIANTS = {
+    "fp32": "model.onnx",
+    "optimized": "model_optimized.onnx",
+    "int8": "model_quantized.onnx",
+}
+
+
+def load_csv(path, limit):
+    texts, labels = [], []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            texts.append(row["text"])
+            labels.append({EMOTION_LABELS.index(name.strip()) for name in row["labels"].split(";") if name.strip()})
+            if len(texts) >= limit:
+                break
+    return texts, labels
+
+
+def load_goemotions(limit):
+    from datasets import load_dataset
+
+    dataset = load_dataset("go_emotions", "simplified", split="test")
+    dataset = dataset.select(range(min(limit, len(dataset))))
+    return list(dataset["text"]), [set(labels) for labels in dataset["labels"]]
+
+
+def evaluate(classifier, texts, batch_size):
+    probabilities = []
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        probabilities.append(classifier.predict_proba(texts[i:i + batch_size]))
+    elapsed = time.perf_counter() - start
+    return np.vstack(probabilities), elapsed / len(texts) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-dir", default="./saved_model", help="Directory holding the exported variants")
+    parser.add_argument("--csv", help="Labelled CSV sample (defaults to the GoEmotions test split)")
+    parser.add_argument("--limit", type=int, default=1000, help="Maximum number of messages")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    texts, gold = load_csv(args.csv, args.limit) if args.csv else load_goemotions(args.limit)
+    tokenizer = AutoTokenizer.from_pretrained(EMOTION_MODEL_NAME)
+    print(f"Evaluating {len(texts)} messages")
+
+    results = {}
+    for variant, file_name in VARIANTS.items():
+        path = os.path.join(args.model_dir, file_name)
+        if not os.path.exists(path):
+            print(f"Skipping {variant}: {path} not found")
+            continue
+        classifier = OnnxTextClassifier(create_session(path), tokenizer, EMOTION_LABELS)
+        results[variant] = evaluate(classifier, texts, args.batch_size)
+
+    if "fp32" not in results:
+        raise SystemExit("The fp32 model is required as the reference")
+
+    reference = results["fp32"][0]
+    reference_top1 = reference.argmax(axis=1)
+
+    print(f"{'variant':>10} {'accuracy':>9} {'agreement':>10} {'mean_abs':>9} {'max_abs':>8} {'ms/msg':>7}")
+    for variant, (probabilities, ms_per_message) in results.items():
+        top1 = probabilities.argmax(axis=1)
+        accuracy = np.mean([prediction in labels for prediction, labels in zip(top1, gold)])
+        agreement = np.mean(top1 == reference_top1)
+        drift = np.abs(probabilities - reference)
+        print(f"{variant:>10} {accuracy:>9.4f} {agreement:>10.4f} {drift.mean():>9.5f} "
+              f"{drift.max():>8.4f} {ms_per_message:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+# GoEmotions classifier served by /analyze/, exported to ONNX by
+# emotion_model_conversion_onnx.py and checked by emotion_quantization_drift.py
+EMOTION_MODEL_NAME = "monologg/bert-base-cased-goemotions-original"
+
+# Emotion labels in the order of the model's outputs
+EMOTION_LABELS = [
+    "admiration", "amusement", "anger", "annoyance", "approval", "caring", "confusion", "curiosity", "desire",
+    "disappointment", "disapproval", "disgust", "embarrassment", "excitement", "fear", "gratitude", "grief",
+    "joy", "love", "nervousness", "optimism", "pride", "realization", "relief", "remorse", "sadness", "surprise",
+    "neutral"
+]
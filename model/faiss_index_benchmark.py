@@ -0,0 +1,101 @@
+"""
+Recall/latency benchmark for the Faiss index types used by the FAQ cache.
+
+Builds a synthetic corpus of unit-normalised "question" embeddings grouped
+around topics, then queries each index type with perturbed copies of corpus
+vectors (simulated paraphrases). Recall@1 is measured against exact
+inner-product search.
+
+    python faiss_index_benchmark.py --sizes 10000,100000,1000000
+"""
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from faiss_store import FAISS_MIN_SIMILARITY, INDEX_TYPES, build_index
+
+DIMENSION = 384  # all-MiniLM-L6-v2
+
+
+def make_corpus(size, dimension, n_topics, rng):
+    """Create `size` normalised vectors clustered around `n_topics` topic centres"""
+    centres = rng.standard_normal((n_topics, dimension)).astype(np.float32)
+    topics = rng.integers(0, n_topics, size)
+    corpus = centres[topics] + 0.6 * rng.standard_normal((size, dimension)).astype(np.float32)
+    faiss.normalize_L2(corpus)
+    return corpus
+
+
+def make_queries(corpus, n_queries, noise, rng):
+    """Perturb random corpus vectors to simulate paraphrased questions"""
+    picks = rng.choice(len(corpus), n_queries, replace=False)
+    queries = corpus[picks] + noise * rng.standard_normal((n_queries, corpus.shape[1])).astype(np.float32)
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def benchmark(index_type, corpus, queries, ground_truth):
+    ids = np.arange(len(corpus), dtype=np.int64)
+
+    start = time.perf_counter()
+    index = build_index(index_type, corpus.shape[1], corpus if index_type == "ivfpq" else None)
+    index.add_with_ids(corpus, ids)
+    build_seconds = time.perf_counter() - start
+
+    # One query at a time, as the server issues them
+    latencies = []
+    found = np.empty(len(queries), dtype=np.int64)
+    scores = np.empty(len(queries), dtype=np.float32)
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        D, I = index.search(queries[i:i + 1], 1)
+        latencies.append(time.perf_counter() - start)
+        found[i] = I[0][0]
+        scores[i] = D[0][0]
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "type": index_type,
+        "build_s": build_seconds,
+        "size_mb": faiss.serialize_index(index).nbytes / 1e6,
+        "recall@1": float(np.mean(found == ground_truth)),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "hit_rate": float(np.mean(scores >= FAISS_MIN_SIMILARITY[index_type])),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000", help="Comma-separated corpus sizes")
+    parser.add_argument("--types", default=",".join(INDEX_TYPES), help="Comma-separated index types")
+    parser.add_argument("--queries", type=int, default=1000, help="Number of queries per corpus")
+    parser.add_argument("--noise", type=float, default=0.02, help="Paraphrase noise added to query vectors")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    index_types = [t.strip() for t in args.types.split(",") if t.strip()]
+
+    header = f"{'size':>9} {'type':>6} {'build_s':>8} {'size_mb':>8} {'recall@1':>9} {'p50_ms':>7} {'p95_ms':>7} {'hit_rate':>9}"
+    print(header)
+    print("-" * len(header))
+    for size in (int(s) for s in args.sizes.split(",")):
+        corpus = make_corpus(size, DIMENSION, max(10, size // 100), rng)
+        queries = make_queries(corpus, min(args.queries, size), args.noise, rng)
+
+        exact = faiss.IndexFlatIP(DIMENSION)
+        exact.add(corpus)
+        _, ground_truth = exact.search(queries, 1)
+        ground_truth = ground_truth[:, 0]
+
+        for index_type in index_types:
+            r = benchmark(index_type, corpus, queries, ground_truth)
+            print(f"{size:>9} {r['type']:>6} {r['build_s']:>8.2f} {r['size_mb']:>8.1f} "
+                  f"{r['recall@1']:>9.3f} {r['p50_ms']:>7.3f} {r['p95_ms']:>7.3f} {r['hit_rate']:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+import os
+import sqlite3
+import threading
+
+import faiss
+import numpy as np
+
+# Faiss Index Configuration
+FAISS_INDEX_FILE = "faiss_index.index"
+FAISS_METADATA_DB = os.getenv("FAISS_METADATA_DB", "faiss_metadata.db")
+FAISS_PERSIST_INTERVAL = float(os.getenv("FAISS_PERSIST_INTERVAL", "60"))
+FAISS_PERSIST_DIRTY_THRESHOLD = int(os.getenv("FAISS_PERSIST_DIRTY_THRESHOLD", "20"))
+
+# Index type: "flat" (exact inner product), "hnsw" or "ivfpq". Embeddings are
+# L2-normalised, so inner product is cosine similarity.
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat").lower()
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "80"))
+FAISS_HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+# IVF-PQ needs training data, so the index stays flat until it holds this many vectors
+FAISS_IVF_TRAIN_THRESHOLD = int(os.getenv("FAISS_IVF_TRAIN_THRESHOLD", "20000"))
+FAISS_IVF_NPROBE = int(os.getenv("FAISS_IVF_NPROBE", "16"))
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "16"))
+FAISS_PQ_NBITS = int(os.getenv("FAISS_PQ_NBITS", "8"))
+
+# Minimum cosine similarity for a cache hit. Approximate indexes score slightly
+# lower than exact search, so each type gets its own default. A squared L2
+# distance of 1.0 on unit vectors (the old cutoff) equals a cosine of 0.5.
+FAISS_MIN_SIMILARITY = {
+    "flat": float(os.getenv("FAISS_MIN_SIMILARITY_FLAT", "0.5")),
+    "hnsw": float(os.getenv("FAISS_MIN_SIMILARITY_HNSW", "0.5")),
+    "ivfpq": float(os.getenv("FAISS_MIN_SIMILARITY_IVFPQ", "0.45")),
+}
+
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+
+
+def build_index(index_type, dimension, train_vectors=None, nlist=None):
+    """
+    Create an empty `IndexIDMap` of the requested type using inner-product scoring.
+
+    "ivfpq" requires `train_vectors`; without them a flat index is returned.
+    `nlist` defaults to roughly 4 * sqrt(len(train_vectors)).
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown Faiss index type: {index_type}")
+
+    if index_type == "hnsw":
+        base = faiss.IndexHNSWFlat(dimension, FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        base.hnsw.efConstruction = FAISS_HNSW_EF_CONSTRUCTION
+        base.hnsw.efSearch = FAISS_HNSW_EF_SEARCH
+    elif index_type == "ivfpq" and train_vectors is not None:
+        train_vectors = np.ascontiguousarray(train_vectors, dtype=np.float32)
+        if nlist is None:
+            nlist = int(4 * np.sqrt(len(train_vectors)))
+        # Faiss wants at least 39 training points per list
+        nlist = max(1, min(nlist, len(train_vectors) // 39))
+        # More than 256 points per list adds training time without improving the centroids
+        if len(train_vectors) > 256 * nlist:
+            sample = np.random.default_rng(0).choice(len(train_vectors), 256 * nlist, replace=False)
+            train_vectors = train_vectors[sample]
+
+        quantizer = faiss.IndexFlatIP(dimension)
+        base = faiss.IndexIVFPQ(quantizer, dimension, nlist, FAISS_PQ_M, FAISS_PQ_NBITS,
+                                faiss.METRIC_INNER_PRODUCT)
+        base.train(train_vectors)
+        base.nprobe = min(FAISS_IVF_NPROBE, nlist)
+    else:
+        base = faiss.IndexFlatIP(dimension)
+
+    return faiss.IndexIDMap(base)
+
+
+def configure_search(index):
+    """Apply the configured search-time parameters to a loaded index"""
+    base = faiss.downcast_index(index.index)
+    if isinstance(base, faiss.IndexHNSWFlat):
+        base.hnsw.efSearch = FAISS_HNSW_EF_SEARCH
+    elif isinstance(base, faiss.IndexIVFPQ):
+        base.nprobe = min(FAISS_IVF_NPROBE, base.nlist)
+
+
+def index_kind(index):
+    """Return "flat", "hnsw", "ivfpq" or None for a loaded index"""
+    if not isinstance(index, faiss.IndexIDMap) or index.metric_type != faiss.METRIC_INNER_PRODUCT:
+        return None
+    base = faiss.downcast_index(index.index)
+    if isinstance(base, faiss.IndexHNSWFlat):
+        return "hnsw"
+    if isinstance(base, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(base, faiss.IndexFlat):
+        return "flat"
+    return None
+
+
+class FaissMetadataTable:
+    """
+    Local SQLite side table mapping each Faiss vector ID to its cached answer.
+
+    The embedding is stored alongside the question, response and language so
+    the index can be rebuilt from this table alone without re-embedding.
+    """
+
+    def __init__(self, path=FAISS_METADATA_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS faiss_entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question TEXT NOT NULL,
+                response TEXT,
+                language TEXT,
+                embedding BLOB NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS faiss_entries_question ON faiss_entries (question)")
+        self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM faiss_entries").fetchone()[0]
+
+    def insert(self, question, response, language, embedding):
+        """Insert an entry and return its Faiss vector ID"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO faiss_entries (question, response, language, embedding) VALUES (?, ?, ?, ?)",
+                (question, response, language, np.asarray(embedding, dtype=np.float32).tobytes()),
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def find(self, question):
+        """Return the vector ID of an entry for exactly this question, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM faiss_entries WHERE question = ? ORDER BY id LIMIT 1", (question,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def update(self, vector_id, response, language):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE faiss_entries SET response = ?, language = ? WHERE id = ?",
+                (response, language, int(vector_id)),
+            )
+            self._conn.commit()
+
+    def get(self, vector_id):
+        """Return the entry for a Faiss vector ID, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT question, response, language FROM faiss_entries WHERE id = ?",
+                (int(vector_id),),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"question": row[0], "response": row[1], "language": row[2]}
+
+    def embeddings(self, after_id=0):
+        """Return (ids, embeddings) stored in the table, optionally only those after `after_id`"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, embedding FROM faiss_entries WHERE id > ? ORDER BY id",
+                (int(after_id),),
+            ).fetchall()
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        vectors = [np.frombuffer(row[1], dtype=np.float32) for row in rows]
+        return ids, vectors
+
+    def replace_all(self, entries):
+        """Replace the table contents with (question, response, language, embedding) tuples"""
+        with self._lock:
+            self._conn.execute("DELETE FROM faiss_entries")
+            self._conn.executemany(
+                "INSERT INTO faiss_entries (question, response, language, embedding) VALUES (?, ?, ?, ?)",
+                [
+                    (question, response, language, np.asarray(embedding, dtype=np.float32).tobytes())
+                    for question, response, language, embedding in entries
+                ],
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class FaissIndexManager:
+    """
+    Keeps the Faiss index resident in memory for the lifetime of the server.
+
+    The index is an `IndexIDMap` whose IDs are keys into a local
+    `FaissMetadataTable`, so a semantic hit resolves to its answer without a
+    network call. The index is loaded once (from storage, falling
+    back to the local copy) and every search is served from memory. Additions
+    mark the index as dirty; a background thread writes it to local disk and
+    uploads it to storage every `persist_interval` seconds, or sooner once
+    `dirty_threshold` additions have accumulated.
+
+    Scores are cosine similarities. With `index_type="ivfpq"` the index stays
+    exact until it holds `FAISS_IVF_TRAIN_THRESHOLD` vectors, after which the
+    background thread trains an IVF-PQ index and swaps it in.
+    """
+
+    def __init__(self, storage, dimension, index_file=FAISS_INDEX_FILE,
+                 metadata=None, index_type=FAISS_INDEX_TYPE,
+                 persist_interval=FAISS_PERSIST_INTERVAL,
+                 dirty_threshold=FAISS_PERSIST_DIRTY_THRESHOLD):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown Faiss index type: {index_type}")
+
+        self.storage = storage
+        self.dimension = dimension
+        self.index_file = index_file
+        self.metadata = metadata or FaissMetadataTable()
+        self.index_type = index_type
+        self.min_similarity = FAISS_MIN_SIMILARITY[index_type]
+        self.persist_interval = persist_interval
+        self.dirty_threshold = dirty_threshold
+
+        self._index = None
+        self._dirty = 0
+        self._lock = threading.Lock()
+        self._persist_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def ntotal(self):
+        with self._lock:
+            return self._index.ntotal if self._index is not None else 0
+
+    def _expected_kind(self, ntotal):
+        if self.index_type == "ivfpq" and ntotal < FAISS_IVF_TRAIN_THRESHOLD:
+            return "flat"
+        return self.index_type
+
+    def load(self):
+        """Load the index once and start the background persistence thread"""
+        index = None
+        try:
+            self.storage.download(self.index_file, self.index_file)
+            index = faiss.read_index(self.index_file)
+            print(f"Loaded Faiss index from storage ({index.ntotal} vectors)")
+        except Exception as e:
+            print(f"Could not download Faiss index: {e}")
+            if os.path.exists(self.index_file):
+                try:
+                    index = faiss.read_index(self.index_file)
+                    print(f"Loaded local Faiss index ({index.ntotal} vectors)")
+                except Exception as e:
+                    print(f"Could not read local Faiss index: {e}")
+
+        # IDs in a legacy (L2 or non-IDMap) index, one of another type, or one
+        # out of step with the local side table cannot be used, so rebuild it
+        # from the table.
+        count = self.metadata.count()
+        if index is None or index_kind(index) != self._expected_kind(count) or index.ntotal != count:
+            self.rebuild_from_table()
+        else:
+            configure_search(index)
+            with self._lock:
+                self._index = index
+                self._dirty = 0
+
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._persist_loop, name="faiss-persist", daemon=True)
+            self._thread.start()
+
+    def rebuild_from_table(self):
+        """Rebuild the in-memory index from the embeddings in the side table"""
+        ids, vectors = self.metadata.embeddings()
+        kind = self._expected_kind(len(ids))
+        matrix = np.vstack(vectors) if len(ids) else None
+        index = build_index(kind, self.dimension, matrix if kind == "ivfpq" else None)
+        if len(ids):
+            index.add_with_ids(matrix, ids)
+
+        # Building (and training) happens without the lock; entries added in
+        # the meantime are caught up before the new index is swapped in.
+        with self._lock:
+            last_id = int(ids[-1]) if len(ids) else 0
+            tail_ids, tail_vectors = self.metadata.embeddings(after_id=last_id)
+            if len(tail_ids):
+                index.add_with_ids(np.vstack(tail_vectors), tail_ids)
+            self._index = index
+            self._dirty = max(self._dirty, 1)
+        print(f"Rebuilt {kind} Faiss index from metadata table ({index.ntotal} vectors)")
+
+    def _maybe_train(self):
+        """Switch to a trained IVF-PQ index once enough vectors have accumulated"""
+        if self.index_type != "ivfpq":
+            return
+        with self._lock:
+            needs_training = (
+                index_kind(self._index) == "flat"
+                and self._index.ntotal >= FAISS_IVF_TRAIN_THRESHOLD
+            )
+        if needs_training:
+            self.rebuild_from_table()
+
+    def rebuild(self, entries):
+        """
+        Replace the side table and index with freshly embedded entries.
+
+        Args:
+            entries: iterable of (question, response, language, embedding) tuples
+                with embeddings already normalised
+        """
+        self.metadata.replace_all(entries)
+        self.rebuild_from_table()
+        self._wake.set()
+
+    def search(self, vectors, top_k=1):
+        """
+        Search the in-memory index; `vectors` must already be normalised.
+
+        Returns (similarities, ids) as Faiss does; similarities are cosines.
+        """
+        with self._lock:
+            return self._index.search(vectors, top_k)
+
+    def get_entry(self, vector_id):
+        """Return the question/response/language stored for a vector ID"""
+        if vector_id < 0:
+            return None
+        return self.metadata.get(vector_id)
+
+    def add(self, embedding, question, response=None, language=None):
+        """
+        Add one normalised embedding with its answer and schedule persistence.
+        A question already in the index keeps its vector and gets the new
+        answer, so adding is idempotent (e.g. when a job is retried).
+        """
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        with self._lock:
+            vector_id = self.metadata.find(question)
+            if vector_id is not None:
+                self.metadata.update(vector_id, response, language)
+                return vector_id
+            vector_id = self.metadata.insert(question, response, language, embedding[0])
+            self._index.add_with_ids(embedding, np.array([vector_id], dtype=np.int64))
+            self._dirty += 1
+            dirty = self._dirty
+
+        if dirty >= self.dirty_threshold:
+            self._wake.set()
+        return vector_id
+
+    def persist(self):
+        """Write the index to local disk and upload it to storage if it changed"""
+        with self._persist_lock:
+            # Serialise under the index lock, then do the slow I/O without it
+            # so searches are never blocked on disk or network.
+            with self._lock:
+                if self._index is None or self._dirty == 0:
+                    return False
+                data = faiss.serialize_index(self._index)
+                dirty = self._dirty
+                self._dirty = 0
+
+            try:
+                tmp_path = f"{self.index_file}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data.tobytes())
+                os.replace(tmp_path, self.index_file)
+
+                # Resumable in chunks once the index is large (see storage_backends.py)
+                self.storage.upload_file(self.index_file, self.index_file)
+                print(f"Persisted Faiss index ({dirty} new vectors)")
+                return True
+            except Exception as e:
+                # Keep the changes marked dirty so the next cycle retries
+                with self._lock:
+                    self._dirty += dirty
+                print(f"Error persisting Faiss index: {e}")
+                return False
+
+    def close(self):
+        """Stop the background thread and flush any pending changes"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.persist()
+
+    def _persist_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.persist_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self._maybe_train()
+            except Exception as e:
+                print(f"Error training Faiss index: {e}")
+            self.persist()
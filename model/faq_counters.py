@@ -0,0 +1,168 @@
+import os
+import threading
+
+FAQ_COLLECTION = "frequent_questions"
+FAQ_FLUSH_INTERVAL = float(os.getenv("FAQ_FLUSH_INTERVAL", "5"))
+FAQ_FLUSH_THRESHOLD = int(os.getenv("FAQ_FLUSH_THRESHOLD", "100"))
+# A question is added to Faiss once it has been asked more than this many times
+FAQ_PROMOTION_COUNT = int(os.getenv("FAQ_PROMOTION_COUNT", "3"))
+# Firestore rejects batches of more than 500 writes
+FIRESTORE_BATCH_LIMIT = 500
+
+
+def normalize_question(question):
+    return question.lower().strip()
+
+
+class FaqCounterTable:
+    """
+    In-memory FAQ counters with write-behind persistence to Firestore.
+
+    The `frequent_questions` collection is read once by `load()`. Each asked
+    question then only updates this table; the accumulated increments are
+    written in batches of increments by a background thread every
+    `flush_interval` seconds, or sooner once `flush_threshold` questions are
+    pending. Because the writes are increments, replicas sharing the
+    collection do not overwrite each other's counts.
+
+    `promote(question, response, language)` is called once for a question when
+    its count first exceeds `promotion_count`.
+    """
+
+    def __init__(self, db, promote, collection=FAQ_COLLECTION,
+                 flush_interval=FAQ_FLUSH_INTERVAL,
+                 flush_threshold=FAQ_FLUSH_THRESHOLD,
+                 promotion_count=FAQ_PROMOTION_COUNT):
+        self.db = db
+        self.promote = promote
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.promotion_count = promotion_count
+
+        self._entries = {}   # question -> {"count", "response"}
+        self._promoted = set()
+        self._pending = {}   # question -> (increment, response)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load(self):
+        """Hydrate the table from Firestore once and start the flush thread"""
+        entries = {doc.id: doc.to_dict() for doc in self.db.collection(self.collection).stream()}
+        with self._lock:
+            self._entries = entries
+            # Questions already past the threshold were promoted before
+            self._promoted = {
+                question for question, data in entries.items()
+                if data.get("count", 0) > self.promotion_count
+            }
+        print(f"Loaded {len(entries)} frequent questions")
+
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._flush_loop, name="faq-flush", daemon=True)
+            self._thread.start()
+
+    def record(self, question, response, language=None):
+        """Count one occurrence of `question` and return its new count"""
+        question = normalize_question(question)
+        with self._lock:
+            entry = self._entries.setdefault(question, {"count": 0})
+            entry["count"] = entry.get("count", 0) + 1
+            entry["response"] = response
+            count = entry["count"]
+
+            increment, _ = self._pending.get(question, (0, None))
+            self._pending[question] = (increment + 1, response)
+            if len(self._pending) >= self.flush_threshold:
+                self._wake.set()
+
+            promote = count > self.promotion_count and question not in self._promoted
+            if promote:
+                self._promoted.add(question)
+
+        if promote:
+            try:
+                self.promote(question, response, language)
+            except Exception as e:
+                # The count is already recorded; promotion is retried next time
+                with self._lock:
+                    self._promoted.discard(question)
+                print(f"Could not promote frequent question to Faiss: {e}")
+            else:
+                print(f"Promoted to Faiss database: {question}")
+        return count
+
+    def set(self, question, data):
+        """Overwrite a question's entry, in memory and in Firestore right away"""
+        question = normalize_question(question)
+        self.db.collection(self.collection).document(question).set(data)
+        with self._lock:
+            self._entries[question] = dict(data)
+            self._pending.pop(question, None)
+            if data.get("count", 0) > self.promotion_count:
+                self._promoted.add(question)
+
+    def all(self):
+        with self._lock:
+            return {question: dict(data) for question, data in self._entries.items()}
+
+    def flush(self):
+        """Write the pending increments to Firestore; returns the number of questions written"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            items = list(pending.items())
+            written = 0
+            try:
+                collection = self.db.collection(self.collection)
+                for start in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+                    batch = self.db.batch()
+                    for question, (increment, response) in items[start:start + FIRESTORE_BATCH_LIMIT]:
+                        batch.set(
+                            collection.document(question),
+                            {"count": self.db.increment(increment), "response": response},
+                            merge=True
+                        )
+                    batch.commit()
+                    written = start + FIRESTORE_BATCH_LIMIT
+            except Exception as e:
+                # Put back what was not committed so the next flush retries it
+                with self._lock:
+                    for question, (increment, response) in items[written:]:
+                        newer, newer_response = self._pending.get(question, (0, None))
+                        self._pending[question] = (increment + newer, newer_response or response)
+                print(f"Error flushing frequent questions: {e}")
+                return 0
+            return len(items)
+
+    def close(self):
+        """Stop the flush thread and write any pending increments"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "questions": len(self._entries),
+                "promoted": len(self._promoted),
+                "pending": len(self._pending),
+            }
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            self.flush()
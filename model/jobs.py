@@ -0,0 +1,219 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from scheduler import QueueFullError
+
+# Relative paths are resolved against this directory, not the working directory
+JOBS_SPOOL = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.getenv("JOBS_SPOOL", "jobs_spool.db"))
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+JOBS_MAX_QUEUE = int(os.getenv("JOBS_MAX_QUEUE", "1000"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "5"))
+# Retries wait backoff * 2^(attempt - 1) seconds
+JOBS_RETRY_BACKOFF = float(os.getenv("JOBS_RETRY_BACKOFF", "2"))
+
+
+class JobQueue:
+    """
+    Background jobs that run after the response has been sent.
+
+    Jobs are spooled to SQLite before `enqueue()` returns, so work queued
+    before a crash or restart is picked up again by `start()`. Worker threads
+    run due jobs oldest first; a failing job is retried with exponential
+    backoff and kept as "failed" after `max_attempts`. At most `max_queue`
+    jobs may wait; beyond that `enqueue()` raises `QueueFullError`.
+
+    Handlers are registered by name and receive the pickled arguments given
+    to `enqueue()`, so those must be plain data. They can be registered before
+    the spool exists; it is opened by `start()`.
+    """
+
+    def __init__(self, path=JOBS_SPOOL, workers=JOBS_WORKERS, max_queue=JOBS_MAX_QUEUE,
+                 max_attempts=JOBS_MAX_ATTEMPTS, retry_backoff=JOBS_RETRY_BACKOFF):
+        self.path = path
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.handlers = {}
+
+        self._completed = {}
+        self._retried = {}
+        self._avg_seconds = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._stop = False
+        self._threads = []
+        self._conn = None
+
+    def _open(self):
+        if self._conn is not None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                state TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                enqueued_at REAL NOT NULL,
+                run_after REAL NOT NULL,
+                last_error TEXT
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_due ON jobs (state, run_after)")
+        self._conn.commit()
+
+    def register(self, name):
+        """Decorator registering `handler(*args, **kwargs)` for jobs called `name`"""
+        def decorator(handler):
+            self.handlers[name] = handler
+            return handler
+        return decorator
+
+    def enqueue(self, name, *args, **kwargs):
+        """Spool a job and wake a worker; returns the job ID"""
+        if name not in self.handlers:
+            raise KeyError(f"No handler registered for job '{name}'")
+        payload = pickle.dumps((args, kwargs))
+        now = time.time()
+        with self._lock:
+            self._open()
+            depth = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+            if depth >= self.max_queue:
+                raise QueueFullError("jobs", depth, depth * self._mean_seconds() / max(1, self.workers))
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (name, payload, enqueued_at, run_after) VALUES (?, ?, ?, ?)",
+                (name, payload, now, now),
+            )
+            self._conn.commit()
+            self._wake.notify()
+            return cursor.lastrowid
+
+    def start(self):
+        """Requeue jobs interrupted by a restart and start the worker threads"""
+        with self._lock:
+            if self._threads:
+                return
+            self._open()
+            self._stop = False
+            recovered = self._conn.execute("UPDATE jobs SET state = 'queued' WHERE state = 'running'").rowcount
+            self._conn.commit()
+            queued = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+        if queued:
+            print(f"Resuming {queued} spooled jobs ({recovered} interrupted)")
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self, timeout=10):
+        """Stop the workers after their current job; queued jobs stay in the spool"""
+        with self._lock:
+            self._stop = True
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _mean_seconds(self):
+        return sum(self._avg_seconds.values()) / len(self._avg_seconds) if self._avg_seconds else 1.0
+
+    def _claim(self):
+        """Mark the oldest due job as running and return it, waiting until one is due"""
+        with self._lock:
+            while not self._stop:
+                now = time.time()
+                row = self._conn.execute(
+                    "SELECT id, name, payload, attempts FROM jobs "
+                    "WHERE state = 'queued' AND run_after <= ? ORDER BY id LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute("UPDATE jobs SET state = 'running' WHERE id = ?", (row[0],))
+                    self._conn.commit()
+                    return row
+
+                next_due = self._conn.execute(
+                    "SELECT MIN(run_after) FROM jobs WHERE state = 'queued'"
+                ).fetchone()[0]
+                self._wake.wait(None if next_due is None else max(0.01, next_due - now))
+            return None
+
+    def _worker(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                return
+            job_id, name, payload, attempts = job
+            start = time.perf_counter()
+            try:
+                args, kwargs = pickle.loads(payload)
+                self.handlers[name](*args, **kwargs)
+            except Exception as e:
+                self._failed(job_id, name, attempts + 1, e)
+                continue
+
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+                self._conn.commit()
+                self._completed[name] = self._completed.get(name, 0) + 1
+                self._avg_seconds[name] = 0.8 * self._avg_seconds.get(name, elapsed) + 0.2 * elapsed
+
+    def _failed(self, job_id, name, attempts, error):
+        with self._lock:
+            if attempts >= self.max_attempts:
+                print(f"Job {name} #{job_id} failed after {attempts} attempts: {error}")
+                self._conn.execute(
+                    "UPDATE jobs SET state = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                    (attempts, str(error), job_id),
+                )
+            else:
+                delay = self.retry_backoff * 2 ** (attempts - 1)
+                print(f"Job {name} #{job_id} failed (attempt {attempts}), retrying in {delay:.1f}s: {error}")
+                self._conn.execute(
+                    "UPDATE jobs SET state = 'queued', attempts = ?, last_error = ?, run_after = ? WHERE id = ?",
+                    (attempts, str(error), time.time() + delay, job_id),
+                )
+                self._retried[name] = self._retried.get(name, 0) + 1
+            self._conn.commit()
+            self._wake.notify()
+
+    def stats(self):
+        """Depth, lag and outcome counters per job name"""
+        now = time.time()
+        with self._lock:
+            rows = [] if self._conn is None else self._conn.execute(
+                "SELECT name, state, COUNT(*), MIN(enqueued_at) FROM jobs GROUP BY name, state"
+            ).fetchall()
+            names = set(self.handlers) | {row[0] for row in rows}
+            stats = {
+                name: {
+                    "queued": 0,
+                    "running": 0,
+                    "failed": 0,
+                    "lag_seconds": 0.0,
+                    "completed": self._completed.get(name, 0),
+                    "retried": self._retried.get(name, 0),
+                    "avg_seconds": round(self._avg_seconds.get(name, 0.0), 4),
+                }
+                for name in names
+            }
+            for name, state, count, oldest in rows:
+                stats[name][state] = count
+                if state == "queued":
+                    # How long the oldest waiting job has been in the queue
+                    stats[name]["lag_seconds"] = round(now - oldest, 3)
+            return {"workers": self.workers, "max_queue": self.max_queue, "jobs": stats}
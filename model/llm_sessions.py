@@ -0,0 +1,191 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+# Saved llama.cpp states (KV cache + logits) are kept in memory up to this
+# budget, then spilled to disk. A full 2048-token state of a 7B model is
+# roughly 1 GB, so the defaults hold a couple of sessions in RAM.
+LLM_STATE_MEMORY_BUDGET_MB = int(os.getenv("LLM_STATE_MEMORY_BUDGET_MB", "2048"))
+LLM_STATE_DISK_BUDGET_MB = int(os.getenv("LLM_STATE_DISK_BUDGET_MB", "16384"))
+LLM_STATE_SPILL_DIR = os.getenv("LLM_STATE_SPILL_DIR", "llm_states")
+
+
+def session_key(user_id=None, chat_id=None):
+    """Build the key identifying one conversation"""
+    return f"{user_id or 'anonymous'}:{chat_id or 'default'}"
+
+
+class LlamaStatePool:
+    """
+    LRU pool of saved llama.cpp states with a memory budget.
+
+    States evicted from memory are pickled to `spill_dir` (itself bounded by
+    `disk_budget` bytes, oldest first) and read back on the next lookup.
+    """
+
+    def __init__(self, memory_budget=LLM_STATE_MEMORY_BUDGET_MB * 1024 * 1024,
+                 disk_budget=LLM_STATE_DISK_BUDGET_MB * 1024 * 1024,
+                 spill_dir=LLM_STATE_SPILL_DIR):
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.spill_dir = spill_dir
+        os.makedirs(spill_dir, exist_ok=True)
+
+        self._memory = OrderedDict()  # key -> (state, size)
+        self._disk = OrderedDict()    # key -> (path, size)
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _state_size(state):
+        return getattr(state, "llama_state_size", 0) or len(getattr(state, "llama_state", b""))
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".state")
+
+    def get(self, key):
+        """Return the saved state for `key` (from memory or disk), or None"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key][0]
+            spilled = self._disk.pop(key, None)
+
+        if spilled is None:
+            return None
+
+        path, size = spilled
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+            os.remove(path)
+        except Exception as e:
+            print(f"Could not restore spilled LLM state for {key}: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._disk_bytes -= size
+
+        self.put(key, state)
+        return state
+
+    def put(self, key, state):
+        """Store `state` for `key`, spilling least recently used states to disk"""
+        size = self._state_size(state)
+        evicted = []
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= self._memory.pop(key)[1]
+            self._memory[key] = (state, size)
+            self._memory_bytes += size
+            while self._memory_bytes > self.memory_budget and len(self._memory) > 1:
+                old_key, (old_state, old_size) = self._memory.popitem(last=False)
+                self._memory_bytes -= old_size
+                evicted.append((old_key, old_state, old_size))
+
+        for old_key, old_state, old_size in evicted:
+            self._spill(old_key, old_state, old_size)
+
+    def discard(self, key):
+        """Forget any saved state for `key`"""
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= self._memory.pop(key)[1]
+            spilled = self._disk.pop(key, None)
+            if spilled is not None:
+                self._disk_bytes -= spilled[1]
+        if spilled is not None and os.path.exists(spilled[0]):
+            os.remove(spilled[0])
+
+    def _spill(self, key, state, size):
+        path = self._spill_path(key)
+        try:
+            with open(path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            print(f"Could not spill LLM state for {key}: {e}")
+            return
+
+        removed = []
+        with self._lock:
+            self._disk[key] = (path, size)
+            self._disk_bytes += size
+            while self._disk_bytes > self.disk_budget and len(self._disk) > 1:
+                _, (old_path, old_size) = self._disk.popitem(last=False)
+                self._disk_bytes -= old_size
+                removed.append(old_path)
+
+        for old_path in removed:
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_sessions": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_sessions": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+
+
+class LlamaSessionManager:
+    """
+    Runs llama.cpp completions with per-conversation KV-cache reuse.
+
+    The context currently loaded in `llm` belongs to one session. When a turn
+    arrives for another session, the loaded context is saved to the pool and
+    the requested session's state is restored; llama.cpp then matches the
+    longest common prompt prefix and only evaluates the new tokens. Calls are
+    serialised because a `Llama` instance is not thread-safe.
+    """
+
+    def __init__(self, llm, pool=None):
+        self.llm = llm
+        self.pool = pool or LlamaStatePool()
+        self._active = None
+        self._lock = threading.Lock()
+
+    def _activate(self, key):
+        if self._active == key:
+            return
+        if self._active is not None:
+            self.pool.put(self._active, self.llm.save_state())
+        state = self.pool.get(key)
+        if state is not None:
+            self.llm.load_state(state)
+        self._active = key
+
+    def __call__(self, key, prompt, **kwargs):
+        """Run `llm(prompt, **kwargs)` in the context of session `key`"""
+        with self._lock:
+            self._activate(key)
+            return self.llm(prompt, **kwargs)
+
+    def stream(self, key, prompt, **kwargs):
+        """
+        Yield completion chunks of `llm(prompt, stream=True, **kwargs)` for session `key`.
+
+        The model stays locked to this session until the generator is exhausted
+        or closed.
+        """
+        with self._lock:
+            self._activate(key)
+            for chunk in self.llm(prompt, stream=True, **kwargs):
+                yield chunk
+
+    def count_tokens(self, text):
+        return len(self.llm.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def stats(self):
+        return {"active_session": self._active, "states": self.pool.stats()}
+
+    def forget(self, key):
+        """Drop the saved state of a finished conversation"""
+        with self._lock:
+            if self._active == key:
+                self._active = None
+            self.pool.discard(key)
@@ -0,0 +1,101 @@
+"""
+Throughput and latency of the LLM engine against the number of concurrent
+conversations, for an in-process model and pools of llama.cpp workers.
+
+    python llm_throughput_benchmark.py --workers 1,2,4 --concurrency 1,2,4,8
+
+Each simulated user holds its own session and sends --turns requests one
+after another. Tokens/s counts generated tokens across all users.
+"""
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+
+from llm_sessions import LlamaSessionManager
+from llm_workers import LLM_THREADS, LlamaWorkerPool
+
+PROMPTS = [
+    "I have trouble sleeping before exams. What can I do?",
+    "How can I explain to my friends that I need some time alone?",
+    "Give me a short breathing exercise for when I feel anxious.",
+    "What are some small habits that help with low mood?",
+]
+
+
+def create_engine(model_path, workers, n_ctx):
+    if workers > 1:
+        return LlamaWorkerPool(model_path, workers, llama_kwargs={"n_ctx": n_ctx})
+    from llama_cpp import Llama
+
+    return LlamaSessionManager(Llama(model_path=model_path, n_ctx=n_ctx, n_threads=LLM_THREADS, verbose=False))
+
+
+def run_level(engine, concurrency, turns, max_tokens):
+    latencies = []
+    tokens = []
+    lock = threading.Lock()
+
+    def user(index):
+        key = f"bench:{concurrency}:{index}"
+        history = ""
+        for turn in range(turns):
+            prompt = f"{history}User: {PROMPTS[(index + turn) % len(PROMPTS)]}\nAssistant:"
+            start = time.perf_counter()
+            output = engine(key, prompt, max_tokens=max_tokens, stop=["User:"], temperature=0.7)
+            elapsed = time.perf_counter() - start
+            text = output["choices"][0]["text"]
+            history = f"{prompt}{text}\n"
+            with lock:
+                latencies.append(elapsed)
+                tokens.append(output["usage"]["completion_tokens"])
+        engine.forget(key)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    return {
+        "requests_per_s": len(latencies) / wall,
+        "tokens_per_s": sum(tokens) / wall,
+        "p50": float(np.percentile(latencies, 50)),
+        "p95": float(np.percentile(latencies, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-path", default=os.getenv("MODEL_PATH"))
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--concurrency", default="1,2,4,8")
+    parser.add_argument("--turns", type=int, default=3, help="Requests per simulated user")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--n-ctx", type=int, default=2048)
+    args = parser.parse_args()
+
+    if not args.model_path:
+        raise SystemExit("Set MODEL_PATH or pass --model-path")
+
+    print(f"{'workers':>7} {'users':>5} {'req/s':>7} {'tok/s':>7} {'p50_s':>7} {'p95_s':>7}")
+    for workers in [int(value) for value in args.workers.split(",")]:
+        engine = create_engine(args.model_path, workers, args.n_ctx)
+        # Warm up so model loading and first-call setup are not measured
+        engine("bench:warmup", "Hello", max_tokens=8)
+        try:
+            for concurrency in [int(value) for value in args.concurrency.split(",")]:
+                result = run_level(engine, concurrency, args.turns, args.max_tokens)
+                print(f"{workers:>7} {concurrency:>5} {result['requests_per_s']:>7.2f} "
+                      f"{result['tokens_per_s']:>7.1f} {result['p50']:>7.2f} {result['p95']:>7.2f}")
+        finally:
+            if isinstance(engine, LlamaWorkerPool):
+                engine.close()
+
+
+if __name__ == "__main__":
+    main()
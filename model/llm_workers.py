@@ -0,0 +1,283 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+from llm_sessions import LLM_STATE_MEMORY_BUDGET_MB, LLM_STATE_SPILL_DIR
+
+# Number of llama.cpp worker processes. Each loads the GGUF with mmap, so the
+# weights are shared through the page cache and every extra worker only costs
+# its own KV cache and saved session states. 1 keeps the model in-process.
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "1"))
+# Total llama.cpp threads, split evenly between the workers
+LLM_THREADS = int(os.getenv("LLM_THREADS", "8"))
+# A session normally stays on the worker holding its KV cache; it moves to an
+# idle worker once this many requests are already in flight on its own
+LLM_REBALANCE_DEPTH = int(os.getenv("LLM_REBALANCE_DEPTH", "2"))
+LLM_AFFINITY_SIZE = int(os.getenv("LLM_AFFINITY_SIZE", "10000"))
+
+
+class LlmWorkerError(Exception):
+    """Raised when a worker process fails a request or exits"""
+
+
+def _worker_main(worker_id, model_path, llama_kwargs, requests, responses, cancelled):
+    """Serve requests for one worker process until it receives None"""
+    from llama_cpp import Llama
+
+    from llm_sessions import LlamaSessionManager, LlamaStatePool
+
+    llm = Llama(model_path=model_path, **llama_kwargs)
+    pool = LlamaStatePool(
+        memory_budget=LLM_STATE_MEMORY_BUDGET_MB * 1024 * 1024 // max(1, LLM_WORKERS),
+        spill_dir=os.path.join(LLM_STATE_SPILL_DIR, f"worker-{worker_id}"),
+    )
+    sessions = LlamaSessionManager(llm, pool)
+    responses.put(("ready", worker_id, None))
+
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        request_id, op, key, prompt, kwargs = message
+        try:
+            if op == "complete":
+                responses.put(("result", request_id, sessions(key, prompt, **kwargs)))
+            elif op == "stream":
+                stream = sessions.stream(key, prompt, **kwargs)
+                try:
+                    for chunk in stream:
+                        if cancelled.value == request_id:
+                            break
+                        responses.put(("chunk", request_id, chunk))
+                finally:
+                    stream.close()
+                responses.put(("done", request_id, None))
+            elif op == "forget":
+                sessions.forget(key)
+                responses.put(("result", request_id, None))
+        except Exception as e:
+            responses.put(("error", request_id, f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, worker_id):
+        self.id = worker_id
+        self.process = None
+        self.requests = None
+        self.cancelled = None
+        self.ready = threading.Event()
+        self.in_flight = 0
+        self.completed = 0
+        self.restarts = 0
+
+
+class LlamaWorkerPool:
+    """
+    Serves several conversations at once from a pool of llama.cpp processes.
+
+    Has the same interface as `LlamaSessionManager`. Each session is routed to
+    the worker that already holds its KV cache; new sessions go to the least
+    busy worker. A session only moves when its worker has `rebalance_depth`
+    requests in flight while another is idle, trading one prompt re-evaluation
+    for not queueing. Workers that exit are restarted and their requests fail.
+    """
+
+    def __init__(self, model_path, workers=LLM_WORKERS, llama_kwargs=None,
+                 rebalance_depth=LLM_REBALANCE_DEPTH, affinity_size=LLM_AFFINITY_SIZE):
+        from llama_cpp import Llama
+
+        self.model_path = model_path
+        self.llama_kwargs = dict(llama_kwargs or {})
+        self.llama_kwargs.setdefault("n_threads", max(1, LLM_THREADS // workers))
+        self.rebalance_depth = rebalance_depth
+        self.affinity_size = affinity_size
+
+        # Vocabulary only, for counting tokens in this process
+        self.tokenizer = Llama(model_path=model_path, vocab_only=True, verbose=False)
+
+        self._context = multiprocessing.get_context("spawn")
+        self._responses = self._context.Queue()
+        self._workers = [_Worker(i) for i in range(workers)]
+        self._affinity = OrderedDict()  # session key -> worker
+        self._pending = {}              # request id -> (worker, output queue or None)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+
+        for worker in self._workers:
+            self._start(worker)
+        self._listener = threading.Thread(target=self._listen, name="llm-pool-listener", daemon=True)
+        self._listener.start()
+
+        for worker in self._workers:
+            while not worker.ready.wait(1):
+                if not worker.process.is_alive():
+                    self.close()
+                    raise LlmWorkerError(f"LLM worker {worker.id} exited while loading the model")
+        print(f"Started {workers} LLM worker processes")
+
+    def _start(self, worker):
+        worker.ready.clear()
+        worker.requests = self._context.Queue()
+        worker.cancelled = self._context.Value("q", -1)
+        worker.process = self._context.Process(
+            target=_worker_main,
+            args=(worker.id, self.model_path, self.llama_kwargs, worker.requests, self._responses, worker.cancelled),
+            name=f"llm-worker-{worker.id}",
+            daemon=True,
+        )
+        worker.process.start()
+
+    def _route(self, key):
+        """Pick the worker for session `key` (caller holds the lock)"""
+        idle = min(self._workers, key=lambda w: (w.in_flight, not w.ready.is_set()))
+        worker = self._affinity.get(key)
+        if worker is None or (worker.in_flight >= self.rebalance_depth and idle.in_flight == 0):
+            if worker is not None:
+                self._send(worker, "forget", key, None, {}, None)
+            worker = idle
+        self._affinity[key] = worker
+        self._affinity.move_to_end(key)
+        while len(self._affinity) > self.affinity_size:
+            self._affinity.popitem(last=False)
+        return worker
+
+    def _send(self, worker, op, key, prompt, kwargs, output):
+        """Queue a request on `worker` (caller holds the lock) and return its ID"""
+        request_id = next(self._ids)
+        self._pending[request_id] = (worker, output)
+        worker.in_flight += 1
+        worker.requests.put((request_id, op, key, prompt, kwargs))
+        return request_id
+
+    def _submit(self, key, op, prompt=None, kwargs=None):
+        output = queue.Queue()
+        with self._lock:
+            if self._closed:
+                raise LlmWorkerError("The LLM worker pool is closed")
+            worker = self._route(key)
+            request_id = self._send(worker, op, key, prompt, kwargs or {}, output)
+        return worker, request_id, output
+
+    @staticmethod
+    def _result(kind, payload):
+        if kind == "error":
+            raise LlmWorkerError(payload)
+        return payload
+
+    def __call__(self, key, prompt, **kwargs):
+        """Run `llm(prompt, **kwargs)` in the context of session `key` on its worker"""
+        _, _, output = self._submit(key, "complete", prompt, kwargs)
+        return self._result(*output.get())
+
+    def stream(self, key, prompt, **kwargs):
+        """Yield completion chunks for session `key`; closing the generator stops generation"""
+        worker, request_id, output = self._submit(key, "stream", prompt, kwargs)
+        finished = False
+        try:
+            while True:
+                kind, payload = output.get()
+                if kind == "chunk":
+                    yield payload
+                    continue
+                finished = True
+                self._result(kind, payload)
+                return
+        finally:
+            if not finished:
+                # Tell the worker to stop and drop the rest of the stream
+                worker.cancelled.value = request_id
+                with self._lock:
+                    if request_id in self._pending:
+                        self._pending[request_id] = (worker, None)
+
+    def forget(self, key):
+        """Drop the saved state of a finished conversation on its worker"""
+        with self._lock:
+            worker = self._affinity.pop(key, None)
+            if worker is not None and not self._closed:
+                self._send(worker, "forget", key, None, {}, None)
+
+    def count_tokens(self, text):
+        with self._lock:
+            return len(self.tokenizer.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def _listen(self):
+        while not self._closed:
+            try:
+                kind, request_id, payload = self._responses.get(timeout=1)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            except (EOFError, OSError):
+                return
+
+            if kind == "ready":
+                self._workers[request_id].ready.set()
+                continue
+
+            with self._lock:
+                pending = self._pending.get(request_id)
+                if pending is None:
+                    continue
+                worker, output = pending
+                if kind != "chunk":
+                    del self._pending[request_id]
+                    worker.in_flight -= 1
+                    worker.completed += 1
+            if output is not None:
+                output.put((kind, payload))
+
+    def _check_workers(self):
+        """Fail the requests of workers that exited and restart them"""
+        for worker in self._workers:
+            if self._closed or worker.process.is_alive():
+                continue
+            print(f"LLM worker {worker.id} exited (code {worker.process.exitcode}); restarting")
+            with self._lock:
+                failed = [
+                    (request_id, output)
+                    for request_id, (owner, output) in self._pending.items()
+                    if owner is worker
+                ]
+                for request_id, _ in failed:
+                    del self._pending[request_id]
+                worker.in_flight = 0
+                for key in [key for key, owner in self._affinity.items() if owner is worker]:
+                    del self._affinity[key]
+                worker.restarts += 1
+                self._start(worker)
+            for _, output in failed:
+                if output is not None:
+                    output.put(("error", f"LLM worker {worker.id} exited"))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": [
+                    {
+                        "id": worker.id,
+                        "ready": worker.ready.is_set(),
+                        "in_flight": worker.in_flight,
+                        "completed": worker.completed,
+                        "restarts": worker.restarts,
+                        "sessions": sum(1 for owner in self._affinity.values() if owner is worker),
+                    }
+                    for worker in self._workers
+                ],
+            }
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for worker in self._workers:
+                if worker.process is not None and worker.process.is_alive():
+                    worker.requests.put(None)
+        for worker in self._workers:
+            if worker.process is not None:
+                worker.process.join(10)
+                if worker.process.is_alive():
+                    worker.process.terminate()
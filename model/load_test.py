@@ -0,0 +1,339 @@
+"""
+End-to-end load test of the chat API with per-stage latency breakdown.
+
+By default the app runs in-process with offline stand-ins for Firestore,
+Storage, the translator, gTTS, Whisper, the embedding model and the LLM
+(see load_test_fakes.py), so it needs no network, credentials or model files
+and measures the server's own overhead: scheduling, batching, caches, Faiss
+and the background jobs.
+
+    python load_test.py --concurrency 8 --requests 200
+    python load_test.py --workload recorded.jsonl --concurrency 16 --json run.json
+    python load_test.py --real llm,embedding      # real models, fake services
+    python load_test.py --url http://localhost:8000 --requests 100
+
+A workload is a JSON-lines file replayed in order (and repeated as needed):
+
+    {"endpoint": "/chat/", "message": "...", "response_type": "text", "user_id": "u1", "chat_id": "c1"}
+    {"endpoint": "/chat/stream", "message": "...", "response_type": "both"}
+    {"endpoint": "/chat/audio/file", "audio": "clips/note.webm", "response_type": "both"}
+    {"endpoint": "/chat/audio/file", "seconds": 25, "response_type": "both", "stream": true}
+
+Without --workload a mixed one is generated: repeated and multilingual chat
+messages (so FAQ promotion, Faiss hits and translation all occur) and voice
+notes of 5-40 seconds of synthetic speech-like noise.
+
+Reports p50/p95/p99 latency and throughput per endpoint, and per stage
+(detect, translate, embedding, faiss, llm, whisper, tts, upload) from the
+app's stage timers (GET /stages). --real keeps the real implementation of
+storage, translation, tts, whisper, embedding or llm; model paths must then
+be absolute because the app runs in a scratch directory.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+from load_test_fakes import (
+    FakeBucket, FakeEncoder, FakeFirestore, FakeLlama, FakeTranslateBackend, FakeTTSEngine,
+    FakeWhisperBackend, Latency,
+)
+
+REAL_CHOICES = ("storage", "translation", "tts", "whisper", "embedding", "llm")
+
+ENGLISH_MESSAGES = [
+    "How can I manage stress before exams?",
+    "I have trouble sleeping at night. What can I do?",
+    "Give me a short breathing exercise for when I feel anxious.",
+    "What are some small habits that help with low mood?",
+    "How do I tell my friends I need some time alone?",
+    "I feel lonely since I moved to a new city.",
+]
+OTHER_MESSAGES = [
+    "Je me sens très stressé par mes examens.",
+    "Me siento solo desde que me mudé.",
+    "Ich kann nachts nicht schlafen, was soll ich tun?",
+    "Sono molto ansioso per il lavoro.",
+]
+
+
+def speech_like_wav(seconds, seed, sample_rate=16000):
+    """WAV bytes of noise bursts separated by short pauses, so the VAD finds split points"""
+    rng = np.random.default_rng(seed)
+    audio = np.zeros(int(seconds * sample_rate), dtype=np.float32)
+    position = 0
+    while position < len(audio):
+        burst = int(rng.uniform(1.5, 6) * sample_rate)
+        audio[position:position + burst] = rng.standard_normal(min(burst, len(audio) - position)) * 0.2
+        position += burst + int(rng.uniform(0.4, 1.0) * sample_rate)
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes((np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes())
+    return buffer.getvalue()
+
+
+def generate_workload(count, seed):
+    rng = random.Random(seed)
+    items = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.2:
+            items.append({
+                "endpoint": "/chat/audio/file",
+                "seconds": rng.choice([5, 10, 20, 40]),
+                "response_type": rng.choice(["text", "both"]),
+                "stream": rng.random() < 0.5,
+            })
+        else:
+            # Repeats of a few questions, like real traffic, get promoted to Faiss
+            message = rng.choice(OTHER_MESSAGES) if rng.random() < 0.25 else rng.choice(ENGLISH_MESSAGES)
+            items.append({
+                "endpoint": "/chat/stream" if kind < 0.35 else "/chat/",
+                "message": message,
+                "response_type": rng.choice(["text", "both"]),
+            })
+    return items
+
+
+def load_workload(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def install_fakes(app_module, latency, real):
+    """Point the app's model registry and services at the offline stand-ins"""
+    import transcription
+    from embeddings import EmbeddingService
+    from llm_sessions import LlamaSessionManager
+    from storage_backends import FirebaseStorage
+
+    models = app_module.models
+    if "storage" not in real:
+        # The real Firebase wrapper around in-memory stand-ins of its clients
+        models.register("storage")(lambda: FirebaseStorage(FakeFirestore(latency), FakeBucket(latency)))
+    if "llm" not in real:
+        models.register("llm")(lambda: LlamaSessionManager(FakeLlama(latency)))
+    if "whisper" not in real:
+        FakeWhisperBackend.latency = latency
+        transcription.BACKENDS["fake"] = FakeWhisperBackend
+        models.register("whisper")(lambda: transcription.Transcriber(backend="fake"))
+    if "embedding" not in real:
+        models.register("embedding")(lambda: EmbeddingService(FakeEncoder(latency)))
+    if "translation" not in real:
+        app_module.translations._backends = {
+            "google": FakeTranslateBackend(latency),
+            "marian": FakeTranslateBackend(latency),
+        }
+    if "tts" not in real:
+        app_module.tts.engines = [FakeTTSEngine(latency)]
+
+
+class Results:
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+
+    def record(self, name, seconds, status):
+        self.latencies.setdefault(name, []).append(seconds)
+        self.count(name, status)
+
+    def count(self, name, status):
+        counts = self.statuses.setdefault(name, {})
+        counts[status] = counts.get(status, 0) + 1
+
+
+async def send(client, item, index, users, results):
+    endpoint = item["endpoint"]
+    user_id = item.get("user_id") or f"load-user-{index % users}"
+    chat_id = item.get("chat_id") or "load-chat"
+    start = time.perf_counter()
+
+    if endpoint == "/chat/stream":
+        payload = {"message": item["message"], "response_type": item.get("response_type", "text"),
+                   "user_id": user_id, "chat_id": chat_id}
+        async with client.stream("POST", endpoint, json=payload) as response:
+            async for _ in response.aiter_lines():
+                pass
+            status = response.status_code
+    elif endpoint in ("/chat/audio/file", "/chat/audio/"):
+        if "audio" in item:
+            with open(item["audio"], "rb") as f:
+                audio, name, content_type = f.read(), os.path.basename(item["audio"]), "audio/webm"
+        else:
+            audio, name, content_type = speech_like_wav(item.get("seconds", 10), index), "note.wav", "audio/wav"
+        data = {"response_type": item.get("response_type", "text"), "user_id": user_id, "chat_id": chat_id,
+                "stream": str(bool(item.get("stream"))).lower()}
+        response = await client.post(endpoint, files={"file": (name, audio, content_type)}, data=data)
+        status = response.status_code
+    else:
+        payload = {"message": item["message"], "response_type": item.get("response_type", "text"),
+                   "user_id": user_id, "chat_id": chat_id}
+        response = await client.post(endpoint, json=payload)
+        status = response.status_code
+
+    results.record(endpoint, time.perf_counter() - start, status)
+
+
+async def run_load(client, workload, total, concurrency, users):
+    results = Results()
+    counter = iter(range(total))
+
+    async def worker():
+        for index in counter:
+            item = workload[index % len(workload)]
+            try:
+                await send(client, item, index, users, results)
+            except Exception as e:
+                results.count(item["endpoint"], type(e).__name__)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, time.perf_counter() - start
+
+
+def percentiles(values):
+    values = np.array(values)
+    return {
+        "count": len(values),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+    }
+
+
+def report(results, wall, stage_summary):
+    endpoints = {name: percentiles(values) for name, values in results.latencies.items()}
+    for name, summary in endpoints.items():
+        summary["per_s"] = summary["count"] / wall
+    statuses = results.statuses
+    stages = {name: dict(summary, per_s=summary["count"] / wall) for name, summary in stage_summary.items()}
+
+    print(f"\n{'endpoint / stage':<28} {'count':>6} {'per_s':>7} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8}")
+    for title, rows in (("endpoints", endpoints), ("stages", stages)):
+        print(f"-- {title}")
+        for name, row in sorted(rows.items()):
+            print(f"{name:<28} {row['count']:>6} {row['per_s']:>7.2f} {row['p50'] * 1000:>8.1f} "
+                  f"{row['p95'] * 1000:>8.1f} {row['p99'] * 1000:>8.1f}")
+    for name, counts in sorted(statuses.items()):
+        print(f"{name}: status {counts}")
+    completed = sum(len(values) for values in results.latencies.values())
+    print(f"\n{completed} requests in {wall:.1f}s ({completed / wall:.2f} req/s)")
+    return {"wall_seconds": wall, "endpoints": endpoints, "statuses": statuses, "stages": stages}
+
+
+async def wait_until_ready(client, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        response = await client.get("/health")
+        if response.status_code == 200:
+            return
+        if time.monotonic() > deadline:
+            raise SystemExit(f"Models not ready after {timeout}s: {response.json()}")
+        await asyncio.sleep(0.5)
+
+
+async def main_async(args, workload):
+    import httpx
+
+    latency = Latency(
+        firestore=args.firestore_ms / 1000, storage=args.storage_ms / 1000,
+        translate=args.translate_ms / 1000, tts=args.tts_ms / 1000, whisper_rtf=args.whisper_rtf,
+        embedding=args.embedding_ms / 1000, llm_prompt_token=args.llm_prompt_ms / 1000,
+        llm_token=args.llm_token_ms / 1000,
+    )
+    real = {name.strip() for name in args.real.split(",") if name.strip()}
+    unknown = real - set(REAL_CHOICES)
+    if unknown:
+        raise SystemExit(f"--real accepts {', '.join(REAL_CHOICES)}; got {', '.join(sorted(unknown))}")
+
+    async with contextlib.AsyncExitStack() as stack:
+        if args.url:
+            client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+            stages = None
+        else:
+            # The Faiss index, side tables, job spool and audio cache land in a scratch directory
+            scratch = tempfile.mkdtemp(prefix="load_test_")
+            os.chdir(scratch)
+            os.environ.setdefault("JOBS_SPOOL", os.path.join(scratch, "jobs_spool.db"))
+            os.environ.setdefault("TTS_CACHE_DIR", os.path.join(scratch, "audio_responses"))
+            os.environ.setdefault("MODEL_PRELOAD", "storage,llm,whisper,embedding,faiss,faq")
+            import app as app_module
+            from stage_timing import stages
+
+            install_fakes(app_module, latency, real)
+            app = app_module.app
+            # Runs the app's startup handlers now and its shutdown handlers on exit
+            await stack.enter_async_context(app.router.lifespan_context(app))
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://load-test",
+                                       timeout=args.timeout)
+        # Closed before the app shuts down
+        client = await stack.enter_async_context(client)
+
+        await wait_until_ready(client, args.ready_timeout)
+        if args.warmup:
+            print(f"Warming up with {args.warmup} requests")
+            await run_load(client, workload, args.warmup, args.concurrency, args.users)
+            if stages is not None:
+                stages.reset()
+
+        print(f"Sending {args.requests} requests with concurrency {args.concurrency}")
+        results, wall = await run_load(client, workload, args.requests, args.concurrency, args.users)
+        stage_summary = stages.summary() if stages is not None else (await client.get("/stages")).json()
+
+    summary = report(results, wall, stage_summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(dict(summary, args=vars(args)), f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workload", help="JSON-lines workload to replay (default: generated)")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=20, help="Distinct user IDs when the workload has none")
+    parser.add_argument("--warmup", type=int, default=20, help="Requests sent before measuring")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="Load-test a running server instead of the in-process app")
+    parser.add_argument("--real", default="", help=f"Comma-separated real components: {', '.join(REAL_CHOICES)}")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--firestore-ms", type=float, default=20)
+    parser.add_argument("--storage-ms", type=float, default=50)
+    parser.add_argument("--translate-ms", type=float, default=80)
+    parser.add_argument("--tts-ms", type=float, default=150)
+    parser.add_argument("--embedding-ms", type=float, default=3, help="Per text")
+    parser.add_argument("--whisper-rtf", type=float, default=0.1, help="Seconds per second of audio")
+    parser.add_argument("--llm-prompt-ms", type=float, default=0.5, help="Per prompt token evaluated")
+    parser.add_argument("--llm-token-ms", type=float, default=10, help="Per generated token")
+    args = parser.parse_args()
+
+    if args.workload:
+        args.workload = os.path.abspath(args.workload)
+        workload = load_workload(args.workload)
+    else:
+        workload = generate_workload(max(args.requests, 1), args.seed)
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    for item in workload:
+        if "audio" in item:
+            item["audio"] = os.path.abspath(item["audio"])
+
+    asyncio.run(main_async(args, workload))
+
+
+if __name__ == "__main__":
+    main()
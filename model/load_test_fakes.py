@@ -0,0 +1,289 @@
+"""
+Offline stand-ins for the services and models the app calls, used by
+load_test.py. Each one sleeps for a configurable time instead of doing the
+work, so the server's own code (scheduling, batching, caching, Faiss, the
+SQLite side tables) is what gets measured.
+"""
+import hashlib
+import itertools
+import threading
+import time
+
+import numpy as np
+
+
+def _pause(seconds):
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+class Latency:
+    """Simulated costs in seconds (per call, per token, per second of audio)"""
+
+    def __init__(self, firestore=0.02, storage=0.05, translate=0.08, tts=0.15,
+                 whisper_rtf=0.1, embedding=0.003, llm_prompt_token=0.0005, llm_token=0.01):
+        self.firestore = firestore
+        self.storage = storage
+        self.translate = translate
+        self.tts = tts
+        self.whisper_rtf = whisper_rtf
+        self.embedding = embedding
+        self.llm_prompt_token = llm_prompt_token
+        self.llm_token = llm_token
+
+
+# Firestore / Storage
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocument:
+    def __init__(self, db, collection, doc_id):
+        self.db = db
+        self.collection = collection
+        self.id = doc_id
+
+    def set(self, data, merge=False):
+        _pause(self.db.latency.firestore)
+        self.db._write(self.collection, self.id, data, merge)
+
+    def get(self):
+        _pause(self.db.latency.firestore)
+        with self.db._lock:
+            data = self.db._data.get(self.collection, {}).get(self.id)
+        return FakeSnapshot(self.id, data)
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def document(self, doc_id=None):
+        return FakeDocument(self.db, self.name, doc_id or f"doc{next(self.db._ids)}")
+
+    def add(self, data):
+        document = self.document()
+        document.set(data)
+        return time.time(), document
+
+    def stream(self):
+        _pause(self.db.latency.firestore)
+        with self.db._lock:
+            docs = list(self.db._data.get(self.name, {}).items())
+        return [FakeSnapshot(doc_id, dict(data)) for doc_id, data in docs]
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self._writes = []
+
+    def set(self, document, data, merge=False):
+        self._writes.append((document, data, merge))
+
+    def commit(self):
+        _pause(self.db.latency.firestore)
+        for document, data, merge in self._writes:
+            self.db._write(document.collection, document.id, data, merge)
+        self._writes = []
+
+
+class FakeFirestore:
+    """In-memory Firestore client: collections, documents, batches and Increment merges"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self._data = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def _write(self, collection, doc_id, data, merge):
+        with self._lock:
+            docs = self._data.setdefault(collection, {})
+            current = dict(docs.get(doc_id) or {}) if merge else {}
+            for field, value in data.items():
+                if type(value).__name__ == "Increment":
+                    value = current.get(field, 0) + value.value
+                current[field] = value
+            docs[doc_id] = current
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.public_url = f"https://storage.invalid/{bucket.name}/{name}"
+
+    def upload_from_string(self, data, content_type=None, predefined_acl=None):
+        _pause(self.bucket.latency.storage)
+        with self.bucket._lock:
+            self.bucket.files[self.name] = bytes(data)
+
+    def upload_from_filename(self, path, content_type=None, predefined_acl=None):
+        with open(path, "rb") as f:
+            self.upload_from_string(f.read())
+
+    def download_to_filename(self, path):
+        _pause(self.bucket.latency.storage)
+        with self.bucket._lock:
+            data = self.bucket.files.get(self.name)
+        if data is None:
+            raise FileNotFoundError(f"{self.name} is not in the bucket")
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+class FakeBucket:
+    def __init__(self, latency, name="load-test"):
+        self.latency = latency
+        self.name = name
+        self.files = {}
+        self._lock = threading.Lock()
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+
+# Translation and speech
+
+class FakeTranslateBackend:
+    """Tags the text with the target language after one simulated round trip per batch"""
+    name = "fake"
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def translate_batch(self, texts, src, dest):
+        _pause(self.latency.translate)
+        return [f"[{dest}] {text}" for text in texts]
+
+
+class FakeTTSEngine:
+    name = "fake"
+    extension = "mp3"
+    content_type = "audio/mpeg"
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def synthesize(self, text, lang, voice):
+        _pause(self.latency.tts)
+        # Roughly the size of 32 kbit/s speech at 15 characters per second
+        return b"ID3" + bytes(len(text) * 270)
+
+
+# Models
+
+class FakeWhisperBackend:
+    """Returns a fixed English transcript after `whisper_rtf` seconds per second of audio"""
+    parallel = 2
+    latency = Latency()
+    transcript = "I have been feeling stressed about my exams and I cannot sleep."
+
+    def __init__(self, tier):
+        self.tier = tier
+
+    def transcribe(self, audio, **kwargs):
+        duration = len(audio) / 16000
+        _pause(duration * self.latency.whisper_rtf)
+        return {
+            "text": self.transcript,
+            "language": kwargs.get("language") or "en",
+            "segments": [{"start": 0.0, "end": duration, "text": self.transcript}],
+        }
+
+
+class FakeEncoder:
+    """Deterministic unit vectors from a hash of the text, so repeated questions match in Faiss"""
+    lowercase = True
+
+    def __init__(self, latency, dimension=384):
+        self.latency = latency
+        self.dimension = dimension
+
+    def encode(self, texts):
+        _pause(self.latency.embedding * len(texts))
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:4], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimension)
+            embeddings[row] = vector / np.linalg.norm(vector)
+        return embeddings
+
+
+class FakeLlamaState:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.llama_state_size = 4096 + 64 * len(tokens)
+
+
+class FakeLlama:
+    """
+    Stands in for `llama_cpp.Llama` behind `LlamaSessionManager`. Like the real
+    KV cache, only the tokens after the prefix shared with the previous prompt
+    are evaluated, so session reuse shows up in the timings.
+    """
+
+    reply = ("It sounds like a lot is on your mind right now. Try a short walk, a few slow "
+             "breaths and writing down what worries you before bed.").split()
+
+    def __init__(self, latency):
+        self.latency = latency
+        self._tokens = []
+
+    def tokenize(self, text, add_bos=True):
+        return [hash(word) & 0xFFFF for word in text.decode("utf-8").split()]
+
+    def save_state(self):
+        return FakeLlamaState(list(self._tokens))
+
+    def load_state(self, state):
+        self._tokens = list(state.tokens)
+
+    def _evaluate(self, prompt):
+        tokens = self.tokenize(prompt.encode("utf-8"))
+        shared = 0
+        for old, new in zip(self._tokens, tokens):
+            if old != new:
+                break
+            shared += 1
+        _pause((len(tokens) - shared) * self.latency.llm_prompt_token)
+        self._tokens = tokens
+        return len(tokens)
+
+    def _generate(self, max_tokens):
+        for word in self.reply[:max_tokens]:
+            _pause(self.latency.llm_token)
+            yield " " + word
+
+    def __call__(self, prompt, max_tokens=16, stream=False, **kwargs):
+        prompt_tokens = self._evaluate(prompt)
+        if stream:
+            return ({"choices": [{"text": text}]} for text in self._generate(max_tokens))
+        text = "".join(self._generate(max_tokens))
+        completion_tokens = len(text.split())
+        return {
+            "choices": [{"text": text}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
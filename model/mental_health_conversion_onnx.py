@@ -1,4 +1,5 @@
 import os
+import json
 import torch
 from transformers import AutoModelForSequenceClassification, AutoTokenizer
 from onnxruntime.quantization import quantize_dynamic, QuantType
@@ -8,6 +9,7 @@ model_name = "./saved_model/models--kingabzpro--Llama-3.1-8B-Instruct-Mental-Hea
 onnx_model_dir = "./mental_health_onnx_model"
 onnx_model_path = os.path.join(onnx_model_dir, "mental_health_model.onnx")
 quantized_model_path = os.path.join(onnx_model_dir, "mental_health_model_quantized.onnx")
+labels_path = os.path.join(onnx_model_dir, "labels.json")
 
 # Create directory if it doesn't exist
 os.makedirs(onnx_model_dir, exist_ok=True)
@@ -16,11 +18,18 @@ os.makedirs(onnx_model_dir, exist_ok=True)
 model = AutoModelForSequenceClassification.from_pretrained(model_name)
 tokenizer = AutoTokenizer.from_pretrained(model_name)
 
+# Llama has no padding token; pad with EOS like the server does. The model
+# picks the logits of the last non-padding token, so it must know the pad id.
+if tokenizer.pad_token is None:
+    tokenizer.pad_token = tokenizer.eos_token
+model.config.pad_token_id = tokenizer.pad_token_id
+
 # Set model to evaluation mode
 model.eval()
 
-# Create dummy input tensor with a larger sequence length
-dummy_input_ids = torch.randint(0, 100, (1, 512))  # Increased sequence length
+# Short dummy input: the sequence axis is dynamic, so short messages do not
+# pay for a fixed 512-token shape. A batch of two traces the padding-aware path.
+dummy_input_ids = torch.randint(0, 100, (2, 16))
 dummy_attention_mask = torch.ones_like(dummy_input_ids)  # Attention mask (all ones)
 
 # Convert to ONNX
@@ -30,10 +39,18 @@ torch.onnx.export(
     onnx_model_path,
     input_names=["input_ids", "attention_mask"],
     output_names=["logits"],
-    dynamic_axes={"input_ids": {0: "batch_size"}, "attention_mask": {0: "batch_size"}, "logits": {0: "batch_size"}},
+    dynamic_axes={
+        "input_ids": {0: "batch_size", 1: "sequence_length"},
+        "attention_mask": {0: "batch_size", 1: "sequence_length"},
+        "logits": {0: "batch_size"}
+    },
     opset_version=14,
 )
 
+# Save the class labels for the server
+with open(labels_path, "w") as f:
+    json.dump([model.config.id2label[i] for i in range(model.config.num_labels)], f)
+
 print(f"Model successfully saved as ONNX: {onnx_model_path}")
 
 # Perform ONNX model quantization
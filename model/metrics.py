@@ -0,0 +1,202 @@
+import asyncio
+import json
+import os
+import random
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from profiling import PROFILE_REQUESTS, PROFILE_SAMPLE_RATE, StackSampler, profile_path
+from stage_timing import stages
+
+# Requests slower than this are logged as one JSON line with their stage
+# spans; 0 logs every request, a negative value none
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "2000"))
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "chat_stage_seconds", "Duration of each blocking pipeline stage", ["stage"], buckets=LATENCY_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "chat_request_seconds", "Duration of HTTP requests", ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+LLM_TOKENS = Counter("llm_tokens", "Tokens evaluated (prompt) and generated (completion) by the LLM", ["kind"])
+LLM_TOKENS_PER_SECOND = Histogram(
+    "llm_tokens_per_second", "Generation speed of each LLM call",
+    buckets=(1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200)
+)
+
+stages.add_listener(lambda name, seconds: STAGE_SECONDS.labels(name).observe(seconds))
+
+
+def record_llm_call(completion_tokens, seconds, prompt_tokens=None):
+    if prompt_tokens is not None:
+        LLM_TOKENS.labels("prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels("completion").inc(completion_tokens)
+    if completion_tokens and seconds > 0:
+        LLM_TOKENS_PER_SECOND.observe(completion_tokens / seconds)
+
+
+def _caches(stats, prefix=""):
+    """Yield (name, stats) for every dict with hit/miss counters, named by its path"""
+    if not isinstance(stats, dict):
+        return
+    if "hits" in stats and "misses" in stats:
+        yield prefix, stats
+        return
+    for key, value in stats.items():
+        yield from _caches(value, f"{prefix}_{key}" if prefix else key)
+
+
+class StatsCollector:
+    """
+    Exports the app's existing stats dictionaries at scrape time: cache hit
+    and miss counters, scheduler queue depths, background job lag, model load
+    state and memory, and LLM session state sizes.
+
+    `snapshot()` returns {"caches", "queues", "jobs", "models", "llm"} with
+    the shapes of the corresponding stats endpoints.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def describe(self):
+        # Without describe() the registry calls collect() on registration,
+        # before the app has defined everything the snapshot reads
+        return []
+
+    def collect(self):
+        snapshot = self.snapshot()
+
+        hits = CounterMetricFamily("cache_hits", "Cache hits", labels=["cache"])
+        misses = CounterMetricFamily("cache_misses", "Cache misses", labels=["cache"])
+        entries = GaugeMetricFamily("cache_entries", "Entries held in the cache", labels=["cache"])
+        for name, stats in _caches(snapshot.get("caches")):
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+            entries.add_metric([name], stats.get("size", stats.get("entries", 0)))
+        yield from (hits, misses, entries)
+
+        depth = GaugeMetricFamily("scheduler_queue_depth", "Calls running or waiting", labels=["queue"])
+        workers = GaugeMetricFamily("scheduler_queue_workers", "Worker threads", labels=["queue"])
+        completed = CounterMetricFamily("scheduler_queue_completed", "Calls completed", labels=["queue"])
+        rejected = CounterMetricFamily("scheduler_queue_rejected", "Calls rejected as over capacity", labels=["queue"])
+        for name, stats in (snapshot.get("queues") or {}).items():
+            depth.add_metric([name], stats["depth"])
+            workers.add_metric([name], stats["workers"])
+            completed.add_metric([name], stats["completed"])
+            rejected.add_metric([name], stats["rejected"])
+        yield from (depth, workers, completed, rejected)
+
+        jobs = (snapshot.get("jobs") or {}).get("jobs", {})
+        queued = GaugeMetricFamily("jobs_queued", "Background jobs waiting", labels=["job"])
+        failed = GaugeMetricFamily("jobs_failed", "Background jobs that ran out of attempts", labels=["job"])
+        lag = GaugeMetricFamily("jobs_lag_seconds", "Age of the oldest waiting job", labels=["job"])
+        for name, stats in jobs.items():
+            queued.add_metric([name], stats["queued"])
+            failed.add_metric([name], stats["failed"])
+            lag.add_metric([name], stats["lag_seconds"])
+        yield from (queued, failed, lag)
+
+        ready = GaugeMetricFamily("model_ready", "1 once the model is loaded", labels=["model"])
+        load_seconds = GaugeMetricFamily("model_load_seconds", "Time taken to load the model", labels=["model"])
+        memory = GaugeMetricFamily(
+            "model_memory_bytes", "Growth of resident memory while the model loaded", labels=["model"]
+        )
+        for name, status in (snapshot.get("models") or {}).items():
+            ready.add_metric([name], 1 if status["state"] == "ready" else 0)
+            if status["load_seconds"] is not None:
+                load_seconds.add_metric([name], status["load_seconds"])
+            if status.get("memory_bytes") is not None:
+                memory.add_metric([name], status["memory_bytes"])
+        yield from (ready, load_seconds, memory)
+
+        llm = snapshot.get("llm") or {}
+        if "states" in llm:
+            state_bytes = GaugeMetricFamily(
+                "llm_state_bytes", "Saved conversation KV states", labels=["location"]
+            )
+            state_bytes.add_metric(["memory"], llm["states"]["memory_bytes"])
+            state_bytes.add_metric(["disk"], llm["states"]["disk_bytes"])
+            yield state_bytes
+        if "workers" in llm:
+            in_flight = GaugeMetricFamily("llm_worker_in_flight", "Requests on each LLM worker", labels=["worker"])
+            for worker in llm["workers"]:
+                in_flight.add_metric([str(worker["id"])], worker["in_flight"])
+            yield in_flight
+
+
+def register_stats(snapshot):
+    REGISTRY.register(StatsCollector(snapshot))
+
+
+def metrics_response():
+    """Body and content type of the Prometheus text exposition"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing each HTTP request and the stages it runs.
+
+    Observes `chat_request_seconds` by route, adds a `Server-Timing` header
+    with the stages finished before the response started, and logs slow
+    requests (`SLOW_REQUEST_MS`) with their spans. With PROFILE_REQUESTS
+    enabled, requests sent with `X-Profile: 1` (or a PROFILE_SAMPLE_RATE
+    fraction of them) are profiled by a `StackSampler`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sampler = None
+        if PROFILE_REQUESTS and (
+            dict(scope["headers"]).get(b"x-profile") == b"1" or random.random() < PROFILE_SAMPLE_RATE
+        ):
+            sampler = StackSampler().start()
+
+        status = 500
+        with stages.trace() as spans:
+            async def send_with_timing(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    totals = spans.totals()
+                    if totals:
+                        timing = ", ".join(f"{name};dur={ms}" for name, ms in totals.items())
+                        message = dict(message, headers=list(message.get("headers", [])) + [
+                            (b"server-timing", timing.encode("latin-1"))
+                        ])
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                elapsed = time.perf_counter() - spans.start
+                # The route template (not the raw path) keeps label cardinality bounded
+                route = getattr(scope.get("route"), "path", None) or "unmatched"
+                REQUEST_SECONDS.labels(scope["method"], route, str(status)).observe(elapsed)
+
+                profile = None
+                if sampler is not None:
+                    sampler.stop()
+                    profile = await asyncio.to_thread(sampler.write, profile_path(route))
+                if profile or (SLOW_REQUEST_MS >= 0 and elapsed * 1000 >= SLOW_REQUEST_MS):
+                    print(json.dumps({
+                        "event": "request",
+                        "method": scope["method"],
+                        "route": route,
+                        "status": status,
+                        "ms": round(elapsed * 1000, 1),
+                        "stages": spans.totals(),
+                        "spans": spans.spans,
+                        "profile": profile,
+                    }))
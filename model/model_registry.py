@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Comma-separated model names. DISABLED_MODELS are never loaded (requests that
+# need them get a 503), which allows slim replicas such as an /analyze/-only
+# server. MODEL_PRELOAD lists the models loaded in parallel at startup ("all"
+# or "none" also accepted); the rest load on first use.
+DISABLED_MODELS = os.getenv("DISABLED_MODELS", "")
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "all")
+MODEL_PRELOAD_WORKERS = int(os.getenv("MODEL_PRELOAD_WORKERS", "4"))
+
+
+def _rss_bytes():
+    """Resident memory of this process (Linux), or None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _names(value):
+    return {name.strip() for name in value.split(",") if name.strip()}
+
+
+class ModelUnavailableError(Exception):
+    """Raised when a model is disabled or failed to load"""
+
+    def __init__(self, name, reason):
+        super().__init__(f"Model '{name}' is unavailable: {reason}")
+        self.name = name
+        self.reason = reason
+
+
+class _Entry:
+    def __init__(self, name, loader, preload):
+        self.name = name
+        self.loader = loader
+        self.preload = preload
+        self.instance = None
+        self.state = "pending"
+        self.error = None
+        self.load_seconds = None
+        self.memory_bytes = None
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    """
+    Loads models lazily on first use or in parallel at startup.
+
+    Loaders are registered by name and may themselves `get()` other models.
+    Each model is loaded at most once at a time; a failed load is retried on
+    the next `get()`.
+    """
+
+    def __init__(self, disabled=DISABLED_MODELS, preload=MODEL_PRELOAD, workers=MODEL_PRELOAD_WORKERS):
+        self.disabled = _names(disabled)
+        self.preload_names = preload.strip().lower()
+        self.workers = workers
+        self._entries = {}
+
+    def register(self, name, preload=True):
+        """Decorator registering `loader()` as the factory for model `name`"""
+        def decorator(loader):
+            entry = _Entry(name, loader, preload)
+            if name in self.disabled:
+                entry.state = "disabled"
+            self._entries[name] = entry
+            return loader
+        return decorator
+
+    def enabled(self, name):
+        return name in self._entries and name not in self.disabled
+
+    def get(self, name):
+        """Return the loaded model, loading it now if needed"""
+        entry = self._entries.get(name)
+        if entry is None:
+            raise ModelUnavailableError(name, "not registered")
+        if entry.state == "disabled":
+            raise ModelUnavailableError(name, "disabled by configuration")
+        if entry.instance is not None:
+            return entry.instance
+
+        with entry.lock:
+            if entry.instance is not None:
+                return entry.instance
+            entry.state = "loading"
+            start = time.perf_counter()
+            rss_before = _rss_bytes()
+            try:
+                instance = entry.loader()
+            except Exception as e:
+                entry.state = "failed"
+                entry.error = str(e)
+                print(f"Failed to load model '{name}': {e}")
+                raise ModelUnavailableError(name, str(e)) from e
+            entry.load_seconds = round(time.perf_counter() - start, 2)
+            # Approximate: models preloaded in parallel also count each other's growth
+            rss_after = _rss_bytes()
+            if rss_before is not None and rss_after is not None:
+                entry.memory_bytes = max(0, rss_after - rss_before)
+            entry.instance = instance
+            entry.error = None
+            entry.state = "ready"
+            print(f"Loaded model '{name}' in {entry.load_seconds}s")
+            return instance
+
+    def get_if_loaded(self, name):
+        """Return the model if it is already loaded, without loading it"""
+        entry = self._entries.get(name)
+        return entry.instance if entry is not None else None
+
+    def _should_preload(self, entry):
+        if entry.state == "disabled":
+            return False
+        if self.preload_names == "all":
+            return entry.preload
+        if self.preload_names == "none":
+            return False
+        return entry.name in _names(self.preload_names)
+
+    def preload_in_background(self):
+        """Start loading the preload models in parallel threads and return immediately"""
+        names = [entry.name for entry in self._entries.values() if self._should_preload(entry)]
+        if not names:
+            return
+
+        def load(name):
+            try:
+                self.get(name)
+            except ModelUnavailableError:
+                pass
+
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="model-loader")
+        for name in names:
+            executor.submit(load, name)
+        executor.shutdown(wait=False)
+
+    def status(self):
+        return {
+            name: {
+                "state": entry.state,
+                "preload": self._should_preload(entry),
+                "load_seconds": entry.load_seconds,
+                "memory_bytes": entry.memory_bytes,
+                "error": entry.error,
+            }
+            for name, entry in self._entries.items()
+        }
+
+    def ready(self):
+        """True once every model selected for preloading is loaded"""
+        return all(
+            entry.state == "ready"
+            for entry in self._entries.values()
+            if self._should_preload(entry)
+        )
@@ -0,0 +1,225 @@
+import gc
+import os
+import threading
+import time
+
+import numpy as np
+import onnxruntime as ort
+from scipy.special import softmax
+
+from caching import LRUCache
+from stage_timing import stages
+from tokenization import CachedTokenizer, normalize_text
+
+# ONNX Runtime session tuning; 0 threads lets ORT pick based on the cores
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", "0"))
+ORT_GRAPH_OPTIMIZATION = os.getenv("ORT_GRAPH_OPTIMIZATION", "all").lower()
+ORT_ENABLE_MEM_ARENA = os.getenv("ORT_ENABLE_MEM_ARENA", "true").lower() in ("1", "true", "yes")
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "4096"))
+
+# Padded sequence lengths. Messages in a batch are padded up to the smallest
+# bucket that fits the longest of them, so ONNX Runtime sees a handful of
+# recurring shapes instead of one per message length.
+LENGTH_BUCKETS = (16, 32, 64, 128, 256, 512)
+
+
+def create_session(model_path, intra_op_threads=ORT_INTRA_OP_THREADS,
+                   inter_op_threads=ORT_INTER_OP_THREADS,
+                   graph_optimization=ORT_GRAPH_OPTIMIZATION,
+                   enable_mem_arena=ORT_ENABLE_MEM_ARENA):
+    """Create a CPU `InferenceSession` with the configured threading, optimisation and memory settings"""
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[graph_optimization]
+    options.enable_cpu_mem_arena = enable_mem_arena
+    return ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def bucket_length(length, max_length=512):
+    """Return the padded length for a sequence of `length` tokens"""
+    for bucket in LENGTH_BUCKETS:
+        if length <= bucket:
+            return min(bucket, max_length)
+    return max_length
+
+
+class OnnxTextClassifier:
+    """
+    Batched text classification with an ONNX sequence-classification model.
+
+    Messages are tokenized together, grouped by length bucket and each group
+    is run through a single `session.run`. Models exported without an
+    `attention_mask` input cannot ignore padding, so for those messages are
+    only grouped with others of exactly the same length.
+
+    Token IDs and class probabilities are cached per normalised message, so a
+    repeated message skips tokenization and inference entirely.
+    """
+
+    def __init__(self, session, tokenizer, labels, max_length=512, result_cache_size=RESULT_CACHE_SIZE):
+        self.session = session
+        self.tokenizer = CachedTokenizer(tokenizer, max_length)
+        self.labels = labels
+        self.max_length = max_length
+        self.results = LRUCache(result_cache_size)
+
+        self.input_names = [i.name for i in session.get_inputs()]
+        self.uses_attention_mask = "attention_mask" in self.input_names
+        self.pad_token_id = self.tokenizer.pad_token_id
+
+    def _run(self, sequences):
+        length = max(len(ids) for ids in sequences)
+        if self.uses_attention_mask:
+            length = bucket_length(length, self.max_length)
+
+        input_ids = np.full((len(sequences), length), self.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(sequences), length), dtype=np.int64)
+        for row, ids in enumerate(sequences):
+            input_ids[row, :len(ids)] = ids
+            attention_mask[row, :len(ids)] = 1
+
+        onnx_inputs = {"input_ids": input_ids}
+        if self.uses_attention_mask:
+            onnx_inputs["attention_mask"] = attention_mask
+        with stages.stage("onnx"):
+            return self.session.run(None, onnx_inputs)[0]
+
+    def predict_proba(self, texts):
+        """Return an (n_texts, n_labels) array of class probabilities"""
+        texts = [normalize_text(text) for text in texts]
+        probabilities = np.zeros((len(texts), len(self.labels)), dtype=np.float32)
+
+        pending = {}
+        for position, text in enumerate(texts):
+            cached = self.results.get(text)
+            if cached is not None:
+                probabilities[position] = cached
+            else:
+                pending.setdefault(text, []).append(position)
+
+        if not pending:
+            return probabilities
+
+        unique_texts = list(pending)
+        sequences = self.tokenizer.encode(unique_texts)
+
+        groups = {}
+        for index, ids in enumerate(sequences):
+            key = bucket_length(len(ids), self.max_length) if self.uses_attention_mask else len(ids)
+            groups.setdefault(key, []).append(index)
+
+        for indices in groups.values():
+            logits = self._run([sequences[i] for i in indices])
+            for i, row in zip(indices, softmax(logits, axis=-1)):
+                self.results.put(unique_texts[i], row)
+                probabilities[pending[unique_texts[i]]] = row
+        return probabilities
+
+    def stats(self):
+        return {"tokens": self.tokenizer.stats(), "results": self.results.stats()}
+
+    def classify(self, texts, top_k=5):
+        """Return, for each text, its `top_k` (label, probability) pairs, most likely first"""
+        probabilities = self.predict_proba(texts)
+        results = []
+        for row in probabilities:
+            top = np.argsort(row)[-top_k:][::-1]
+            results.append([(self.labels[i], float(row[i])) for i in top])
+        return results
+
+
+class LazyOnnxClassifier:
+    """
+    Loads a classifier on first use and unloads it again when idle.
+
+    `load()` must return an `OnnxTextClassifier`. After `idle_timeout`
+    seconds without requests the session is released so a large model does
+    not hold RAM while unused; `unload()` does the same on demand. A
+    classifier is never unloaded while a call is using it.
+    """
+
+    def __init__(self, load, idle_timeout=None):
+        self.load = load
+        self.idle_timeout = idle_timeout
+
+        self._classifier = None
+        self._in_use = 0
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    @property
+    def loaded(self):
+        return self._classifier is not None
+
+    def _acquire(self):
+        with self._lock:
+            if self._classifier is None:
+                start = time.perf_counter()
+                self._classifier = self.load()
+                print(f"Loaded classifier in {time.perf_counter() - start:.1f}s")
+                self._start_watcher()
+            self._in_use += 1
+            return self._classifier
+
+    def _release(self):
+        with self._lock:
+            self._in_use -= 1
+            self._last_used = time.monotonic()
+
+    def predict_proba(self, texts):
+        classifier = self._acquire()
+        try:
+            return classifier.predict_proba(texts)
+        finally:
+            self._release()
+
+    def classify(self, texts, top_k=5):
+        classifier = self._acquire()
+        try:
+            return classifier.classify(texts, top_k)
+        finally:
+            self._release()
+
+    def stats(self):
+        classifier = self._classifier
+        return classifier.stats() if classifier is not None else None
+
+    def unload(self):
+        """Release the session now; returns False if it is busy or not loaded"""
+        with self._lock:
+            if self._classifier is None or self._in_use:
+                return False
+            self._classifier = None
+        gc.collect()
+        print("Unloaded classifier")
+        return True
+
+    def _start_watcher(self):
+        if not self.idle_timeout or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch_idle, name="classifier-idle", daemon=True)
+        self._watcher.start()
+
+    def _watch_idle(self):
+        while True:
+            time.sleep(max(1.0, self.idle_timeout / 4))
+            with self._lock:
+                idle = (
+                    self._classifier is not None
+                    and not self._in_use
+                    and time.monotonic() - self._last_used > self.idle_timeout
+                )
+            if idle:
+                self.unload()
@@ -0,0 +1,80 @@
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+# Per-request sampling profiler. With PROFILE_REQUESTS=1, requests carrying
+# an `X-Profile: 1` header are profiled, plus a random PROFILE_SAMPLE_RATE
+# fraction of all requests. Stacks are written to PROFILE_DIR in collapsed
+# format ("frame;frame;frame count"), which flamegraph.pl and speedscope read.
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "0").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Innermost frames of threads that are blocked waiting for work
+IDLE_FRAMES = {"_worker", "wait", "select", "_wait_for_tstate_lock"}
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class StackSampler:
+    """
+    Samples the Python stacks of every thread every `interval_ms` while running.
+
+    Stages of a request run on scheduler pool threads rather than on the event
+    loop, so all threads are sampled; threads blocked waiting for work (see
+    `IDLE_FRAMES`) are left out. Samples from other requests in flight at the
+    same time are included as well.
+    """
+
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.samples
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if frame.f_code.co_name in IDLE_FRAMES:
+                    continue
+                stack = [_frame_name(f) for f, _ in traceback.walk_stack(frame)]
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+def profile_path(label):
+    """File name for a request's profile, e.g. profiles/20240101-120000-123-chat.folded"""
+    stamp = time.strftime("%Y%m%d-%H%M%S") + f"-{int(time.time() * 1000) % 1000:03d}"
+    slug = "".join(c if c.isalnum() else "-" for c in label).strip("-") or "root"
+    return os.path.join(PROFILE_DIR, f"{stamp}-{slug}.folded")
@@ -0,0 +1,32 @@
+"""
+Re-embed every question in the Firestore `faiss_metadata` collection and
+rebuild the Faiss index and its local side table from scratch, e.g. after
+switching EMBEDDING_BACKEND or the embedding model.
+
+    python reindex_faiss.py --batch-size 2048
+
+The rebuilt index is written locally and uploaded to Firebase Storage before
+the command exits. Run it while the server is stopped (or restart the server
+afterwards) so it does not keep serving the old index.
+"""
+import argparse
+import time
+
+from app import models, rebuild_faiss_from_firestore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1024, help="Questions embedded per encode call")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    faiss_index = models.get("faiss")
+    count = rebuild_faiss_from_firestore(faiss_index, batch_size=args.batch_size)
+    # Stops the persistence thread and uploads the rebuilt index
+    faiss_index.close()
+    print(f"Re-embedded {count} questions in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# (workers, queue) per work type. The LLM and Whisper each run as a single
+# shared instance, so one worker apiece; small CPU encoders (the ONNX
+# classifiers and MiniLM) share the "onnx" pool; the 8B mental-health
+# classifier gets its own so its lazy load and long batches never hold up
+# embeddings and emotions; network and disk calls (Firestore, Storage,
+# translation, gTTS) go to "io".
+DEFAULT_QUEUES = {
+    "llm": (1, 8),
+    "whisper": (1, 4),
+    "onnx": (2, 64),
+    "mental_health": (1, 16),
+    "io": (8, 256),
+}
+
+_DONE = object()
+
+
+class QueueFullError(Exception):
+    """Raised when a work queue is at capacity and the request is rejected"""
+
+    def __init__(self, queue, depth, retry_after):
+        super().__init__(f"The {queue} queue is full ({depth} requests waiting)")
+        self.queue = queue
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+class Reservation:
+    """Capacity held in a `WorkQueue` until released; releasing twice is a no-op"""
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.start = time.perf_counter()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.queue._release(time.perf_counter() - self.start)
+
+    async def run(self, fn, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` on the queue's pool within this reservation rather than admitting a new call"""
+        future = self.queue.executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        return await asyncio.wrap_future(future)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class WorkQueue:
+    """
+    Bounded thread pool for one type of blocking work.
+
+    At most `workers` calls run at once and at most `max_queue` more wait;
+    anything beyond that is rejected immediately with `QueueFullError`, which
+    carries the current depth and an estimated wait based on a moving average
+    of recent service times.
+    """
+
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-worker")
+
+        self._pending = 0
+        self._avg_seconds = 1.0
+        self._completed = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def depth(self):
+        """Requests admitted but not yet finished (running plus waiting)"""
+        with self._lock:
+            return self._pending
+
+    def estimated_wait(self, depth=None):
+        depth = self.depth if depth is None else depth
+        with self._lock:
+            return depth * self._avg_seconds / self.workers
+
+    def _admit(self):
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self._rejected += 1
+                depth = self._pending
+            else:
+                self._pending += 1
+                return
+        raise QueueFullError(self.name, depth, self.estimated_wait(depth))
+
+    def _release(self, elapsed=None):
+        with self._lock:
+            self._pending -= 1
+            if elapsed is not None:
+                self._completed += 1
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+
+    def _timed(self, fn, args, kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._release(time.perf_counter() - start)
+
+    async def run(self, fn, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` on this pool without blocking the event loop"""
+        self._admit()
+        try:
+            # Carry the caller's context (e.g. its timing spans) into the pool
+            future = self.executor.submit(contextvars.copy_context().run, self._timed, fn, args, kwargs)
+        except BaseException:
+            self._release()
+            raise
+        # A call cancelled before it started never reaches _timed
+        future.add_done_callback(lambda f: f.cancelled() and self._release())
+        return await asyncio.wrap_future(future)
+
+    async def stream(self, fn, *args, **kwargs):
+        """
+        Iterate the blocking generator `fn(*args, **kwargs)` on this pool,
+        yielding its items without blocking the event loop. The whole stream
+        counts as one request for admission.
+        """
+        reservation = self.reserve()
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        iterator = None
+        try:
+            iterator = await loop.run_in_executor(self.executor, context.run, lambda: iter(fn(*args, **kwargs)))
+            while True:
+                item = await loop.run_in_executor(self.executor, context.run, next, iterator, _DONE)
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            if iterator is not None and hasattr(iterator, "close"):
+                # Queued behind any in-flight next() so the generator can clean up
+                self.executor.submit(_close_quietly, iterator)
+            reservation.release()
+
+    def reserve(self):
+        """
+        Reserve capacity for work that runs outside the pool (e.g. a response
+        stream). Raises `QueueFullError` immediately when full; call `release()`
+        on the returned reservation (or use it as a context manager) when done.
+        """
+        self._admit()
+        return Reservation(self)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "depth": self._pending,
+                "avg_seconds": round(self._avg_seconds, 4),
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _close_quietly(generator):
+    try:
+        generator.close()
+    except ValueError:
+        pass  # still running on another worker; it is dropped once that returns
+
+
+class Scheduler:
+    """
+    One `WorkQueue` per work type, sized from `SCHED_<NAME>_WORKERS` and
+    `SCHED_<NAME>_QUEUE` environment variables.
+    """
+
+    def __init__(self, queues=DEFAULT_QUEUES):
+        self.queues = {}
+        for name, (workers, max_queue) in queues.items():
+            key = name.upper()
+            self.queues[name] = WorkQueue(
+                name,
+                int(os.getenv(f"SCHED_{key}_WORKERS", workers)),
+                int(os.getenv(f"SCHED_{key}_QUEUE", max_queue)),
+            )
+
+    def __getitem__(self, name):
+        return self.queues[name]
+
+    async def run(self, name, fn, *args, **kwargs):
+        return await self.queues[name].run(fn, *args, **kwargs)
+
+    def stream(self, name, fn, *args, **kwargs):
+        return self.queues[name].stream(fn, *args, **kwargs)
+
+    def stats(self):
+        return {name: queue.stats() for name, queue in self.queues.items()}
+
+    def shutdown(self):
+        for queue in self.queues.values():
+            queue.shutdown()
@@ -0,0 +1,127 @@
+import contextvars
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+STAGE_SAMPLES = 10000
+
+# Spans of the request being handled, if it is being traced (see StageTimer.trace)
+_spans = contextvars.ContextVar("stage_spans", default=None)
+
+
+class RequestSpans:
+    """The stages run on behalf of one request, in completion order"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+        self.closed = False
+
+    def add(self, name, start, seconds):
+        if not self.closed:
+            self.spans.append({
+                "stage": name,
+                "start_ms": round((start - self.start) * 1000, 1),
+                "ms": round(seconds * 1000, 1),
+            })
+
+    def totals(self):
+        """Total milliseconds per stage"""
+        totals = {}
+        for span in self.spans:
+            totals[span["stage"]] = round(totals.get(span["stage"], 0) + span["ms"], 1)
+        return totals
+
+
+class StageTimer:
+    """
+    Records how long each pipeline stage (detect, translate, faiss, llm, ...)
+    takes, keeping the most recent `max_samples` durations per stage for
+    percentile summaries.
+    """
+
+    def __init__(self, max_samples=STAGE_SAMPLES):
+        self.max_samples = max_samples
+        self._samples = {}
+        self._counts = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener):
+        """Call `listener(name, seconds)` for every recorded stage (e.g. to export metrics)"""
+        self._listeners.append(listener)
+
+    def record(self, name, seconds, start=None):
+        spans = _spans.get()
+        if spans is not None:
+            spans.add(name, start if start is not None else time.perf_counter() - seconds, seconds)
+        for listener in self._listeners:
+            listener(name, seconds)
+        with self._lock:
+            if name not in self._samples:
+                self._samples[name] = deque(maxlen=self.max_samples)
+                self._counts[name] = 0
+            self._samples[name].append(seconds)
+            self._counts[name] += 1
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, start)
+
+    @contextmanager
+    def trace(self):
+        """
+        Collect the stages run for the current request into a `RequestSpans`,
+        including those run on scheduler pools (which copy the caller's context)
+        """
+        spans = RequestSpans()
+        token = _spans.set(spans)
+        try:
+            yield spans
+        finally:
+            spans.closed = True
+            _spans.reset(token)
+
+    def timed(self, name):
+        """Decorator recording every call of the function as stage `name`"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """Count and p50/p95/p99/mean latency in seconds for each stage"""
+        with self._lock:
+            samples = {name: np.array(values) for name, values in self._samples.items()}
+            counts = dict(self._counts)
+        return {
+            name: {
+                "count": counts[name],
+                "p50": float(np.percentile(values, 50)),
+                "p95": float(np.percentile(values, 95)),
+                "p99": float(np.percentile(values, 99)),
+                "mean": float(values.mean()),
+            }
+            for name, values in samples.items()
+            if len(values)
+        }
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+
+# Shared by the app and the load-test harness
+stages = StageTimer()
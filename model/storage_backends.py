@@ -0,0 +1,313 @@
+import asyncio
+import json
+import os
+import pathlib
+import shutil
+import sqlite3
+import threading
+import time
+
+# "firebase" (Cloud Storage + Firestore) or "local" (files and SQLite on
+# disk, for on-prem and offline deployments)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firebase").lower()
+# Keep-alive HTTP connections shared by all threads talking to Cloud Storage
+STORAGE_POOL_SIZE = int(os.getenv("STORAGE_POOL_SIZE", "32"))
+# Larger uploads are sent as resumable uploads in chunks of STORAGE_CHUNK_MB,
+# so a dropped connection only repeats the current chunk
+STORAGE_RESUMABLE_MB = float(os.getenv("STORAGE_RESUMABLE_MB", "8"))
+STORAGE_CHUNK_MB = int(os.getenv("STORAGE_CHUNK_MB", "8"))
+STORAGE_LOCAL_DIR = os.getenv("STORAGE_LOCAL_DIR", "local_storage")
+# Base URL under which something serves STORAGE_LOCAL_DIR/blobs (file:// URLs otherwise)
+STORAGE_PUBLIC_URL = os.getenv("STORAGE_PUBLIC_URL", "")
+
+
+class Storage:
+    """
+    Blob and document storage behind one interface.
+
+    Blobs: `upload`, `upload_file`, `download` and `public_url`, plus
+    `upload_many_async` to upload several files at once. Documents follow the
+    subset of the Firestore client the app uses: `collection(name)` with
+    `document(id)` (`set(data, merge=)`, `get()`), `add(data)` and `stream()`,
+    `batch()`, and the `increment(n)` and `server_timestamp` field values.
+    """
+
+    def upload(self, data, name, content_type="application/octet-stream", public=True):
+        raise NotImplementedError
+
+    def upload_file(self, path, name, content_type=None, public=False):
+        raise NotImplementedError
+
+    def download(self, name, path):
+        raise NotImplementedError
+
+    def public_url(self, name):
+        raise NotImplementedError
+
+    async def upload_many_async(self, files, run=asyncio.to_thread):
+        """
+        Upload [(data, name, content_type), ...] concurrently and return their
+        URLs in order. Each upload runs as `run(self.upload, data, name,
+        content_type)`, e.g. on a scheduler pool.
+        """
+        return list(await asyncio.gather(*(run(self.upload, *file) for file in files)))
+
+    def close(self):
+        pass
+
+
+class FirebaseStorage(Storage):
+    """Firebase Storage and Firestore through one shared, connection-pooled client each"""
+
+    def __init__(self, db, bucket, pool_size=STORAGE_POOL_SIZE):
+        self.db = db
+        self.bucket = bucket
+
+        # The storage client's session defaults to 10 connections per host;
+        # size it for the scheduler's I/O pool and the job workers
+        session = getattr(getattr(bucket, "client", None), "_http", None)
+        if hasattr(session, "mount"):
+            from requests.adapters import HTTPAdapter
+
+            session.mount("https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+
+    @classmethod
+    def from_credentials(cls, path="./firebase-key.json"):
+        import firebase_admin
+        from firebase_admin import credentials, firestore, storage
+
+        firebase_admin.initialize_app(credentials.Certificate(path), {
+            'storageBucket': os.getenv("FIREBASE_STORAGE_BUCKET"),
+            'projectId': os.getenv("FIREBASE_PROJECT_ID")
+        })
+        return cls(firestore.client(), storage.bucket())
+
+    def _blob(self, name, size):
+        blob = self.bucket.blob(name)
+        if size > STORAGE_RESUMABLE_MB * 1024 * 1024:
+            blob.chunk_size = STORAGE_CHUNK_MB * 1024 * 1024
+        return blob
+
+    def upload(self, data, name, content_type="application/octet-stream", public=True):
+        """Upload bytes and return the public URL; a public file takes one request, not an upload plus an ACL change"""
+        blob = self._blob(name, len(data))
+        blob.upload_from_string(data, content_type=content_type, predefined_acl="publicRead" if public else None)
+        return blob.public_url
+
+    def upload_file(self, path, name, content_type=None, public=False):
+        blob = self._blob(name, os.path.getsize(path))
+        blob.upload_from_filename(path, content_type=content_type, predefined_acl="publicRead" if public else None)
+        return blob.public_url
+
+    def download(self, name, path):
+        self.bucket.blob(name).download_to_filename(path)
+
+    def public_url(self, name):
+        return self.bucket.blob(name).public_url
+
+    def collection(self, name):
+        return self.db.collection(name)
+
+    def batch(self):
+        return self.db.batch()
+
+    @staticmethod
+    def increment(value):
+        from firebase_admin import firestore
+
+        return firestore.Increment(value)
+
+    @property
+    def server_timestamp(self):
+        from firebase_admin import firestore
+
+        return firestore.SERVER_TIMESTAMP
+
+
+class LocalIncrement:
+    def __init__(self, value):
+        self.value = value
+
+
+_SERVER_TIMESTAMP = object()
+
+
+class LocalSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class LocalDocument:
+    def __init__(self, storage, collection, doc_id):
+        self.storage = storage
+        self.collection = collection
+        self.id = doc_id
+
+    def set(self, data, merge=False):
+        self.storage._write([(self, data, merge)])
+
+    def get(self):
+        return LocalSnapshot(self.id, self.storage._read(self.collection, self.id))
+
+
+class LocalCollection:
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+
+    def document(self, doc_id=None):
+        return LocalDocument(self.storage, self.name, doc_id or os.urandom(10).hex())
+
+    def add(self, data):
+        document = self.document()
+        document.set(data)
+        return time.time(), document
+
+    def stream(self):
+        return [LocalSnapshot(doc_id, data) for doc_id, data in self.storage._scan(self.name)]
+
+
+class LocalBatch:
+    def __init__(self, storage):
+        self.storage = storage
+        self._writes = []
+
+    def set(self, document, data, merge=False):
+        self._writes.append((document, data, merge))
+
+    def commit(self):
+        # One SQLite transaction, so the batch is atomic like Firestore's
+        self.storage._write(self._writes)
+        self._writes = []
+
+
+class LocalStorage(Storage):
+    """
+    Blobs as files under `directory`/blobs and documents as JSON rows in
+    `directory`/documents.db, for on-prem and offline deployments and tests.
+    Blob URLs are STORAGE_PUBLIC_URL + name when set, file:// URLs otherwise.
+    """
+
+    def __init__(self, directory=STORAGE_LOCAL_DIR, public_base_url=STORAGE_PUBLIC_URL):
+        self.directory = directory
+        self.blob_dir = os.path.join(directory, "blobs")
+        self.public_base_url = public_base_url.rstrip("/")
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "documents.db"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                collection TEXT NOT NULL,
+                id TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (collection, id)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def _path(self, name):
+        path = os.path.abspath(os.path.join(self.blob_dir, name))
+        if not path.startswith(os.path.abspath(self.blob_dir) + os.sep):
+            raise ValueError(f"Invalid blob name: {name}")
+        return path
+
+    def _replace(self, name, write):
+        """Write a blob through a temp file so readers never see a partial file"""
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, path)
+        return self.public_url(name)
+
+    def upload(self, data, name, content_type="application/octet-stream", public=True):
+        def write(tmp_path):
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+        return self._replace(name, write)
+
+    def upload_file(self, path, name, content_type=None, public=False):
+        return self._replace(name, lambda tmp_path: shutil.copyfile(path, tmp_path))
+
+    def download(self, name, path):
+        source = self._path(name)
+        if not os.path.exists(source):
+            raise FileNotFoundError(f"{name} is not in local storage")
+        shutil.copyfile(source, path)
+
+    def public_url(self, name):
+        if self.public_base_url:
+            return f"{self.public_base_url}/{name}"
+        return pathlib.Path(self._path(name)).as_uri()
+
+    def collection(self, name):
+        return LocalCollection(self, name)
+
+    def batch(self):
+        return LocalBatch(self)
+
+    @staticmethod
+    def increment(value):
+        return LocalIncrement(value)
+
+    @property
+    def server_timestamp(self):
+        return _SERVER_TIMESTAMP
+
+    def _read(self, collection, doc_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM documents WHERE collection = ? AND id = ?", (collection, doc_id)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _scan(self, collection):
+        with self._lock:
+            rows = self._conn.execute("SELECT id, data FROM documents WHERE collection = ?", (collection,)).fetchall()
+        return [(doc_id, json.loads(data)) for doc_id, data in rows]
+
+    def _write(self, writes):
+        with self._lock:
+            with self._conn:
+                for document, data, merge in writes:
+                    current = {}
+                    if merge:
+                        row = self._conn.execute(
+                            "SELECT data FROM documents WHERE collection = ? AND id = ?",
+                            (document.collection, document.id)
+                        ).fetchone()
+                        current = json.loads(row[0]) if row else {}
+                    for field, value in data.items():
+                        if isinstance(value, LocalIncrement):
+                            value = current.get(field, 0) + value.value
+                        elif value is _SERVER_TIMESTAMP:
+                            value = time.time()
+                        current[field] = value
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO documents (collection, id, data) VALUES (?, ?, ?)",
+                        (document.collection, document.id, json.dumps(current, default=str))
+                    )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_storage(backend=STORAGE_BACKEND):
+    if backend == "firebase":
+        return FirebaseStorage.from_credentials()
+    if backend == "local":
+        return LocalStorage()
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,26 @@
+from conversations import ConversationStore
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_message_larger_than_the_budget_is_truncated_to_fit():
+    store = ConversationStore(count_words, max_prompt_tokens=50)
+    store.append("chat", "hello", "hi there")
+
+    prompt = store.build_prompt("chat", " ".join(f"word{i}" for i in range(200)))
+
+    assert count_words(prompt) <= 50
+    assert "User: word0 word1" in prompt
+    assert prompt.endswith("Assistant:")
+    assert "hello" not in prompt
+
+
+def test_history_is_kept_when_the_message_fits():
+    store = ConversationStore(count_words, max_prompt_tokens=50)
+    store.append("chat", "hello", "hi there")
+
+    prompt = store.build_prompt("chat", "how are you")
+
+    assert prompt == "User: hello\nAssistant:\nhi there\nUser: how are you\nAssistant:"
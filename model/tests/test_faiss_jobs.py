@@ -0,0 +1,51 @@
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from faiss_store import FaissIndexManager, FaissMetadataTable
+from jobs import JobQueue
+from storage_backends import LocalStorage
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_faiss_job_retried_after_a_failed_metadata_write_adds_one_entry(tmp_path):
+    storage = LocalStorage(str(tmp_path / "storage"))
+    index = FaissIndexManager(
+        storage, 8, index_file=str(tmp_path / "faiss.index"),
+        metadata=FaissMetadataTable(str(tmp_path / "faiss_metadata.db")),
+    )
+    index.load()
+    jobs = JobQueue(str(tmp_path / "jobs.db"), workers=1, retry_backoff=0)
+    failures = [RuntimeError("Firestore unavailable")]
+
+    # Same steps as app.add_to_faiss: index first, then the metadata document
+    @jobs.register("faiss")
+    def add_to_faiss(question, response):
+        vector = np.ones((1, 8), dtype=np.float32) / np.sqrt(8)
+        faiss_id = index.add(vector, question, response, "en")
+        if failures:
+            raise failures.pop()
+        doc_id = hashlib.sha1(question.encode("utf-8")).hexdigest()
+        storage.collection("faiss_metadata").document(doc_id).set({"question": question, "faiss_id": faiss_id})
+
+    jobs.start()
+    try:
+        jobs.enqueue("faiss", "How do I sleep better?", "Keep a regular schedule.")
+        wait_for(lambda: jobs.stats()["jobs"].get("faiss", {}).get("completed"))
+    finally:
+        jobs.close()
+
+    assert index.ntotal == 1
+    assert index.metadata.count() == 1
+    assert len(storage.collection("faiss_metadata").stream()) == 1
+    index.close()
+    storage.close()
+    assert os.path.exists(tmp_path / "faiss.index")
@@ -0,0 +1,24 @@
+import os
+
+from jobs import JOBS_SPOOL, JobQueue
+
+
+def test_spool_is_opened_on_start(tmp_path):
+    path = tmp_path / "spool" / "jobs.db"
+    jobs = JobQueue(str(path), workers=1)
+
+    @jobs.register("noop")
+    def noop():
+        pass
+
+    assert not path.exists()
+    assert jobs.stats()["jobs"]["noop"]["queued"] == 0
+    jobs.start()
+    try:
+        assert path.exists()
+    finally:
+        jobs.close()
+
+
+def test_default_spool_is_next_to_the_code():
+    assert os.path.dirname(JOBS_SPOOL) == os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
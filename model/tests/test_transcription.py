@@ -0,0 +1,42 @@
+import numpy as np
+
+from transcription import SAMPLE_RATE, vad_chunks
+
+
+def speech(seconds, seed=0):
+    """Noise with a syllable-rate envelope and no pauses, like continuous speech"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)
+    return (rng.standard_normal(len(t)) * 0.1 * envelope).astype(np.float32)
+
+
+def test_short_clip_is_not_split_or_filtered():
+    audio = speech(12)
+    assert vad_chunks(audio) == [(0, len(audio))]
+
+
+def test_constant_tone_is_kept():
+    t = np.arange(40 * SAMPLE_RATE) / SAMPLE_RATE
+    audio = (0.3 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+    chunks = vad_chunks(audio)
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(audio)
+
+
+def test_continuous_speech_without_pauses_is_split_into_windows():
+    audio = speech(75)
+    chunks = vad_chunks(audio, max_seconds=30, min_seconds=10)
+    assert len(chunks) >= 3
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(audio)
+    assert all(end - start <= 30 * SAMPLE_RATE for start, end in chunks)
+    assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+
+
+def test_silent_chunk_is_dropped_but_never_all_of_them():
+    audio = np.concatenate([speech(25), np.zeros(35 * SAMPLE_RATE, dtype=np.float32)])
+    chunks = vad_chunks(audio, max_seconds=30, min_seconds=10)
+    assert chunks and chunks[0][0] == 0
+    assert chunks[-1][1] <= 30 * SAMPLE_RATE
+
+    silence = np.zeros(60 * SAMPLE_RATE, dtype=np.float32)
+    assert vad_chunks(silence) == [(0, len(silence))]
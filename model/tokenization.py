@@ -0,0 +1,49 @@
+import os
+
+from caching import LRUCache
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+
+
+def normalize_text(text):
+    """Collapse whitespace so trivially different messages share cache entries"""
+    return " ".join(text.split())
+
+
+class CachedTokenizer:
+    """
+    Batch tokenization through a Hugging Face fast (Rust) tokenizer with an
+    LRU of recently seen normalised messages mapped to their token IDs.
+
+    Only cache misses are sent to the tokenizer, all in one batch call.
+    """
+
+    def __init__(self, tokenizer, max_length=512, cache_size=TOKEN_CACHE_SIZE):
+        if not getattr(tokenizer, "is_fast", False):
+            print(f"Warning: {type(tokenizer).__name__} is not a fast tokenizer; batch tokenization will be slow")
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.cache = LRUCache(cache_size)
+
+    @property
+    def pad_token_id(self):
+        return self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else 0
+
+    def encode(self, texts):
+        """Return a list of token ID lists, one per (already normalised) text"""
+        sequences = [self.cache.get(text) for text in texts]
+
+        missing = sorted({text for text, ids in zip(texts, sequences) if ids is None})
+        if missing:
+            encoded = self.tokenizer(missing, truncation=True, max_length=self.max_length)["input_ids"]
+            new = {}
+            for text, ids in zip(missing, encoded):
+                ids = tuple(ids)
+                new[text] = ids
+                self.cache.put(text, ids)
+            sequences = [ids if ids is not None else new[text] for text, ids in zip(texts, sequences)]
+
+        return sequences
+
+    def stats(self):
+        return self.cache.stats()
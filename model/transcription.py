@@ -0,0 +1,306 @@
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+WHISPER_TIERS = ("tiny", "base", "small", "medium", "large")
+SAMPLE_RATE = 16000
+
+# "openai" runs the reference openai-whisper models; "faster" runs the same
+# checkpoints through CTranslate2 (faster-whisper), int8-quantized by default.
+WHISPER_BACKEND = os.getenv("WHISPER_BACKEND", "openai").lower()
+WHISPER_DEFAULT_TIER = os.getenv("WHISPER_DEFAULT_TIER", "large").lower()
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+WHISPER_CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", "0"))
+# Optional tier selection by audio duration, e.g. "30:large,120:medium,small":
+# clips up to 30s use large, up to 120s medium, anything longer small.
+WHISPER_AUTO_TIERS = os.getenv("WHISPER_AUTO_TIERS", "")
+
+# Streaming transcription cuts audio at pauses into chunks of at most
+# WHISPER_CHUNK_SECONDS (Whisper's own window is 30s) and, with the faster
+# backend, transcribes up to WHISPER_PARALLEL_CHUNKS of them at once.
+WHISPER_CHUNK_SECONDS = float(os.getenv("WHISPER_CHUNK_SECONDS", "30"))
+WHISPER_MIN_CHUNK_SECONDS = float(os.getenv("WHISPER_MIN_CHUNK_SECONDS", "10"))
+WHISPER_VAD_MIN_SILENCE_MS = int(os.getenv("WHISPER_VAD_MIN_SILENCE_MS", "300"))
+# Frames below this RMS level (about -40 dBFS) count as silence
+WHISPER_VAD_SILENCE_RMS = float(os.getenv("WHISPER_VAD_SILENCE_RMS", "0.01"))
+WHISPER_PARALLEL_CHUNKS = int(os.getenv("WHISPER_PARALLEL_CHUNKS", "2"))
+
+# faster-whisper names the current large checkpoint explicitly
+FASTER_WHISPER_NAMES = {"large": "large-v3"}
+
+
+def parse_auto_tiers(value):
+    """Parse "30:large,120:medium,small" into [(30.0, "large"), (120.0, "medium"), (inf, "small")]"""
+    rules = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if ":" in part:
+            limit, tier = part.split(":", 1)
+            rules.append((float(limit), tier.strip().lower()))
+        else:
+            rules.append((float("inf"), part.lower()))
+    for _, tier in rules:
+        if tier not in WHISPER_TIERS:
+            raise ValueError(f"Unknown Whisper tier: {tier}")
+    return sorted(rules)
+
+
+class AudioDecodeError(Exception):
+    """Raised when uploaded bytes cannot be decoded as audio"""
+
+
+def _run_ffmpeg_decode(source, data, sample_rate):
+    import ffmpeg
+
+    try:
+        out, _ = (
+            ffmpeg.input(source, threads=0)
+            .output("pipe:1", format="s16le", acodec="pcm_s16le", ac=1, ar=sample_rate)
+            .run(cmd=["ffmpeg", "-nostdin"], input=data, capture_stdout=True, capture_stderr=True)
+        )
+    except ffmpeg.Error as e:
+        raise AudioDecodeError(e.stderr.decode(errors="replace").strip()) from e
+    return out
+
+
+def decode_audio(data, sample_rate=SAMPLE_RATE):
+    """
+    Decode encoded audio bytes (webm, mp3, wav, ...) into a mono float32 array
+    by piping them through ffmpeg, the same way Whisper reads files.
+
+    Containers that need a seekable input (e.g. MP4/M4A with the index at the
+    end) cannot be read from a pipe; those fall back to a private temp file.
+    """
+    if not data:
+        raise AudioDecodeError("Audio file is empty")
+    try:
+        out = _run_ffmpeg_decode("pipe:0", data, sample_rate)
+    except AudioDecodeError:
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            out = _run_ffmpeg_decode(f.name, None, sample_rate)
+    if not out:
+        raise AudioDecodeError("Audio file contains no audio")
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+
+def audio_duration(audio):
+    """Duration in seconds of a 16 kHz float array or an audio file"""
+    if isinstance(audio, np.ndarray):
+        return len(audio) / SAMPLE_RATE
+    import ffmpeg
+
+    return float(ffmpeg.probe(audio)["format"]["duration"])
+
+
+def vad_chunks(audio, max_seconds=WHISPER_CHUNK_SECONDS, min_seconds=WHISPER_MIN_CHUNK_SECONDS,
+               min_silence_ms=WHISPER_VAD_MIN_SILENCE_MS, silence_rms=WHISPER_VAD_SILENCE_RMS, frame_ms=30):
+    """
+    Split a 16 kHz array into (start, end) sample ranges no longer than
+    `max_seconds`, cut in the middle of pauses.
+
+    Audio of `max_seconds` or less is returned whole. Frames with an RMS
+    energy above `silence_rms` are speech. Each cut is the last pause of at
+    least `min_silence_ms` between `min_seconds` and `max_seconds` into the
+    chunk, or the quietest frame there if there is none. Chunks without any
+    speech are dropped, unless that would drop them all.
+    """
+    if len(audio) <= max_seconds * SAMPLE_RATE:
+        return [(0, len(audio))] if len(audio) else []
+
+    frame = SAMPLE_RATE * frame_ms // 1000
+    n_frames = len(audio) // frame
+    energy = np.sqrt(np.mean(audio[:n_frames * frame].reshape(n_frames, frame) ** 2, axis=1))
+    speech = energy > silence_rms
+
+    # Midpoints of long enough silent runs are candidate cut points
+    min_run = max(1, min_silence_ms // frame_ms)
+    cuts = []
+    run_start = None
+    for i, is_speech in enumerate(np.append(speech, True)):
+        if not is_speech and run_start is None:
+            run_start = i
+        elif is_speech and run_start is not None:
+            if i - run_start >= min_run:
+                cuts.append((run_start + i) // 2)
+            run_start = None
+
+    max_frames = max(2, int(max_seconds * 1000 / frame_ms))
+    min_frames = min(max_frames - 1, int(min_seconds * 1000 / frame_ms))
+    chunks = []
+    start = 0
+    while n_frames - start > max_frames:
+        window = [cut for cut in cuts if start + min_frames <= cut <= start + max_frames]
+        if window:
+            end = window[-1]
+        else:
+            end = start + min_frames + int(np.argmin(energy[start + min_frames:start + max_frames]))
+        chunks.append((start, end))
+        start = end
+    chunks.append((start, n_frames))
+
+    voiced = [
+        (start * frame, end * frame if end < n_frames else len(audio))
+        for start, end in chunks
+        if speech[start:end].any()
+    ]
+    # Quiet recordings may have no frame above the floor; let Whisper decide
+    return voiced or [(0, len(audio))]
+
+
+class OpenAIWhisperBackend:
+    # The PyTorch model installs decoding hooks on itself, so one call at a time
+    parallel = 1
+
+    def __init__(self, tier):
+        import whisper
+
+        self.model = whisper.load_model(tier)
+
+    def transcribe(self, audio, **kwargs):
+        return self.model.transcribe(audio, **kwargs)
+
+
+class FasterWhisperBackend:
+    parallel = WHISPER_PARALLEL_CHUNKS
+
+    def __init__(self, tier):
+        from faster_whisper import WhisperModel
+
+        self.model = WhisperModel(
+            FASTER_WHISPER_NAMES.get(tier, tier),
+            device="cpu",
+            compute_type=WHISPER_COMPUTE_TYPE,
+            cpu_threads=WHISPER_CPU_THREADS,
+            num_workers=max(1, self.parallel),
+        )
+
+    def transcribe(self, audio, **kwargs):
+        segments, info = self.model.transcribe(audio, **kwargs)
+        segments = [
+            {"start": segment.start, "end": segment.end, "text": segment.text}
+            for segment in segments
+        ]
+        # Same shape as openai-whisper's result
+        return {
+            "text": "".join(segment["text"] for segment in segments),
+            "language": info.language,
+            "segments": segments,
+        }
+
+
+BACKENDS = {
+    "openai": OpenAIWhisperBackend,
+    "faster": FasterWhisperBackend,
+}
+
+
+class Transcriber:
+    """
+    Speech-to-text across Whisper size tiers behind one interface.
+
+    A tier can be requested per call; otherwise it is chosen from the audio
+    duration (`WHISPER_AUTO_TIERS`) or falls back to the default tier. Each
+    tier's model is loaded on first use and kept.
+    """
+
+    def __init__(self, backend=WHISPER_BACKEND, default_tier=WHISPER_DEFAULT_TIER,
+                 auto_tiers=WHISPER_AUTO_TIERS):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown Whisper backend: {backend}")
+        if default_tier not in WHISPER_TIERS:
+            raise ValueError(f"Unknown Whisper tier: {default_tier}")
+
+        self.backend = backend
+        self.default_tier = default_tier
+        self.auto_tiers = parse_auto_tiers(auto_tiers)
+
+        self._models = {}
+        self._locks = {tier: threading.Lock() for tier in WHISPER_TIERS}
+
+    def model(self, tier):
+        """Return the backend model for `tier`, loading it if needed"""
+        if tier not in WHISPER_TIERS:
+            raise ValueError(f"Unknown Whisper tier: {tier}")
+        if tier not in self._models:
+            with self._locks[tier]:
+                if tier not in self._models:
+                    print(f"Loading Whisper {tier} ({self.backend} backend)")
+                    self._models[tier] = BACKENDS[self.backend](tier)
+        return self._models[tier]
+
+    def select_tier(self, audio, tier=None):
+        if tier:
+            return tier.lower()
+        if self.auto_tiers:
+            duration = audio_duration(audio)
+            for limit, rule_tier in self.auto_tiers:
+                if duration <= limit:
+                    return rule_tier
+        return self.default_tier
+
+    def transcribe(self, audio, tier=None, **kwargs):
+        """
+        Transcribe a file path or 16 kHz float32 array.
+
+        Returns a dict with "text", "language" and "segments", like openai-whisper.
+        """
+        tier = self.select_tier(audio, tier)
+        return self.model(tier).transcribe(audio, **kwargs)
+
+    def stream(self, audio, tier=None, **kwargs):
+        """
+        Transcribe a 16 kHz float32 array chunk by chunk (see `vad_chunks`),
+        yielding each chunk's result in order as soon as it is ready.
+
+        Each result has "index", "chunks" (the total), "start" and "end" in
+        seconds, "text", "language" and "segments" with clip-relative times.
+        The language detected on the first chunk is used for the rest.
+        """
+        tier = self.select_tier(audio, tier)
+        model = self.model(tier)
+        chunks = vad_chunks(audio)
+
+        def run(index):
+            start, end = chunks[index]
+            result = model.transcribe(audio[start:end], **kwargs)
+            offset = start / SAMPLE_RATE
+            return {
+                "index": index,
+                "chunks": len(chunks),
+                "start": offset,
+                "end": end / SAMPLE_RATE,
+                "text": result["text"].strip(),
+                "language": result["language"],
+                "segments": [
+                    dict(segment, start=segment["start"] + offset, end=segment["end"] + offset)
+                    for segment in result["segments"]
+                ],
+            }
+
+        if not chunks:
+            return
+        first = run(0)
+        yield first
+        kwargs.setdefault("language", first["language"])
+
+        if model.parallel <= 1:
+            for index in range(1, len(chunks)):
+                yield run(index)
+            return
+
+        with ThreadPoolExecutor(max_workers=model.parallel, thread_name_prefix="whisper-chunk") as pool:
+            futures = [pool.submit(run, index) for index in range(1, len(chunks))]
+            try:
+                for future in futures:
+                    yield future.result()
+            finally:
+                # The consumer stopped early; skip the chunks not started yet
+                for future in futures:
+                    future.cancel()
@@ -0,0 +1,175 @@
+import os
+import threading
+
+from caching import LRUCache
+from tokenization import normalize_text
+
+# "google" (googletrans, needs the network), "marian" (Helsinki-NLP MarianMT
+# models run locally) or "auto": MarianMT, falling back to Google Translate
+# for language pairs without a local model
+TRANSLATION_BACKEND = os.getenv("TRANSLATION_BACKEND", "google").lower()
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "4096"))
+TRANSLATION_CACHE_TTL = float(os.getenv("TRANSLATION_CACHE_TTL", "86400"))
+MARIAN_MODEL_TEMPLATE = os.getenv("MARIAN_MODEL_TEMPLATE", "Helsinki-NLP/opus-mt-{src}-{dest}")
+
+
+class GoogleTranslateBackend:
+    name = "google"
+
+    def __init__(self):
+        from googletrans import Translator
+
+        self.translator = Translator()
+
+    def translate_batch(self, texts, src, dest):
+        # Single-line texts are joined into one request and split again;
+        # googletrans keeps line breaks, so this costs one round trip
+        if len(texts) > 1 and not any("\n" in text for text in texts):
+            try:
+                joined = self.translator.translate("\n".join(texts), src=src, dest=dest).text
+            except Exception as e:
+                # One bad joined request should not fail every item in the batch
+                print(f"Joined translation of {len(texts)} texts failed ({e}); translating them one by one")
+            else:
+                lines = joined.split("\n")
+                if len(lines) == len(texts):
+                    return [line.strip() for line in lines]
+        return [self.translator.translate(text, src=src, dest=dest).text for text in texts]
+
+
+class MarianBackend:
+    """Offline translation with one MarianMT model per language pair, loaded on first use"""
+
+    name = "marian"
+
+    def __init__(self, template=MARIAN_MODEL_TEMPLATE, max_length=512):
+        self.template = template
+        self.max_length = max_length
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _model(self, src, dest):
+        pair = (src, dest)
+        with self._lock:
+            if pair not in self._models:
+                from transformers import MarianMTModel, MarianTokenizer
+
+                name = self.template.format(src=src, dest=dest)
+                print(f"Loading translation model {name}")
+                self._models[pair] = (MarianTokenizer.from_pretrained(name), MarianMTModel.from_pretrained(name).eval())
+            return self._models[pair]
+
+    def translate_batch(self, texts, src, dest):
+        import torch
+
+        tokenizer, model = self._model(src, dest)
+        inputs = tokenizer(texts, return_tensors="pt", padding=True, truncation=True, max_length=self.max_length)
+        with torch.inference_mode():
+            outputs = model.generate(**inputs, max_length=self.max_length)
+        return tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+
+class TranslationService:
+    """
+    Translation and language detection behind LRU/TTL caches.
+
+    `translate_many` takes (text, src, dest) items, answers repeated ones from
+    the cache and sends the rest to the backend in one batch per language pair.
+    Backends are tried in order, so a later one is the fallback.
+    """
+
+    def __init__(self, backend=TRANSLATION_BACKEND, cache_size=TRANSLATION_CACHE_SIZE, ttl=TRANSLATION_CACHE_TTL):
+        if backend not in ("google", "marian", "auto"):
+            raise ValueError(f"Unknown translation backend: {backend}")
+        self.backend_names = {"google": ["google"], "marian": ["marian"], "auto": ["marian", "google"]}[backend]
+        self.cache = LRUCache(cache_size, ttl=ttl)
+        self.language_cache = LRUCache(cache_size, ttl=ttl)
+        self._backends = {}
+        self._lock = threading.Lock()
+        self._detect = None
+        self._detect_lock = threading.Lock()
+
+    def _backend(self, name):
+        with self._lock:
+            if name not in self._backends:
+                self._backends[name] = GoogleTranslateBackend() if name == "google" else MarianBackend()
+            return self._backends[name]
+
+    def _translate_pair(self, texts, src, dest):
+        error = None
+        for name in self.backend_names:
+            try:
+                return self._backend(name).translate_batch(texts, src, dest)
+            except Exception as e:
+                print(f"Translation backend '{name}' failed for {src}->{dest}: {e}")
+                error = e
+        raise error
+
+    def cached(self, text, src, dest):
+        """Return the cached translation, or None"""
+        key = normalize_text(text)
+        if src == dest or not key:
+            return text
+        return self.cache.get((key, src, dest))
+
+    def translate_many(self, items):
+        """Translate (text, src, dest) items, returning one translation per item"""
+        # Only the cache key is normalised; the backend gets the text as
+        # written, so line breaks and paragraphs survive translation
+        keys = [(normalize_text(text), src, dest) for text, src, dest in items]
+        results = [
+            text if src == dest or not key[0] else self.cache.get(key)
+            for (text, src, dest), key in zip(items, keys)
+        ]
+
+        pairs = {}
+        for (text, src, dest), key, result in zip(items, keys, results):
+            if result is None:
+                pairs.setdefault((src, dest), {}).setdefault(key[0], text)
+        if not pairs:
+            return results
+
+        translated = {}
+        for (src, dest), texts in pairs.items():
+            key_texts = sorted(texts)
+            for key_text, translation in zip(key_texts, self._translate_pair([texts[k] for k in key_texts], src, dest)):
+                translated[(key_text, src, dest)] = translation
+                self.cache.put((key_text, src, dest), translation)
+
+        return [result if result is not None else translated[key] for key, result in zip(keys, results)]
+
+    def translate(self, text, src, dest):
+        return self.translate_many([(text, src, dest)])[0]
+
+    def load_language_profiles(self):
+        """Load langdetect's language profiles; its lazy global load is not thread-safe"""
+        with self._detect_lock:
+            if self._detect is None:
+                from langdetect import DetectorFactory, detect
+                from langdetect.detector_factory import init_factory
+
+                init_factory()
+                # Deterministic results, so cached and fresh detections agree
+                DetectorFactory.seed = 0
+                self._detect = detect
+            return self._detect
+
+    def detect_language(self, text):
+        """Detect the language of `text` with langdetect, cached per normalised text; "en" if undetectable"""
+        from langdetect.lang_detect_exception import LangDetectException
+
+        detect = self._detect or self.load_language_profiles()
+        text = normalize_text(text)
+        language = self.language_cache.get(text)
+        if language is None:
+            try:
+                language = detect(text)
+            except LangDetectException as e:
+                # Blank, numeric or emoji-only text has no features to detect
+                print(f"Language detection failed ({e}); assuming English")
+                language = "en"
+            self.language_cache.put(text, language)
+        return language
+
+    def stats(self):
+        return {"translations": self.cache.stats(), "languages": self.language_cache.stats()}
@@ -0,0 +1,355 @@
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import wave
+
+from tokenization import normalize_text
+
+# Relative paths are resolved against this directory, not the working directory
+TTS_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.getenv("TTS_CACHE_DIR", "audio_responses"))
+TTS_CACHE_MAX_MB = float(os.getenv("TTS_CACHE_MAX_MB", "256"))
+# "gtts" (Google Translate's TTS, needs the network), "local" (pyttsx3, fully
+# offline) or "auto": gTTS, falling back to the local engine when it fails
+TTS_ENGINE = os.getenv("TTS_ENGINE", "auto").lower()
+TTS_VOICE = os.getenv("TTS_VOICE", "default")
+# Replies are synthesised sentence by sentence; shorter sentences are merged
+# with the next one so each synthesis call is worth its round trip
+TTS_MIN_SENTENCE_CHARS = int(os.getenv("TTS_MIN_SENTENCE_CHARS", "40"))
+
+SENTENCE_END = re.compile(r"(?<=[.!?…。！？])\s+")
+
+
+def speech_key(text, lang, voice=TTS_VOICE):
+    """Content address of the speech for (text, language, voice)"""
+    return hashlib.sha256(f"{voice}\0{lang}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class SentenceSplitter:
+    """Cuts streamed text (e.g. LLM tokens) into sentences of at least `min_chars`"""
+
+    def __init__(self, min_chars=TTS_MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text):
+        """Add streamed text and return the sentences it completed"""
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self._buffer):
+            sentence = self._buffer[start:match.start()].strip()
+            # A short sentence stays in the buffer and is sent with the next one
+            if len(sentence) >= self.min_chars:
+                sentences.append(sentence)
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        """Return the text left after the last complete sentence"""
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest else []
+
+
+def split_sentences(text, min_chars=TTS_MIN_SENTENCE_CHARS):
+    splitter = SentenceSplitter(min_chars)
+    return splitter.feed(text + " ") + splitter.flush()
+
+
+def join_audio(parts, content_type):
+    """Play `parts` back to back: WAV frames are concatenated under one header, MP3 frames as they are"""
+    if content_type != "audio/wav":
+        return b"".join(parts)
+    output = io.BytesIO()
+    with wave.open(output, "wb") as joined:
+        for index, part in enumerate(parts):
+            with wave.open(io.BytesIO(part), "rb") as f:
+                if index == 0:
+                    joined.setparams(f.getparams())
+                joined.writeframes(f.readframes(f.getnframes()))
+    return output.getvalue()
+
+
+class JoinedAudio:
+    """Stands in for the engine when audio joined from sentences is cached"""
+
+    name = "joined"
+
+    def __init__(self, extension, content_type):
+        self.extension = extension
+        self.content_type = content_type
+
+
+class GTTSEngine:
+    name = "gtts"
+    extension = "mp3"
+    content_type = "audio/mpeg"
+
+    def synthesize(self, text, lang, voice):
+        from gtts import gTTS
+
+        buffer = io.BytesIO()
+        gTTS(text, lang=lang).write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+class LocalTTSEngine:
+    """Offline synthesis with pyttsx3 (eSpeak on Linux, SAPI5 on Windows, NSSpeech on macOS)"""
+
+    name = "local"
+    extension = "wav"
+    content_type = "audio/wav"
+
+    def __init__(self):
+        self._engine = None
+        # pyttsx3 drives a single native engine that is not thread-safe
+        self._lock = threading.Lock()
+
+    def _select_voice(self, lang, voice):
+        voices = self._engine.getProperty("voices")
+        for candidate in voices:
+            if voice != "default" and voice in (candidate.id, candidate.name):
+                return candidate.id
+        for candidate in voices:
+            languages = [
+                language.decode(errors="ignore") if isinstance(language, bytes) else str(language)
+                for language in getattr(candidate, "languages", [])
+            ]
+            if any(lang.lower() in language.lower() for language in languages) or f"/{lang}" in candidate.id:
+                return candidate.id
+        return None
+
+    def synthesize(self, text, lang, voice):
+        with self._lock:
+            if self._engine is None:
+                import pyttsx3
+
+                self._engine = pyttsx3.init()
+            voice_id = self._select_voice(lang, voice)
+            if voice_id:
+                self._engine.setProperty("voice", voice_id)
+
+            fd, path = tempfile.mkstemp(suffix=".wav")
+            os.close(fd)
+            try:
+                self._engine.save_to_file(text, path)
+                self._engine.runAndWait()
+                with open(path, "rb") as f:
+                    return f.read()
+            finally:
+                os.remove(path)
+
+
+class SpeechCache:
+    """
+    Content-addressed store of synthesised speech on local disk.
+
+    Files are named by `speech_key`; a SQLite index in the same directory keeps
+    their size, last use and, once uploaded, their public URL. The least
+    recently used files are evicted when the total exceeds `max_bytes`.
+    The directory and index are created by `open()`.
+    """
+
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=int(TTS_CACHE_MAX_MB * 1024 * 1024)):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def open(self):
+        with self._lock:
+            if self._conn is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.directory, "index.db"), check_same_thread=False)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS speech (
+                    key TEXT PRIMARY KEY,
+                    file_name TEXT NOT NULL,
+                    content_type TEXT NOT NULL,
+                    engine TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    url TEXT,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            self._conn.commit()
+
+    def path(self, entry):
+        return os.path.join(self.directory, entry["file_name"])
+
+    def get(self, key):
+        """Return the cached entry for `key` (and mark it used), or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_name, content_type, engine, url FROM speech WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and not os.path.exists(os.path.join(self.directory, row[0])):
+                self._conn.execute("DELETE FROM speech WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE speech SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return {"key": key, "file_name": row[0], "content_type": row[1], "engine": row[2], "url": row[3]}
+
+    def read(self, entry):
+        with open(self.path(entry), "rb") as f:
+            return f.read()
+
+    def put(self, key, data, engine):
+        """Store synthesised audio under `key` and return its entry"""
+        entry = {
+            "key": key,
+            "file_name": f"{key}.{engine.extension}",
+            "content_type": engine.content_type,
+            "engine": engine.name,
+            "url": None,
+        }
+        # Write to a temp file first so readers never see a partial file
+        tmp_path = f"{self.path(entry)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path(entry))
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO speech (key, file_name, content_type, engine, size, url, last_used) "
+                "VALUES (?, ?, ?, ?, ?, NULL, ?)",
+                (key, entry["file_name"], engine.content_type, engine.name, len(data), time.time()),
+            )
+            self._conn.commit()
+            self._evict()
+        return entry
+
+    def set_url(self, key, url):
+        with self._lock:
+            self._conn.execute("UPDATE speech SET url = ? WHERE key = ?", (url, key))
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM speech").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, file_name, size in self._conn.execute(
+            "SELECT key, file_name, size FROM speech ORDER BY last_used"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, file_name))
+            except FileNotFoundError:
+                pass
+            self._conn.execute("DELETE FROM speech WHERE key = ?", (key,))
+            total -= size
+        self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, total = (0, 0) if self._conn is None else self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM speech"
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class TextToSpeech:
+    """
+    Text-to-speech through a `SpeechCache`: repeated replies (e.g. answers
+    served from the FAQ/Faiss cache) are neither synthesised nor uploaded again.
+    """
+
+    def __init__(self, cache=None, engine=TTS_ENGINE, voice=TTS_VOICE):
+        if engine not in ("gtts", "local", "auto"):
+            raise ValueError(f"Unknown TTS engine: {engine}")
+        self.cache = cache or SpeechCache()
+        self.voice = voice
+        self.engines = {
+            "gtts": [GTTSEngine()],
+            "local": [LocalTTSEngine()],
+            "auto": [GTTSEngine(), LocalTTSEngine()],
+        }[engine]
+
+    def _synthesize(self, text, lang):
+        error = None
+        for engine in self.engines:
+            try:
+                return engine.synthesize(text, lang, self.voice), engine
+            except Exception as e:
+                print(f"TTS engine '{engine.name}' failed: {e}")
+                error = e
+        raise error
+
+    def entry(self, text, lang="en"):
+        """Return the cache entry for the speech of `text`, synthesising it on a miss"""
+        key = speech_key(text, lang, self.voice)
+        entry = self.cache.get(key)
+        if entry is None:
+            data, engine = self._synthesize(text, lang)
+            entry = self.cache.put(key, data, engine)
+        return entry
+
+    def audio(self, text, lang="en"):
+        """Return (audio bytes, content type)"""
+        entry = self.entry(text, lang)
+        return self.cache.read(entry), entry["content_type"]
+
+    def path(self, text, lang="en"):
+        """Return the local path of the cached audio"""
+        return self.cache.path(self.entry(text, lang))
+
+    def url(self, text, lang, upload, prefix=""):
+        """
+        Return a public URL for the speech, calling
+        `upload(data, file_name, content_type)` only the first time.
+        """
+        entry = self.entry(text, lang)
+        if entry["url"]:
+            return entry["url"]
+        url = upload(self.cache.read(entry), prefix + entry["file_name"], entry["content_type"])
+        self.cache.set_url(entry["key"], url)
+        return url
+
+    def joined_entry(self, sentences, lang):
+        """
+        Cache entry for the speech of `sentences` played back to back.
+
+        Each sentence is synthesised and cached on its own (usually already done
+        while the reply was being generated). The joined audio is cached under
+        the whole text, so a repeated reply is neither joined nor uploaded again.
+        """
+        text = " ".join(sentences)
+        entry = self.cache.get(speech_key(text, lang, self.voice))
+        if entry is None:
+            parts = [self.entry(sentence, lang) for sentence in sentences]
+            content_types = {part["content_type"] for part in parts}
+            if len(content_types) > 1:
+                # Engines fell back mid-reply; the formats cannot be joined
+                return self.entry(text, lang)
+            content_type = content_types.pop()
+            extension = parts[0]["file_name"].rsplit(".", 1)[-1]
+            data = join_audio([self.cache.read(part) for part in parts], content_type)
+            entry = self.cache.put(speech_key(text, lang, self.voice), data, JoinedAudio(extension, content_type))
+        return entry
+
+    def stats(self):
+        return self.cache.stats()
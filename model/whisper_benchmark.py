@@ -0,0 +1,113 @@
+"""
+Real-time factor and word error rate of each Whisper tier and backend.
+
+Every clip in the samples directory (wav/mp3/webm/...) needs a reference
+transcript next to it with the same name and a .txt extension. The reference
+sentences below can be synthesised into clips once with --generate (needs
+gTTS and network access):
+
+    python whisper_benchmark.py --generate
+    python whisper_benchmark.py --tiers tiny,base,small --backends openai,faster
+
+RTF is transcription time divided by audio duration (below 1.0 is faster
+than real time).
+"""
+import argparse
+import os
+import re
+import time
+
+from transcription import WHISPER_TIERS, BACKENDS, audio_duration
+
+SAMPLE_SENTENCES = [
+    "I have been feeling anxious before every exam this semester.",
+    "Can you suggest a breathing exercise that helps me fall asleep?",
+    "My friends say I seem distant lately and I do not know how to explain it.",
+    "Today was actually a good day, I went for a long walk and felt calmer.",
+    "How do I talk to my parents about going to therapy?",
+]
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".webm", ".ogg", ".m4a", ".flac")
+
+
+def generate_samples(directory):
+    from gtts import gTTS
+
+    os.makedirs(directory, exist_ok=True)
+    for i, sentence in enumerate(SAMPLE_SENTENCES):
+        base = os.path.join(directory, f"sample_{i:02d}")
+        gTTS(sentence, lang="en").save(base + ".mp3")
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(sentence)
+    print(f"Wrote {len(SAMPLE_SENTENCES)} clips to {directory}")
+
+
+def load_samples(directory):
+    samples = []
+    for name in sorted(os.listdir(directory)):
+        base, extension = os.path.splitext(name)
+        reference_path = os.path.join(directory, base + ".txt")
+        if extension.lower() in AUDIO_EXTENSIONS and os.path.exists(reference_path):
+            with open(reference_path, encoding="utf-8") as f:
+                samples.append((os.path.join(directory, name), f.read().strip()))
+    return samples
+
+
+def normalize_words(text):
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+
+def word_error_rate(reference, hypothesis):
+    """Word-level Levenshtein distance divided by the reference length"""
+    ref, hyp = normalize_words(reference), normalize_words(hypothesis)
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hyp, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word),
+            ))
+        previous = current
+    return previous[-1] / max(1, len(ref))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", default="audio_samples", help="Directory of clips and .txt references")
+    parser.add_argument("--tiers", default=",".join(WHISPER_TIERS))
+    parser.add_argument("--backends", default="openai,faster")
+    parser.add_argument("--generate", action="store_true", help="Synthesise the sample clips with gTTS first")
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_samples(args.samples)
+
+    samples = load_samples(args.samples)
+    if not samples:
+        raise SystemExit(f"No clips with .txt references found in {args.samples} (try --generate)")
+    total_audio = sum(audio_duration(path) for path, _ in samples)
+    print(f"{len(samples)} clips, {total_audio:.1f}s of audio")
+
+    print(f"{'backend':>8} {'tier':>7} {'load_s':>7} {'RTF':>6} {'WER':>6}")
+    for backend in args.backends.split(","):
+        for tier in args.tiers.split(","):
+            start = time.perf_counter()
+            model = BACKENDS[backend](tier)
+            load_seconds = time.perf_counter() - start
+
+            # Warm up so one-off initialisation is not counted
+            model.transcribe(samples[0][0])
+
+            errors = []
+            start = time.perf_counter()
+            for path, reference in samples:
+                errors.append(word_error_rate(reference, model.transcribe(path)["text"]))
+            rtf = (time.perf_counter() - start) / total_audio
+
+            print(f"{backend:>8} {tier:>7} {load_seconds:>7.1f} {rtf:>6.3f} {sum(errors) / len(errors):>6.3f}")
+            del model
+
+
+if __name__ == "__main__":
+    main()
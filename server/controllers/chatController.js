@@ -27,6 +27,8 @@ export const generateResponse = async (req, res) => {
             fastApiResponse = await axios.post("http://localhost:8000/chat/", {
                 message: userMessage,
                 response_type: responseType,
+                user_id: userId,
+                chat_id: chatCategoryId,
             });
         } catch (error) {
             console.error("FastAPI Error:", error.response ? error.response.data : error.message);